@@ -8,6 +8,12 @@ A safety app for women traveling alone
 import os
 os.environ['GEVENT_SUPPORT'] = 'True'
 
+# Message queue clients (e.g. redis) use blocking sockets; patch them to cooperate with gevent.
+# This must run before anything else is imported, so it reads the environment directly.
+if os.environ.get('SOCKETIO_MESSAGE_QUEUE') and not os.environ['SOCKETIO_MESSAGE_QUEUE'].startswith('local://'):
+    from gevent import monkey
+    monkey.patch_all()
+
 from flask import Flask, render_template, request, jsonify, session
 from flask_socketio import emit, join_room, leave_room
 import secrets
@@ -28,13 +34,28 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 # Initialize extensions with the app
 db.init_app(app)
-socketio.init_app(app, cors_allowed_origins="*")
+
+# With a message queue, emits to rooms reach clients connected to any worker process
+from config import active_config
+from services.socketio_queue import message_queue_options
+socketio.init_app(app, cors_allowed_origins="*",
+                  **message_queue_options(active_config.SOCKETIO_MESSAGE_QUEUE, active_config.SOCKETIO_CHANNEL))
 
 # Import models after initializing db
 from models.user import User
 from models.emergency_contact import EmergencyContact
 from models.location_history import LocationHistory
 from models.safety_alert import SafetyAlert
+from models.location_segment import LocationSegment
+from models.movement_segment import MovementSegment, SegmentationCheckpoint
+from models.geofence import Geofence
+from models.alert_heatmap import AlertHeatmapCell
+from models.tracking_session import TrackingSession
+from models.job_lease import JobLease
+
+# Keep the alert heatmap aggregate updated as alerts are written
+from services.heatmap_service import HeatmapService
+HeatmapService.register_listeners()
 
 # Import routes
 from routes.auth import auth_bp
@@ -43,6 +64,10 @@ from routes.emergency import emergency_bp
 from routes.location import location_bp
 from routes.safety import safety_bp
 
+# Register CLI maintenance commands
+from commands import register_commands, check_schema
+register_commands(app)
+
 # Register blueprints
 app.register_blueprint(auth_bp)
 app.register_blueprint(map_bp)
@@ -85,6 +110,10 @@ def server_error(e):
 def handle_connect():
     """Handle client connection to WebSocket"""
     print('Client connected')
+    
+    # Logged-in clients receive their own events (e.g. geofence enter/exit)
+    if 'user_id' in session:
+        join_room(f"user_{session['user_id']}")
 
 @socketio.on('disconnect')
 def handle_disconnect():
@@ -113,11 +142,65 @@ def handle_location_update(data):
 def create_tables():
     """Create database tables before first request"""
     db.create_all()
+    
+    # create_all does not alter existing tables; refuse to serve a database that predates the models
+    check_schema()
+    
+    # Background jobs start with the first request, so `flask` CLI commands do not run them
+    start_background_jobs()
+
+def start_background_jobs():
+    """Start the periodic background greenlets of this worker process"""
+    # Opt-in write-behind buffer for location inserts
+    from services.location_service import location_write_buffer
+    if active_config.LOCATION_WRITE_BEHIND:
+        location_write_buffer.init_app(
+            app,
+            queue_size=active_config.LOCATION_WRITE_BEHIND_QUEUE_SIZE,
+            batch_size=active_config.LOCATION_WRITE_BEHIND_BATCH_SIZE,
+            flush_interval_ms=active_config.LOCATION_WRITE_BEHIND_FLUSH_MS,
+            max_retries=active_config.LOCATION_WRITE_BEHIND_MAX_RETRIES,
+            retry_backoff_ms=active_config.LOCATION_WRITE_BEHIND_RETRY_BACKOFF_MS
+        )
+    
+    # Push changed recommendations to users sharing their location (one worker at a time, by lease)
+    from services.recommendation_push import recommendation_pusher
+    if active_config.RECOMMENDATION_PUSH:
+        recommendation_pusher.init_app(
+            app,
+            interval_seconds=active_config.RECOMMENDATION_PUSH_INTERVAL_SECONDS,
+            batch_size=active_config.RECOMMENDATION_PUSH_BATCH_SIZE,
+            recent_seconds=active_config.RECOMMENDATION_PUSH_RECENT_FIX_SECONDS
+        )
+    
+    # Detect stays and trips for users with new fixes, off the request path
+    from services.segmentation_service import segmentation_worker
+    segmentation_worker.init_app(
+        app,
+        interval_seconds=active_config.SEGMENTATION_INTERVAL_SECONDS,
+        users_per_tick=active_config.SEGMENTATION_USERS_PER_TICK
+    )
+    
+    # Parse offline country/timezone boundaries off the request path (lookups fall back until ready)
+    from services.location_service import reverse_geocoder
+    reverse_geocoder.start_loading()
+    
+    # Remove expired location sharing sessions in expiry order
+    from services.tracking_sessions import tracking_session_sweeper
+    tracking_session_sweeper.init_app(app, max_interval_seconds=active_config.TRACKING_SESSION_SWEEP_MAX_INTERVAL_SECONDS)
 
 if __name__ == '__main__':
     # Ensure gevent support is enabled
     if os.environ.get('GEVENT_SUPPORT') != 'True':
         os.environ['GEVENT_SUPPORT'] = 'True'
+    
+    # Fail fast with upgrade instructions instead of erroring on every request
+    with app.app_context():
+        try:
+            db.create_all()
+            check_schema()
+        except RuntimeError as e:
+            raise SystemExit(f"Error: {str(e)}")
         
     # Run with gevent as the async mode
     socketio.run(app, debug=True, host='0.0.0.0', port=5000)
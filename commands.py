@@ -0,0 +1,215 @@
+"""
+Command line maintenance tasks for the Swiss Knife for Women application
+Run with `flask <command>` (FLASK_APP=app.py)
+"""
+
+import io
+import json
+import os
+import zipfile
+import click
+from extensions import db
+from models.user import User
+from models.location_history import LocationHistory
+
+def missing_columns():
+    """(table, column) pairs defined on the models but absent from existing database tables"""
+    inspector = db.inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    missing = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        missing.extend((table, column) for column in table.columns if column.name not in existing)
+    return missing
+
+def check_schema():
+    """Raise RuntimeError when the database predates the models; `flask upgrade-db` fixes it"""
+    missing = missing_columns()
+    if missing:
+        names = ', '.join(f'{table.name}.{column.name}' for table, column in missing)
+        raise RuntimeError(f'Database schema is out of date (missing {names}); run `flask upgrade-db`')
+
+def add_missing_columns():
+    """Add nullable columns that exist on the models but not in the database"""
+    added = []
+    for table, column in missing_columns():
+        if not column.nullable or column.primary_key:
+            continue
+        column_type = column.type.compile(dialect=db.engine.dialect)
+        with db.engine.begin() as connection:
+            connection.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+        added.append(f'{table.name}.{column.name}')
+    return added
+
+def register_commands(app):
+    """Register maintenance commands on the Flask CLI"""
+
+    @app.cli.command('upgrade-db')
+    def upgrade_db():
+        """Create missing tables, columns and indexes on an existing database"""
+        db.create_all()
+
+        # create_all skips columns and indexes on tables that already exist
+        for name in add_missing_columns():
+            click.echo(f'Added column {name}')
+
+        created = 0
+        for table in db.metadata.sorted_tables:
+            existing = {index['name'] for index in db.inspect(db.engine).get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(db.engine)
+                    click.echo(f'Created index {index.name}')
+                    created += 1
+
+        click.echo(f'Done: {created} indexes created')
+
+    @app.cli.command('compact-location-history')
+    @click.option('--user-id', type=int, default=None, help='Only compact this user')
+    @click.option('--delete-rows', is_flag=True, help='Delete LocationHistory rows once packed')
+    def compact_location_history(user_id, delete_rows):
+        """Pack LocationHistory rows into encoded location segments"""
+        from services.track_service import TrackSegmentService
+
+        db.create_all()
+
+        if user_id is not None:
+            user_ids = [user_id]
+        else:
+            user_ids = [row[0] for row in db.session.query(LocationHistory.user_id).distinct()]
+
+        total = 0
+        for uid in user_ids:
+            migrated = TrackSegmentService.compact_user_rows(uid, delete_rows=delete_rows)
+            click.echo(f'User {uid}: {migrated} fixes packed')
+            total += migrated
+
+        click.echo(f'Done: {total} fixes packed for {len(user_ids)} users')
+
+    @app.cli.command('segment-history')
+    @click.option('--user-id', type=int, default=None, help='Only segment this user')
+    def segment_history(user_id):
+        """Detect stays and trips in location history newer than each user's checkpoint"""
+        from services.segmentation_service import SegmentationService
+
+        db.create_all()
+
+        if user_id is not None:
+            user_ids = [user_id]
+        else:
+            user_ids = [row[0] for row in db.session.query(User.id)]
+
+        total = 0
+        for uid in user_ids:
+            total += SegmentationService.process_user(uid)
+
+        click.echo(f'Done: {total} fixes segmented for {len(user_ids)} users')
+
+    @app.cli.command('backfill-geohash')
+    @click.option('--batch-size', type=int, default=5000, help='Rows updated per transaction')
+    def backfill_geohash(batch_size):
+        """Compute geohash keys for location history and alerts stored before they existed"""
+        from models.safety_alert import SafetyAlert
+        from utils.geohash import encode_or_none
+        from config import active_config
+
+        db.create_all()
+        for name in add_missing_columns():
+            click.echo(f'Added column {name}')
+
+        for model in (LocationHistory, SafetyAlert):
+            updated = 0
+            last_id = 0
+            while True:
+                rows = db.session.query(model.id, model.latitude, model.longitude) \
+                    .filter(model.id > last_id, model.geohash.is_(None), model.latitude.isnot(None)) \
+                    .order_by(model.id).limit(batch_size).all()
+                if not rows:
+                    break
+
+                mappings = [{
+                    'id': row.id,
+                    'geohash': encode_or_none(row.latitude, row.longitude, active_config.GEOHASH_PRECISION)
+                } for row in rows]
+                db.session.bulk_update_mappings(model, mappings)
+                db.session.commit()
+
+                updated += len(rows)
+                last_id = rows[-1].id
+
+            # Build the index after the backfill so it is written once
+            existing = {index['name'] for index in db.inspect(db.engine).get_indexes(model.__tablename__)}
+            for index in model.__table__.indexes:
+                if index.name not in existing:
+                    index.create(db.engine)
+                    click.echo(f'Created index {index.name}')
+
+            click.echo(f'{model.__tablename__}: {updated} rows backfilled')
+
+    @app.cli.command('rebuild-alert-heatmap')
+    def rebuild_alert_heatmap():
+        """Recompute the safety alert heatmap from all alerts"""
+        from services.heatmap_service import HeatmapService
+
+        db.create_all()
+        counted = HeatmapService.rebuild()
+        click.echo(f'Done: {counted} alerts aggregated')
+
+    @app.cli.command('import-pois')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--append', is_flag=True, help='Keep places from earlier imports')
+    @click.option('--bbox', default=None, help='Extract bounds as min_lat,min_lon,max_lat,max_lon')
+    def import_pois(path, append, bbox):
+        """Load police, hospital and shelter POIs from an OSM extract (.json or .pbf) into the offline store"""
+        from services.location_service import poi_store
+        from services.poi_store import read_osm_json, read_osm_pbf
+
+        bounds = None
+        if bbox:
+            min_lat, min_lon, max_lat, max_lon = (float(value) for value in bbox.split(','))
+            bounds = (min_lat, max_lat, min_lon, max_lon)
+
+        places = read_osm_pbf(path) if path.endswith('.pbf') else read_osm_json(path)
+        count = poi_store.import_places(places, source=path, replace=not append, bounds=bounds)
+        click.echo(f'Done: {count} places imported into {poi_store.path}')
+
+    @app.cli.command('fetch-boundaries')
+    @click.option('--countries-source', default=None, help='URL or path of country boundaries (GeoJSON, optionally zipped)')
+    @click.option('--timezones-source', default=None, help='URL or path of timezone boundaries (GeoJSON, optionally zipped)')
+    @click.option('--tolerance', type=float, default=0.01, help='Simplification tolerance in degrees (~1 km)')
+    def fetch_boundaries(countries_source, timezones_source, tolerance):
+        """Download and simplify country and timezone boundaries for the offline reverse geocoder"""
+        import requests
+        from config import active_config
+        from services.reverse_geocoder import simplify_boundaries
+
+        def read_source(source):
+            if os.path.exists(source):
+                with open(source, 'rb') as f:
+                    content = f.read()
+            else:
+                click.echo(f'Downloading {source}')
+                response = requests.get(source, timeout=(10, 300))
+                response.raise_for_status()
+                content = response.content
+            if zipfile.is_zipfile(io.BytesIO(content)):
+                with zipfile.ZipFile(io.BytesIO(content)) as archive:
+                    name = next(name for name in archive.namelist() if name.endswith(('.json', '.geojson')))
+                    content = archive.read(name)
+            return json.loads(content)
+
+        targets = (
+            (countries_source or active_config.REVERSE_GEOCODER_COUNTRIES_SOURCE,
+             active_config.REVERSE_GEOCODER_COUNTRIES_PATH, ('ISO_A2_EH', 'ISO_A2', 'iso_a2'), 'ISO_A2'),
+            (timezones_source or active_config.REVERSE_GEOCODER_TIMEZONES_SOURCE,
+             active_config.REVERSE_GEOCODER_TIMEZONES_PATH, ('tzid', 'TZID'), 'tzid')
+        )
+        for source, path, properties, output_property in targets:
+            data = simplify_boundaries(read_source(source), properties, output_property, tolerance=tolerance)
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, separators=(',', ':'))
+            click.echo(f'Wrote {len(data["features"])} boundaries to {path} ({os.path.getsize(path) // 1024} KiB)')
@@ -12,6 +12,11 @@ load_dotenv()
 if os.environ.get('GEVENT_SUPPORT') != 'True':
     os.environ['GEVENT_SUPPORT'] = 'True'
 
+def _env_seconds(name, default=None):
+    """Duration in seconds from the environment; unset or empty gives default (None: no expiry)"""
+    value = os.environ.get(name)
+    return float(value) if value else default
+
 class Config:
     """Base configuration class"""
     SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-key-for-development-only')
@@ -26,16 +31,139 @@ class Config:
     
     # Geolocation API configuration
     GEOAPIFY_API_KEY = os.environ.get('GEOAPIFY_API_KEY', '')
+    GEOAPIFY_REVERSE_URL = os.environ.get('GEOAPIFY_REVERSE_URL', 'https://api.geoapify.com/v1/geocode/reverse')
+    # Offline reverse geocoding from GeoJSON boundaries (e.g. Natural Earth admin 0 countries,
+    # timezone-boundary-builder); when a file is missing that lookup falls back or defaults to UTC
+    REVERSE_GEOCODER_COUNTRIES_PATH = os.environ.get('REVERSE_GEOCODER_COUNTRIES_PATH', 'data/countries.geojson')
+    REVERSE_GEOCODER_TIMEZONES_PATH = os.environ.get('REVERSE_GEOCODER_TIMEZONES_PATH', 'data/timezones.geojson')
+    # Downloaded and simplified into the paths above by `flask fetch-boundaries`
+    REVERSE_GEOCODER_COUNTRIES_SOURCE = os.environ.get(
+        'REVERSE_GEOCODER_COUNTRIES_SOURCE',
+        'https://raw.githubusercontent.com/nvkelso/natural-earth-vector/master/geojson/ne_10m_admin_0_countries.geojson'
+    )
+    REVERSE_GEOCODER_TIMEZONES_SOURCE = os.environ.get(
+        'REVERSE_GEOCODER_TIMEZONES_SOURCE',
+        'https://github.com/evansiroky/timezone-boundary-builder/releases/latest/download/timezones.geojson.zip'
+    )
+    REVERSE_GEOCODER_MEMO_PRECISION = 6  # Geohash cell memoized when entirely inside one boundary
+    REVERSE_GEOCODER_MEMO_SIZE = 50000
+    
+    OVERPASS_API_URL = os.environ.get('OVERPASS_API_URL', 'https://overpass-api.de/api/interpreter')
+    OVERPASS_QUERY_TIMEOUT_SECONDS = 8  # Server-side query limit; the read timeout allows 2 s more
+    
+    # Outbound HTTP client (per upstream: connection pool, timeouts, concurrency, circuit breaker)
+    HTTP_CONNECT_TIMEOUT_SECONDS = 3.05
+    HTTP_READ_TIMEOUT_SECONDS = 5
+    HTTP_MAX_CONCURRENCY_PER_UPSTREAM = 10  # Also the keep-alive pool size
+    HTTP_ACQUIRE_TIMEOUT_SECONDS = 2        # Wait this long for a free slot before failing
+    HTTP_CIRCUIT_FAILURE_THRESHOLD = 5      # Consecutive failures that open the circuit
+    HTTP_CIRCUIT_RESET_SECONDS = 30         # Time open before a trial request is let through
+    
+    # Nearby places backend: 'overpass' (live API), 'local' (offline POI store) or 'local_then_overpass'
+    PLACES_BACKEND = os.environ.get('PLACES_BACKEND', 'overpass')
+    POI_DATABASE_PATH = os.environ.get('POI_DATABASE_PATH', 'pois.db')
+    NEARBY_PLACES_CACHE_PRECISION = 6            # Geohash cell (~1.2 x 0.6 km) sharing one cached lookup
+    NEARBY_PLACES_CACHE_MIN_RADIUS_METERS = 2000 # Smallest radius fetched per cell (answers smaller queries)
+    NEARBY_PLACES_CACHE_SIZE = 5000
+    NEARBY_PLACES_CACHE_TTL_SECONDS = 3600
+    GEO_LOOKUP_COALESCE_TIMEOUT_SECONDS = 30  # Max wait on another request's in-flight lookup
+    
+    # Place types ranked by /safety/safe-areas (k-nearest search)
+    SAFE_PLACE_TYPES = ('police', 'hospital', 'fire_station', 'shelter', 'pharmacy')
+    SAFE_PLACES_DEFAULT_K = 10
+    SAFE_PLACES_MAX_K = 50
+    SAFE_PLACES_MAX_RADIUS_METERS = 5000   # Largest search circle
     
     # Application settings
     MAX_EMERGENCY_CONTACTS = 5
     LOCATION_HISTORY_RETENTION_DAYS = 7
+    LOCATION_HISTORY_STORAGE = os.environ.get('LOCATION_HISTORY_STORAGE', 'rows')  # 'rows', 'segments' or 'both'
+    LOCATION_SEGMENT_WINDOW_MINUTES = 60  # Time span packed into one encoded segment
+    EXPORT_CHUNK_SIZE = 1000  # Fixes read per query when streaming exports
+    PAGINATION_MAX_LIMIT = 100  # Largest page for location history and alert listings
+    LOCATION_BATCH_MAX_SIZE = 100  # Max fixes accepted per /map/save-locations request
+    LOCATION_MAX_CLOCK_SKEW_SECONDS = 300  # Reject client timestamps this far in the future
+    
+    # Write-behind group commit for location inserts (opt-in)
+    LOCATION_WRITE_BEHIND = os.environ.get('LOCATION_WRITE_BEHIND', 'false').lower() == 'true'
+    LOCATION_WRITE_BEHIND_QUEUE_SIZE = 10000  # Max rows held in memory before rejecting
+    LOCATION_WRITE_BEHIND_BATCH_SIZE = 500    # Flush once this many rows are queued
+    LOCATION_WRITE_BEHIND_FLUSH_MS = 200      # ...or after this many milliseconds
+    LOCATION_WRITE_BEHIND_MAX_RETRIES = 5     # Failed flushes retried before the rows are dropped
+    LOCATION_WRITE_BEHIND_RETRY_BACKOFF_MS = 200  # First retry delay, doubled per retry (max 5 s)
+    
+    # Last-known-position cache (per process, LRU)
+    LAST_KNOWN_POSITION_CACHE_SIZE = 10000
+    # Per-process caches: with multiple workers, set a TTL (e.g. 5) so fixes ingested elsewhere are re-read
+    LAST_KNOWN_POSITION_CACHE_TTL_SECONDS = _env_seconds('LAST_KNOWN_POSITION_CACHE_TTL_SECONDS')
+    
+    # Per-user movement state (rolling speed/heading over the last few fixes)
+    MOVEMENT_STATE_WINDOW = 5                       # Fixes considered for heading changes
+    MOVEMENT_STATE_MIN_HEADING_DISTANCE_METERS = 5  # Ignore headings over smaller moves (GPS jitter)
+    MOVEMENT_STATE_CACHE_SIZE = 10000
+    MOVEMENT_STATE_CACHE_TTL_SECONDS = _env_seconds('MOVEMENT_STATE_CACHE_TTL_SECONDS')
+    
+    # Dead-band filter for redundant fixes from stationary devices
+    LOCATION_DEADBAND_ENABLED = os.environ.get('LOCATION_DEADBAND_ENABLED', 'true').lower() == 'true'
+    LOCATION_DEADBAND_WINDOW_SECONDS = 30     # Only drop fixes arriving this soon after the previous one
+    LOCATION_DEADBAND_HEARTBEAT_SECONDS = 60  # Always store at least one fix per interval
+    LOCATION_DEADBAND_MIN_RADIUS_METERS = 10  # Floor for the previous fix's accuracy radius
+    LOCATION_DEADBAND_MAX_RADIUS_METERS = 100 # Cap so a poor fix cannot swallow real movement
     SOS_AUDIO_MAX_DURATION_SECONDS = 30
     
+    # Stay-point / trip segmentation
+    SEGMENTATION_STAY_RADIUS_METERS = 100  # Fixes within this radius of an anchor belong to one stop
+    SEGMENTATION_STAY_MIN_SECONDS = 300    # Minimum time within the radius to count as a stay
+    SEGMENTATION_INTERVAL_SECONDS = 30     # Background worker tick (segments lag fixes by up to this)
+    SEGMENTATION_USERS_PER_TICK = 100      # Users with new fixes processed per tick; the rest wait
+    SEGMENTATION_CLAIM_SECONDS = 300       # A crashed run's claim on a user expires after this
+    
+    # Geohash spatial keys on LocationHistory and SafetyAlert
+    GEOHASH_PRECISION = 9        # ~5 m cells; shorter prefixes give coarser cells
+    GEOHASH_QUERY_MAX_CELLS = 16 # Max prefix range scans per area query
+    
+    # Safety alert heatmap aggregate
+    HEATMAP_ZOOM_LEVELS = (6, 9, 12, 15)            # Tile zoom levels kept per alert
+    HEATMAP_HOUR_BUCKET_SIZE = 3                    # Hours per time-of-day bucket (UTC)
+    HEATMAP_MAX_CELLS = 4096                        # Coarser level used when a viewport needs more
+    HEATMAP_EXCLUDED_ALERT_TYPES = ('geofence',)    # Personal events, not safety reports
+    
+    # Geofences (per-user circles/polygons evaluated on every fix)
+    MAX_GEOFENCES = 20
+    GEOFENCE_MAX_VERTICES = 100
+    GEOFENCE_MAX_RADIUS_METERS = 50000
+    GEOFENCE_EXIT_MARGIN_METERS = 20    # Must be this far outside before an exit fires
+    GEOFENCE_GRID_CELL_DEGREES = 0.01   # ~1.1 km grid cells for the per-user index
+    GEOFENCE_GRID_MAX_CELLS = 2500      # Larger fences are tested on every fix instead
+    GEOFENCE_INDEX_CACHE_SIZE = 10000
+    GEOFENCE_INDEX_CACHE_TTL_SECONDS = _env_seconds('GEOFENCE_INDEX_CACHE_TTL_SECONDS', 30)
+    
     # Safety thresholds
+    FAST_MOVEMENT_SPEED_MPS = 20        # 72 km/h, likely in a vehicle
+    ERRATIC_HEADING_CHANGE_DEGREES = 90
     NIGHT_START_HOUR = 22  # 10 PM
     NIGHT_END_HOUR = 6     # 6 AM
     ISOLATED_AREA_THRESHOLD_METERS = 500  # Distance from populated areas
+    
+    # Computed recommendations, reused per user while hour, location cell and behavior are unchanged
+    RECOMMENDATION_CACHE_PRECISION = 7      # Geohash cell (~150 m) sharing one result
+    RECOMMENDATION_CACHE_SIZE = 10000
+    RECOMMENDATION_CACHE_TTL_SECONDS = 600  # Bounds staleness of nearby-place results
+    
+    # Background push of recommendations to users sharing their location
+    RECOMMENDATION_PUSH = os.environ.get('RECOMMENDATION_PUSH', 'true').lower() == 'true'
+    RECOMMENDATION_PUSH_INTERVAL_SECONDS = 60
+    RECOMMENDATION_PUSH_BATCH_SIZE = 200          # Users evaluated per tick; the rest wait for later ticks
+    RECOMMENDATION_PUSH_RECENT_FIX_SECONDS = 600  # Only users with a fix this recent
+    
+    # Location sharing sessions: 'sql' (application database), 'redis' or 'local' (in-process stand-in)
+    TRACKING_SESSION_BACKEND = os.environ.get('TRACKING_SESSION_BACKEND', 'sql')
+    TRACKING_SESSION_REDIS_URL = os.environ.get('TRACKING_SESSION_REDIS_URL', 'redis://localhost:6379/0')
+    TRACKING_SESSION_SWEEP_MAX_INTERVAL_SECONDS = 60  # Sweeper also wakes at the next expiry
+    
+    # Socket.IO message queue shared by worker processes (e.g. redis://localhost:6379/1; local:// for tests)
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+    SOCKETIO_CHANNEL = os.environ.get('SOCKETIO_CHANNEL', 'swiss-knife')
 
 class DevelopmentConfig(Config):
     """Development configuration"""
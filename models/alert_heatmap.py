@@ -0,0 +1,29 @@
+"""
+Alert Heatmap model for precomputed safety alert counts per map cell
+"""
+
+from datetime import datetime
+from extensions import db
+
+class AlertHeatmapCell(db.Model):
+    """Number of alerts in one map tile for a severity and time-of-day bucket"""
+    __tablename__ = 'alert_heatmap_cells'
+
+    id = db.Column(db.Integer, primary_key=True)
+    zoom = db.Column(db.Integer, nullable=False)  # Web Mercator (slippy map) tile zoom level
+    x = db.Column(db.Integer, nullable=False)
+    y = db.Column(db.Integer, nullable=False)
+    severity = db.Column(db.String(20), nullable=False)
+    hour_bucket = db.Column(db.Integer, nullable=False)  # created_at hour (UTC) // HEATMAP_HOUR_BUCKET_SIZE
+    count = db.Column(db.Integer, nullable=False, default=0)
+    latitude_sum = db.Column(db.Float, nullable=False, default=0.0)  # For the cell's alert centroid
+    longitude_sum = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # One row per cell/severity/bucket; also serves viewport range scans on (zoom, x, y)
+        db.UniqueConstraint('zoom', 'x', 'y', 'severity', 'hour_bucket', name='uq_alert_heatmap_cell'),
+    )
+
+    def __repr__(self):
+        return f'<AlertHeatmapCell z{self.zoom}/{self.x}/{self.y} {self.severity} h{self.hour_bucket}: {self.count}>'
@@ -0,0 +1,84 @@
+"""
+Geofence model for user-defined circular and polygonal areas
+"""
+
+import json
+from datetime import datetime
+from extensions import db
+
+class Geofence(db.Model):
+    """User-defined area that triggers enter/exit events"""
+    __tablename__ = 'geofences'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    name = db.Column(db.String(64), nullable=False)
+    shape = db.Column(db.String(10), nullable=False)  # 'circle' or 'polygon'
+    latitude = db.Column(db.Float)   # Circle center
+    longitude = db.Column(db.Float)
+    radius = db.Column(db.Float)     # Circle radius in meters
+    polygon = db.Column(db.Text)     # JSON list of [latitude, longitude] vertices
+    min_latitude = db.Column(db.Float, nullable=False)  # Bounding box for the spatial index
+    max_latitude = db.Column(db.Float, nullable=False)
+    min_longitude = db.Column(db.Float, nullable=False)
+    max_longitude = db.Column(db.Float, nullable=False)
+    notify_on_enter = db.Column(db.Boolean, default=True)
+    notify_on_exit = db.Column(db.Boolean, default=True)
+    is_active = db.Column(db.Boolean, default=True)
+    is_inside = db.Column(db.Boolean)  # Last evaluated membership (None until first fix)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __init__(self, user_id, name, shape, latitude=None, longitude=None, radius=None, polygon=None,
+                 notify_on_enter=True, notify_on_exit=True):
+        self.user_id = user_id
+        self.name = name
+        self.shape = shape
+        self.latitude = latitude
+        self.longitude = longitude
+        self.radius = radius
+        self.polygon = json.dumps(polygon) if polygon is not None else None
+        self.notify_on_enter = notify_on_enter
+        self.notify_on_exit = notify_on_exit
+        self.is_active = True
+        self.update_bounds()
+
+    @property
+    def vertices(self):
+        """Polygon vertices as a list of (latitude, longitude) tuples"""
+        return [tuple(vertex) for vertex in json.loads(self.polygon)] if self.polygon else []
+
+    def update_bounds(self):
+        """Recompute the bounding box from the shape"""
+        if self.shape == 'circle':
+            # 1 degree of latitude is ~111 km; widen longitude by latitude
+            from math import cos, radians
+            dlat = self.radius / 111320.0
+            dlon = self.radius / (111320.0 * max(cos(radians(self.latitude)), 0.01))
+            self.min_latitude, self.max_latitude = self.latitude - dlat, self.latitude + dlat
+            self.min_longitude, self.max_longitude = self.longitude - dlon, self.longitude + dlon
+        else:
+            vertices = self.vertices
+            self.min_latitude = min(v[0] for v in vertices)
+            self.max_latitude = max(v[0] for v in vertices)
+            self.min_longitude = min(v[1] for v in vertices)
+            self.max_longitude = max(v[1] for v in vertices)
+
+    def to_dict(self):
+        """Convert geofence object to dictionary (for API responses)"""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'shape': self.shape,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'radius': self.radius,
+            'polygon': [list(v) for v in self.vertices] if self.shape == 'polygon' else None,
+            'notify_on_enter': self.notify_on_enter,
+            'notify_on_exit': self.notify_on_exit,
+            'is_active': self.is_active,
+            'is_inside': self.is_inside
+        }
+
+    def __repr__(self):
+        return f'<Geofence {self.name} ({self.shape}) for User {self.user_id}>'
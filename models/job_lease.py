@@ -0,0 +1,16 @@
+"""
+Job lease model for background jobs that must run in one process at a time
+"""
+
+from extensions import db
+
+class JobLease(db.Model):
+    """Time-limited claim on a named background job by one worker process"""
+    __tablename__ = 'job_leases'
+
+    name = db.Column(db.String(64), primary_key=True)
+    holder = db.Column(db.String(128), nullable=False)  # host:pid:token of the claiming process
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<JobLease {self.name} held by {self.holder} until {self.expires_at}>'
@@ -4,6 +4,8 @@ Location History model for storing user's location data
 
 from datetime import datetime
 from extensions import db
+from utils.geohash import encode_or_none
+from config import active_config
 
 class LocationHistory(db.Model):
     """Location History model for storing user's location data"""
@@ -20,9 +22,17 @@ class LocationHistory(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     ip_address = db.Column(db.String(45))  # IPv4 or IPv6 address
     device_info = db.Column(db.String(255))  # User agent or device identifier
+    geohash = db.Column(db.String(12))  # Spatial key; prefixes give coarser cells
+    
+    __table_args__ = (
+        # Serves latest-fix lookups and keyset pagination on (timestamp, id)
+        db.Index('ix_location_history_user_time', 'user_id', 'timestamp', 'id'),
+        # Serves area queries as geohash prefix range scans
+        db.Index('ix_location_history_geohash', 'geohash'),
+    )
     
     def __init__(self, user_id, latitude, longitude, accuracy=None, altitude=None, 
-                 speed=None, heading=None, ip_address=None, device_info=None):
+                 speed=None, heading=None, ip_address=None, device_info=None, timestamp=None):
         self.user_id = user_id
         self.latitude = latitude
         self.longitude = longitude
@@ -32,6 +42,9 @@ class LocationHistory(db.Model):
         self.heading = heading
         self.ip_address = ip_address
         self.device_info = device_info
+        self.geohash = encode_or_none(latitude, longitude, active_config.GEOHASH_PRECISION)
+        if timestamp is not None:
+            self.timestamp = timestamp
     
     def to_dict(self):
         """Convert location history object to dictionary (for API responses)"""
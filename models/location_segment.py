@@ -0,0 +1,57 @@
+"""
+Location Segment model for compact, per-time-window storage of location history
+"""
+
+from datetime import datetime
+from extensions import db
+from utils.track_encoding import to_millis, decode_points
+
+class LocationSegment(db.Model):
+    """Delta-encoded run of one user's fixes within a fixed time window"""
+    __tablename__ = 'location_segments'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    window_start = db.Column(db.DateTime, nullable=False)  # Start of the time bucket
+    start_time = db.Column(db.DateTime, nullable=False)    # First fix in the segment
+    end_time = db.Column(db.DateTime, nullable=False)      # Last fix in the segment
+    min_latitude = db.Column(db.Float, nullable=False)
+    max_latitude = db.Column(db.Float, nullable=False)
+    min_longitude = db.Column(db.Float, nullable=False)
+    max_longitude = db.Column(db.Float, nullable=False)
+    point_count = db.Column(db.Integer, nullable=False, default=0)
+    last_latitude_e6 = db.Column(db.Integer, nullable=False)   # Delta base for appends
+    last_longitude_e6 = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    version = db.Column(db.Integer, nullable=False)  # Optimistic lock for concurrent appends
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'window_start', name='uq_location_segments_user_window'),
+    )
+
+    __mapper_args__ = {'version_id_col': version}
+
+    def __init__(self, user_id, window_start):
+        self.user_id = user_id
+        self.window_start = window_start
+        self.point_count = 0
+        self.data = b''
+
+    def decode(self):
+        """Decode the segment into point dicts with datetime timestamps"""
+        return decode_points(self.data, to_millis(self.start_time))
+
+    def to_dict(self):
+        """Convert segment metadata to dictionary (for API responses)"""
+        return {
+            'id': self.id,
+            'start_time': self.start_time.isoformat() if self.start_time else None,
+            'end_time': self.end_time.isoformat() if self.end_time else None,
+            'bbox': [self.min_longitude, self.min_latitude, self.max_longitude, self.max_latitude],
+            'point_count': self.point_count,
+            'size_bytes': len(self.data) if self.data else 0
+        }
+
+    def __repr__(self):
+        return f'<LocationSegment user {self.user_id} {self.start_time}..{self.end_time} ({self.point_count} points)>'
@@ -0,0 +1,114 @@
+"""
+Movement Segment models for precomputed stay points and trips
+"""
+
+from datetime import datetime
+from extensions import db
+
+class MovementSegment(db.Model):
+    """A stay (user remained within a radius) or a trip (movement between stays)"""
+    __tablename__ = 'movement_segments'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    segment_type = db.Column(db.String(10), nullable=False)  # 'stay' or 'trip'
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False)
+    latitude = db.Column(db.Float)   # Stay centroid
+    longitude = db.Column(db.Float)
+    start_latitude = db.Column(db.Float)
+    start_longitude = db.Column(db.Float)
+    end_latitude = db.Column(db.Float)
+    end_longitude = db.Column(db.Float)
+    distance = db.Column(db.Float, default=0.0)  # Meters travelled (trips)
+    point_count = db.Column(db.Integer, default=0)
+    is_open = db.Column(db.Boolean, default=True)  # Still being extended by new fixes
+
+    __table_args__ = (
+        db.Index('ix_movement_segments_user_type_start', 'user_id', 'segment_type', 'start_time'),
+    )
+
+    def __init__(self, user_id, segment_type, start_time, latitude, longitude):
+        self.user_id = user_id
+        self.segment_type = segment_type
+        self.start_time = start_time
+        self.end_time = start_time
+        self.start_latitude = latitude
+        self.start_longitude = longitude
+        self.end_latitude = latitude
+        self.end_longitude = longitude
+        self.latitude = latitude if segment_type == 'stay' else None
+        self.longitude = longitude if segment_type == 'stay' else None
+        self.distance = 0.0
+        self.point_count = 1
+        self.is_open = True
+
+    @property
+    def duration_seconds(self):
+        """Length of the segment in seconds"""
+        return (self.end_time - self.start_time).total_seconds()
+
+    def to_dict(self):
+        """Convert movement segment object to dictionary (for API responses)"""
+        return {
+            'id': self.id,
+            'type': self.segment_type,
+            'start_time': self.start_time.isoformat() if self.start_time else None,
+            'end_time': self.end_time.isoformat() if self.end_time else None,
+            'duration_seconds': self.duration_seconds,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'start': {'latitude': self.start_latitude, 'longitude': self.start_longitude},
+            'end': {'latitude': self.end_latitude, 'longitude': self.end_longitude},
+            'distance': round(self.distance or 0.0, 1),
+            'point_count': self.point_count,
+            'is_open': self.is_open
+        }
+
+    def __repr__(self):
+        return f'<MovementSegment {self.segment_type} user {self.user_id} {self.start_time}..{self.end_time}>'
+
+class SegmentationCheckpoint(db.Model):
+    """Per-user progress of incremental segmentation"""
+    __tablename__ = 'segmentation_checkpoints'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    last_timestamp = db.Column(db.DateTime)  # Newest fix already processed
+    open_segment_id = db.Column(db.Integer, db.ForeignKey('movement_segments.id'))
+
+    # Set at ingest: new fixes are waiting, and the earliest one arriving at or before last_timestamp
+    pending = db.Column(db.Boolean, default=False)
+    rewind_from = db.Column(db.DateTime)
+
+    # Candidate stay while on a trip: anchor fix plus running sums of nearby fixes
+    anchor_latitude = db.Column(db.Float)
+    anchor_longitude = db.Column(db.Float)
+    anchor_time = db.Column(db.DateTime)
+    candidate_latitude_sum = db.Column(db.Float, default=0.0)
+    candidate_longitude_sum = db.Column(db.Float, default=0.0)
+    candidate_count = db.Column(db.Integer, default=0)
+
+    # Bumped by every ingest mark and segmentation save; a save only lands if nothing marked meanwhile
+    version = db.Column(db.Integer, default=0)
+
+    # Process running segmentation for this user (committed on its own, so ingest is never blocked)
+    claimed_by = db.Column(db.String(64))
+    claimed_until = db.Column(db.DateTime)
+
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # Serves the background worker's scan for users with new fixes
+        db.Index('ix_segmentation_checkpoints_pending', 'pending'),
+    )
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.pending = False
+        self.candidate_latitude_sum = 0.0
+        self.candidate_longitude_sum = 0.0
+        self.candidate_count = 0
+        self.version = 0
+
+    def __repr__(self):
+        return f'<SegmentationCheckpoint user {self.user_id} at {self.last_timestamp}>'
@@ -4,6 +4,8 @@ Safety Alert model for storing safety alerts and recommendations
 
 from datetime import datetime
 from extensions import db
+from utils.geohash import encode_or_none
+from config import active_config
 
 class SafetyAlert(db.Model):
     """Safety Alert model for storing safety alerts and recommendations"""
@@ -16,6 +18,7 @@ class SafetyAlert(db.Model):
     message = db.Column(db.Text, nullable=False)
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(12))  # Spatial key; prefixes give coarser cells
     is_resolved = db.Column(db.Boolean, default=False)
     resolved_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -24,6 +27,13 @@ class SafetyAlert(db.Model):
     audio_file_path = db.Column(db.String(255))
     contacts_notified = db.Column(db.Boolean, default=False)
     
+    __table_args__ = (
+        # Serves keyset pagination on (created_at, id)
+        db.Index('ix_safety_alerts_user_created', 'user_id', 'created_at', 'id'),
+        # Serves area queries as geohash prefix range scans
+        db.Index('ix_safety_alerts_geohash', 'geohash'),
+    )
+    
     def __init__(self, user_id, alert_type, severity, message, latitude=None, longitude=None, 
                  audio_file_path=None, contacts_notified=False):
         self.user_id = user_id
@@ -32,6 +42,7 @@ class SafetyAlert(db.Model):
         self.message = message
         self.latitude = latitude
         self.longitude = longitude
+        self.geohash = encode_or_none(latitude, longitude, active_config.GEOHASH_PRECISION)
         self.audio_file_path = audio_file_path
         self.contacts_notified = contacts_notified
     
@@ -0,0 +1,30 @@
+"""
+Tracking session model for location sharing links
+"""
+
+from datetime import datetime
+from extensions import db
+
+class TrackingSession(db.Model):
+    """Unexpired (or not yet swept) location sharing session"""
+    __tablename__ = 'tracking_sessions'
+
+    id = db.Column(db.String(64), primary_key=True)  # Tracking ID (also the Socket.IO room)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        # Serves per-user lookups of unexpired sessions
+        db.Index('ix_tracking_sessions_user_expires', 'user_id', 'expires_at'),
+        # Serves the expiry sweep and the next-expiry timer
+        db.Index('ix_tracking_sessions_expires', 'expires_at'),
+    )
+
+    def __init__(self, id, user_id, expires_at):
+        self.id = id
+        self.user_id = user_id
+        self.expires_at = expires_at
+
+    def __repr__(self):
+        return f'<TrackingSession {self.id} for User {self.user_id}>'
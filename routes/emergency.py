@@ -10,6 +10,7 @@ from extensions import db
 from models.user import User
 from models.emergency_contact import EmergencyContact
 from models.safety_alert import SafetyAlert
+from utils.pagination import encode_cursor, decode_cursor, seek_before, clamp_limit
 from config import active_config
 
 emergency_bp = Blueprint('emergency', __name__, url_prefix='/emergency')
@@ -199,8 +200,9 @@ def get_alerts():
     user_id = session['user_id']
     
     # Get query parameters
-    limit = request.args.get('limit', 10, type=int)
-    offset = request.args.get('offset', 0, type=int)
+    limit = clamp_limit(request.args.get('limit', type=int), active_config.PAGINATION_MAX_LIMIT)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    cursor = request.args.get('cursor')
     include_resolved = request.args.get('include_resolved', 'false').lower() == 'true'
     
     # Build query
@@ -209,13 +211,28 @@ def get_alerts():
     if not include_resolved:
         query = query.filter_by(is_resolved=False)
     
-    # Get alerts from database
-    alerts = query.order_by(SafetyAlert.created_at.desc()).limit(limit).offset(offset).all()
+    # Seek past the keyset cursor (takes precedence over offset)
+    if cursor:
+        try:
+            created_at, alert_id = decode_cursor(cursor)
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        query = query.filter(seek_before(SafetyAlert.created_at, SafetyAlert.id, created_at, alert_id))
+        offset = 0
+    
+    # Get alerts from database (one extra row tells us whether another page exists)
+    alerts = query.order_by(SafetyAlert.created_at.desc(), SafetyAlert.id.desc()) \
+        .limit(limit + 1).offset(offset).all()
+    
+    next_cursor = None
+    if len(alerts) > limit:
+        alerts = alerts[:limit]
+        next_cursor = encode_cursor(alerts[-1].created_at, alerts[-1].id)
     
     # Convert to dictionary
     alerts_dict = [alert.to_dict() for alert in alerts]
     
-    return jsonify({'alerts': alerts_dict}), 200
+    return jsonify({'alerts': alerts_dict, 'next_cursor': next_cursor}), 200
 
 @emergency_bp.route('/alerts/<int:alert_id>/resolve', methods=['POST'])
 def resolve_alert(alert_id):
@@ -10,12 +10,18 @@ from extensions import db
 from models.user import User
 from models.emergency_contact import EmergencyContact
 from models.location_history import LocationHistory
+from services.location_service import LocationService
+from services.tracking_sessions import tracking_sessions
 
 location_bp = Blueprint('location', __name__, url_prefix='/location')
 
-# Dictionary to store active tracking sessions
-# Format: {tracking_id: {'user_id': user_id, 'expires_at': datetime}}
-active_tracking_sessions = {}
+def get_user_tracking_ids(user_id):
+    """Tracking ids (Socket.IO rooms) of the user's unexpired sharing sessions"""
+    return [tracking_session.tracking_id for tracking_session in tracking_sessions.for_user(user_id)]
+
+def get_sharing_user_ids():
+    """IDs of users with at least one unexpired tracking session"""
+    return tracking_sessions.sharing_user_ids()
 
 @location_bp.route('/share', methods=['POST'])
 def share_location():
@@ -41,10 +47,7 @@ def share_location():
     expires_at = datetime.utcnow() + timedelta(hours=duration_hours)
     
     # Store tracking session
-    active_tracking_sessions[tracking_id] = {
-        'user_id': user_id,
-        'expires_at': expires_at
-    }
+    tracking_sessions.create(tracking_id, user_id, expires_at)
     
     # Generate tracking URL
     tracking_url = url_for('location.track_location', tracking_id=tracking_id, _external=True)
@@ -66,13 +69,14 @@ def share_location():
 def track_location(tracking_id):
     """Get tracking page for a specific tracking ID"""
     # Check if tracking ID exists and is valid
-    if tracking_id not in active_tracking_sessions:
+    tracking_session = tracking_sessions.get(tracking_id)
+    if tracking_session is None:
         return jsonify({'error': 'Invalid tracking ID'}), 404
     
-    # Check if tracking session has expired
-    if datetime.utcnow() > active_tracking_sessions[tracking_id]['expires_at']:
+    # Check if tracking session has expired (and not yet swept)
+    if tracking_session.is_expired():
         # Remove expired session
-        active_tracking_sessions.pop(tracking_id)
+        tracking_sessions.delete(tracking_id)
         return jsonify({'error': 'Tracking session has expired'}), 410
     
     # Return tracking page
@@ -82,17 +86,18 @@ def track_location(tracking_id):
 def get_tracking_status(tracking_id):
     """Get status of a tracking session"""
     # Check if tracking ID exists and is valid
-    if tracking_id not in active_tracking_sessions:
+    tracking_session = tracking_sessions.get(tracking_id)
+    if tracking_session is None:
         return jsonify({'error': 'Invalid tracking ID'}), 404
     
-    # Check if tracking session has expired
-    if datetime.utcnow() > active_tracking_sessions[tracking_id]['expires_at']:
+    # Check if tracking session has expired (and not yet swept)
+    if tracking_session.is_expired():
         # Remove expired session
-        active_tracking_sessions.pop(tracking_id)
+        tracking_sessions.delete(tracking_id)
         return jsonify({'error': 'Tracking session has expired'}), 410
     
     # Get user ID
-    user_id = active_tracking_sessions[tracking_id]['user_id']
+    user_id = tracking_session.user_id
     
     # Get user
     user = User.query.get(user_id)
@@ -100,8 +105,7 @@ def get_tracking_status(tracking_id):
         return jsonify({'error': 'User not found'}), 404
     
     # Get latest location
-    latest_location = LocationHistory.query.filter_by(user_id=user_id) \
-        .order_by(LocationHistory.timestamp.desc()).first()
+    latest_location = LocationService.get_latest_location(user_id)
     
     # Return tracking status
     return jsonify({
@@ -110,7 +114,7 @@ def get_tracking_status(tracking_id):
             'first_name': user.first_name,
             'last_name': user.last_name
         },
-        'expires_at': active_tracking_sessions[tracking_id]['expires_at'].isoformat(),
+        'expires_at': tracking_session.expires_at.isoformat(),
         'latest_location': latest_location.to_dict() if latest_location else None
     }), 200
 
@@ -124,15 +128,16 @@ def stop_sharing(tracking_id):
     user_id = session['user_id']
     
     # Check if tracking ID exists and is valid
-    if tracking_id not in active_tracking_sessions:
+    tracking_session = tracking_sessions.get(tracking_id)
+    if tracking_session is None:
         return jsonify({'error': 'Invalid tracking ID'}), 404
     
     # Check if user owns the tracking session
-    if active_tracking_sessions[tracking_id]['user_id'] != user_id:
+    if tracking_session.user_id != user_id:
         return jsonify({'error': 'Unauthorized'}), 403
     
     # Remove tracking session
-    active_tracking_sessions.pop(tracking_id)
+    tracking_sessions.delete(tracking_id)
     
     return jsonify({'message': 'Location sharing stopped successfully'}), 200
 
@@ -145,18 +150,14 @@ def get_active_sessions():
     
     user_id = session['user_id']
     
-    # Get current time
-    now = datetime.utcnow()
-    
-    # Filter active sessions for the user
+    # Look up the user's unexpired sessions through the per-user index
     user_sessions = []
-    for tracking_id, session_data in active_tracking_sessions.items():
-        if session_data['user_id'] == user_id and session_data['expires_at'] > now:
-            user_sessions.append({
-                'tracking_id': tracking_id,
-                'expires_at': session_data['expires_at'].isoformat(),
-                'tracking_url': url_for('location.track_location', tracking_id=tracking_id, _external=True)
-            })
+    for tracking_session in tracking_sessions.for_user(user_id):
+        user_sessions.append({
+            'tracking_id': tracking_session.tracking_id,
+            'expires_at': tracking_session.expires_at.isoformat(),
+            'tracking_url': url_for('location.track_location', tracking_id=tracking_session.tracking_id, _external=True)
+        })
     
     return jsonify({'active_sessions': user_sessions}), 200
 
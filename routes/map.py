@@ -2,11 +2,24 @@
 Map routes for the interactive safety map feature
 """
 
-from flask import Blueprint, request, jsonify, session
-import requests
+from flask import Blueprint, request, jsonify, session, Response, stream_with_context
+import json
+from datetime import datetime
 from extensions import db
 from models.user import User
 from models.location_history import LocationHistory
+from models.geofence import Geofence
+from services.location_service import (
+    LocationService, location_write_buffer, location_dead_band, last_known_positions, nearby_places_cache,
+    geo_lookups, overpass_client, geoapify_client
+)
+from services.export_service import ExportService, EXPORT_FORMATS
+from services.geofence_service import GeofenceService
+from services.poi_store import PLACE_TYPE_TAGS
+from services.segmentation_service import SegmentationService
+from services.track_service import TrackSegmentService
+from services.write_buffer import WriteBufferFull
+from utils.pagination import encode_cursor, decode_cursor, seek_before, clamp_limit
 from config import active_config
 
 map_bp = Blueprint('map', __name__, url_prefix='/map')
@@ -25,24 +38,121 @@ def save_location():
     if not data or 'latitude' not in data or 'longitude' not in data:
         return jsonify({'error': 'Invalid location data'}), 400
     
-    # Create new location history entry
-    location = LocationHistory(
-        user_id=user_id,
-        latitude=data['latitude'],
-        longitude=data['longitude'],
-        accuracy=data.get('accuracy'),
-        altitude=data.get('altitude'),
-        speed=data.get('speed'),
-        heading=data.get('heading'),
+    rows, errors = LocationService.build_location_rows(
+        user_id,
+        [data],
         ip_address=request.remote_addr,
         device_info=request.user_agent.string
     )
     
-    # Add location to database
-    db.session.add(location)
-    db.session.commit()
+    if errors:
+        return jsonify({'error': 'Invalid location data', 'details': errors[0]}), 400
     
-    return jsonify({'message': 'Location saved successfully', 'location_id': location.id}), 201
+    # Save location (or queue it when write-behind is enabled)
+    try:
+        result = LocationService.record_locations(rows)
+    except WriteBufferFull:
+        return jsonify({'error': 'Server busy, retry shortly'}), 503, {'Retry-After': '1'}
+    
+    if result['dropped']:
+        return jsonify({'message': 'Location unchanged, not stored', 'dropped': result['dropped']}), 200
+    
+    if result['queued']:
+        return jsonify({'message': 'Location queued successfully', 'queued': result['queued']}), 202
+    
+    location_id = result['location_ids'][0] if result['location_ids'] else None
+    
+    return jsonify({'message': 'Location saved successfully', 'location_id': location_id}), 201
+
+@map_bp.route('/save-locations', methods=['POST'])
+def save_locations():
+    """Save a batch of buffered location fixes in a single transaction"""
+    # Check if user is logged in
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    user_id = session['user_id']
+    data = request.json
+    
+    # Accept either a bare array of fixes or {"locations": [...]}
+    fixes = data.get('locations') if isinstance(data, dict) else data
+    
+    # Validate batch shape
+    if not isinstance(fixes, list) or not fixes:
+        return jsonify({'error': 'A non-empty list of locations is required'}), 400
+    
+    if len(fixes) > active_config.LOCATION_BATCH_MAX_SIZE:
+        return jsonify({'error': f'At most {active_config.LOCATION_BATCH_MAX_SIZE} locations per request'}), 413
+    
+    # Validate all fixes in one pass
+    rows, errors = LocationService.build_location_rows(
+        user_id,
+        fixes,
+        ip_address=request.remote_addr,
+        device_info=request.user_agent.string
+    )
+    
+    if errors:
+        return jsonify({'error': 'Invalid location data', 'details': errors}), 400
+    
+    # Insert the whole batch with one commit (or queue it when write-behind is enabled)
+    try:
+        result = LocationService.record_locations(rows)
+    except WriteBufferFull:
+        return jsonify({'error': 'Server busy, retry shortly'}), 503, {'Retry-After': '1'}
+    
+    if result['queued']:
+        return jsonify({
+            'message': 'Locations queued successfully',
+            'queued': result['queued'],
+            'dropped': result['dropped']
+        }), 202
+    
+    return jsonify({
+        'message': 'Locations saved successfully',
+        'saved': result['saved'],
+        'dropped': result['dropped']
+    }), 201
+
+@map_bp.route('/write-buffer/stats', methods=['GET'])
+def get_write_buffer_stats():
+    """Get queue depth and flush latency of the location write-behind buffer"""
+    # Check if user is logged in
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return jsonify({'write_buffer': location_write_buffer.stats()}), 200
+
+@map_bp.route('/ingest-stats', methods=['GET'])
+def get_ingest_stats():
+    """Get location ingest counters (dead-band drops, write buffer, position cache)"""
+    # Check if user is logged in
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return jsonify({
+        'dead_band': location_dead_band.stats(),
+        'write_buffer': location_write_buffer.stats(),
+        'position_cache': last_known_positions.stats()
+    }), 200
+
+@map_bp.route('/nearby-places/stats', methods=['GET'])
+def get_nearby_places_stats():
+    """Get nearby-places cache and request coalescing counters"""
+    # Check if user is logged in
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return jsonify({'cache': nearby_places_cache.stats(), 'coalescing': geo_lookups.stats()}), 200
+
+@map_bp.route('/upstream-stats', methods=['GET'])
+def get_upstream_stats():
+    """Get outbound geo API counters (latency, failures, circuit state)"""
+    # Check if user is logged in
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return jsonify({'upstreams': [overpass_client.stats(), geoapify_client.stats()]}), 200
 
 @map_bp.route('/location-history', methods=['GET'])
 def get_location_history():
@@ -54,18 +164,234 @@ def get_location_history():
     user_id = session['user_id']
     
     # Get query parameters
-    limit = request.args.get('limit', 10, type=int)
-    offset = request.args.get('offset', 0, type=int)
+    limit = clamp_limit(request.args.get('limit', type=int), active_config.PAGINATION_MAX_LIMIT)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    cursor = request.args.get('cursor')
+    
+    # Decode the keyset cursor (takes precedence over offset); segment cursors are their own kind
+    segments_only = active_config.LOCATION_HISTORY_STORAGE == 'segments'
+    position = None
+    if cursor:
+        try:
+            position = decode_cursor(cursor, kind='skip' if segments_only else None)
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        offset = 0
+    
+    # Read from encoded segments when history is stored only in that format
+    if segments_only:
+        # Segment fixes have no id, so the cursor holds (timestamp, fixes already
+        # returned at that timestamp) and reading resumes at the timestamp itself
+        end, skip = position if position is not None else (None, 0)
+        locations_dict = TrackSegmentService.get_locations(
+            user_id, end=end, limit=limit + 1, offset=offset + (skip or 0)
+        )
+        
+        next_cursor = None
+        if len(locations_dict) > limit:
+            locations_dict = locations_dict[:limit]
+            last_timestamp = datetime.fromisoformat(locations_dict[-1]['timestamp'])
+            same_timestamp = sum(1 for l in locations_dict if l['timestamp'] == locations_dict[-1]['timestamp'])
+            if end is not None and last_timestamp == end:
+                same_timestamp += skip or 0
+            next_cursor = encode_cursor(last_timestamp, same_timestamp, kind='skip')
+        
+        return jsonify({'locations': locations_dict, 'next_cursor': next_cursor}), 200
     
-    # Get location history from database
-    locations = LocationHistory.query.filter_by(user_id=user_id) \
-        .order_by(LocationHistory.timestamp.desc()) \
-        .limit(limit).offset(offset).all()
+    # Get location history from database, seeking past the cursor when given
+    query = LocationHistory.query.filter_by(user_id=user_id)
+    if position is not None:
+        query = query.filter(seek_before(LocationHistory.timestamp, LocationHistory.id, *position))
+    
+    locations = query.order_by(LocationHistory.timestamp.desc(), LocationHistory.id.desc()) \
+        .limit(limit + 1).offset(offset).all()
+    
+    # One extra row tells us whether another page exists
+    next_cursor = None
+    if len(locations) > limit:
+        locations = locations[:limit]
+        next_cursor = encode_cursor(locations[-1].timestamp, locations[-1].id)
     
     # Convert to dictionary
     locations_dict = [location.to_dict() for location in locations]
     
-    return jsonify({'locations': locations_dict}), 200
+    return jsonify({'locations': locations_dict, 'next_cursor': next_cursor}), 200
+
+@map_bp.route('/location-history/export', methods=['GET'])
+def export_location_history():
+    """Stream user's location history as GPX, GeoJSON or CSV"""
+    # Check if user is logged in
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    user_id = session['user_id']
+    
+    # Get query parameters
+    export_format = request.args.get('format', 'gpx').lower()
+    compress = request.args.get('gzip', 'false').lower() in ('1', 'true')
+    
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f'Format must be one of: {", ".join(EXPORT_FORMATS)}'}), 400
+    
+    # Parse optional time range (ISO 8601 or epoch milliseconds)
+    try:
+        start = LocationService.parse_client_timestamp(request.args.get('start', type=_timestamp_arg))
+        end = LocationService.parse_client_timestamp(request.args.get('end', type=_timestamp_arg))
+    except (ValueError, TypeError, OverflowError, OSError):
+        return jsonify({'error': 'start and end must be ISO 8601 or epoch milliseconds'}), 400
+    
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    filename = f'location-history.{extension}'
+    if compress:
+        mimetype = 'application/gzip'
+        filename += '.gz'
+    
+    body = ExportService.stream_export(user_id, export_format, start=start, end=end, compress=compress)
+    
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+def _timestamp_arg(value):
+    """Query-string timestamps: digits are epoch milliseconds, anything else ISO 8601"""
+    return int(value) if value.isdigit() else value
+
+@map_bp.route('/segments', methods=['GET'])
+def get_movement_segments():
+    """Get user's detected stays and trips"""
+    # Check if user is logged in
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    user_id = session['user_id']
+    
+    # Get query parameters
+    segment_type = request.args.get('type')
+    limit = request.args.get('limit', 50, type=int)
+    
+    if segment_type not in (None, 'stay', 'trip'):
+        return jsonify({'error': 'Type must be stay or trip'}), 400
+    
+    try:
+        start = LocationService.parse_client_timestamp(request.args.get('start', type=_timestamp_arg))
+        end = LocationService.parse_client_timestamp(request.args.get('end', type=_timestamp_arg))
+    except (ValueError, TypeError, OverflowError, OSError):
+        return jsonify({'error': 'start and end must be ISO 8601 or epoch milliseconds'}), 400
+    
+    segments = SegmentationService.get_segments(user_id, segment_type=segment_type, start=start, end=end, limit=limit)
+    
+    return jsonify({'segments': [segment.to_dict() for segment in segments]}), 200
+
+@map_bp.route('/current-stop', methods=['GET'])
+def get_current_stop():
+    """Get the stop the user is currently at and how long they have been there"""
+    # Check if user is logged in
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    user_id = session['user_id']
+    
+    stay = SegmentationService.get_current_stay(user_id)
+    if stay is None:
+        return jsonify({'current_stop': None, 'seconds_at_stop': 0}), 200
+    
+    return jsonify({
+        'current_stop': stay.to_dict(),
+        'seconds_at_stop': (datetime.utcnow() - stay.start_time).total_seconds()
+    }), 200
+
+@map_bp.route('/geofences', methods=['GET', 'POST'])
+def manage_geofences():
+    """Manage the user's geofences"""
+    # Check if user is logged in
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    user_id = session['user_id']
+    
+    if request.method == 'POST':
+        # Validate geofence data
+        fields, error = GeofenceService.parse_geofence(request.json or {})
+        if error:
+            return jsonify({'error': error}), 400
+        
+        # Check if maximum number of geofences reached
+        if Geofence.query.filter_by(user_id=user_id).count() >= active_config.MAX_GEOFENCES:
+            return jsonify({'error': f'Maximum number of geofences ({active_config.MAX_GEOFENCES}) reached'}), 400
+        
+        geofence = Geofence(user_id=user_id, **fields)
+        db.session.add(geofence)
+        db.session.commit()
+        
+        # Recompile the user's index on the next fix
+        GeofenceService.invalidate(user_id)
+        
+        return jsonify({'message': 'Geofence created successfully', 'geofence': geofence.to_dict()}), 201
+    
+    # GET request - return all geofences
+    geofences = Geofence.query.filter_by(user_id=user_id).order_by(Geofence.id).all()
+    
+    return jsonify({'geofences': [geofence.to_dict() for geofence in geofences]}), 200
+
+@map_bp.route('/geofences/<int:geofence_id>', methods=['GET', 'PUT', 'DELETE'])
+def manage_geofence(geofence_id):
+    """Manage a specific geofence"""
+    # Check if user is logged in
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    user_id = session['user_id']
+    
+    # Get geofence from database
+    geofence = Geofence.query.filter_by(id=geofence_id, user_id=user_id).first()
+    
+    if not geofence:
+        return jsonify({'error': 'Geofence not found'}), 404
+    
+    if request.method == 'PUT':
+        # Merge the update over the current definition and re-validate it
+        data = request.json or {}
+        merged = geofence.to_dict()
+        merged.update(data)
+        fields, error = GeofenceService.parse_geofence(merged)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        geometry = ('shape', 'latitude', 'longitude', 'radius', 'polygon')
+        if any(key in data for key in geometry):
+            geofence.shape = fields['shape']
+            geofence.latitude = fields.get('latitude')
+            geofence.longitude = fields.get('longitude')
+            geofence.radius = fields.get('radius')
+            geofence.polygon = json.dumps(fields['polygon']) if 'polygon' in fields else None
+            geofence.update_bounds()
+            geofence.is_inside = None  # Re-established silently by the next fix
+        
+        geofence.name = fields['name']
+        geofence.notify_on_enter = fields['notify_on_enter']
+        geofence.notify_on_exit = fields['notify_on_exit']
+        
+        if 'is_active' in data:
+            geofence.is_active = bool(data['is_active'])
+            geofence.is_inside = None
+        
+        db.session.commit()
+        GeofenceService.invalidate(user_id)
+        
+        return jsonify({'message': 'Geofence updated successfully', 'geofence': geofence.to_dict()}), 200
+    
+    elif request.method == 'DELETE':
+        # Delete geofence
+        db.session.delete(geofence)
+        db.session.commit()
+        GeofenceService.invalidate(user_id)
+        
+        return jsonify({'message': 'Geofence deleted successfully'}), 200
+    
+    # GET request - return geofence details
+    return jsonify(geofence.to_dict()), 200
 
 @map_bp.route('/nearby-places', methods=['GET'])
 def get_nearby_places():
@@ -74,65 +400,46 @@ def get_nearby_places():
     latitude = request.args.get('latitude', type=float)
     longitude = request.args.get('longitude', type=float)
     radius = request.args.get('radius', 1000, type=int)  # Default 1km radius
-    place_type = request.args.get('type', 'police')  # Default to police stations
+    place_types = request.args.get('type', 'police').split(',')  # e.g. police,hospital,shelter
     
     # Validate parameters
     if not latitude or not longitude:
         return jsonify({'error': 'Latitude and longitude are required'}), 400
     
-    # Use Overpass API to get nearby places
-    overpass_url = "https://overpass-api.de/api/interpreter"
-    
-    # Define the Overpass query based on place type
-    if place_type == 'police':
-        query = f"""
-        [out:json];
-        node["amenity"="police"](around:{radius},{latitude},{longitude});
-        out body;
-        """
-    elif place_type == 'hospital':
-        query = f"""
-        [out:json];
-        node["amenity"="hospital"](around:{radius},{latitude},{longitude});
-        out body;
-        """
-    elif place_type == 'shelter':
-        query = f"""
-        [out:json];
-        node["social_facility"="shelter"](around:{radius},{latitude},{longitude});
-        out body;
-        """
-    else:
+    if not all(place_type in PLACE_TYPE_TAGS for place_type in place_types):
         return jsonify({'error': 'Invalid place type'}), 400
     
-    try:
-        response = requests.post(overpass_url, data={"data": query})
-        data = response.json()
-        
-        # Extract relevant information
-        places = []
-        for element in data.get('elements', []):
-            if element.get('type') == 'node':
-                places.append({
-                    'id': element.get('id'),
-                    'name': element.get('tags', {}).get('name', 'Unknown'),
-                    'latitude': element.get('lat'),
-                    'longitude': element.get('lon'),
-                    'type': place_type,
-                    'address': element.get('tags', {}).get('addr:full', ''),
-                    'phone': element.get('tags', {}).get('phone', '')
-                })
-        
-        return jsonify({'places': places}), 200
+    # Cached, else one local POI store or Overpass request for all types (see PLACES_BACKEND)
+    places_by_type = LocationService.get_nearby_places_by_type(latitude, longitude, place_types, radius)
+    failed_types = [place_type for place_type in dict.fromkeys(place_types) if places_by_type[place_type] is None]
+    
+    # An unreachable backend must not look like "no police nearby"
+    if len(failed_types) == len(places_by_type):
+        return jsonify({'error': 'Failed to fetch nearby places', 'failed_types': failed_types}), 503
     
-    except Exception as e:
-        return jsonify({'error': f'Failed to fetch nearby places: {str(e)}'}), 500
+    places = [place for place_type in dict.fromkeys(place_types) for place in places_by_type[place_type] or []]
+    response = {'places': places}
+    if failed_types:
+        response.update(partial=True, failed_types=failed_types)
+    
+    return jsonify(response), 200
 
 @map_bp.route('/emergency-numbers', methods=['GET'])
 def get_emergency_numbers():
-    """Get emergency numbers based on country code"""
+    """Get emergency numbers based on country code, or on coordinates"""
     # Get query parameters
-    country_code = request.args.get('country', 'US')  # Default to US
+    latitude = request.args.get('latitude', type=float)
+    longitude = request.args.get('longitude', type=float)
+    
+    if 'country' not in request.args and latitude is not None and longitude is not None:
+        # Resolved offline when boundary data is installed
+        country_code = LocationService.get_country_from_coordinates(latitude, longitude)
+    else:
+        country_code = request.args.get('country', 'US').upper()  # Default to US
+    
+    # The table uses 'UK' for the United Kingdom, ISO 3166 uses 'GB'
+    if country_code == 'GB':
+        country_code = 'UK'
     
     # Define emergency numbers for common countries
     emergency_numbers = {
@@ -3,11 +3,14 @@ Safety routes for AI-powered safety recommendations
 """
 
 from flask import Blueprint, request, jsonify, session
-from datetime import datetime
+from datetime import datetime, timedelta
 from extensions import db
 from models.user import User
-from models.location_history import LocationHistory
 from models.safety_alert import SafetyAlert
+from services.location_service import LocationService
+from services.safety_service import SafetyService, recommendation_cache
+from services.recommendation_push import recommendation_pusher
+from services.heatmap_service import HeatmapService
 from config import active_config
 
 safety_bp = Blueprint('safety', __name__, url_prefix='/safety')
@@ -26,68 +29,31 @@ def get_recommendations():
     longitude = request.args.get('longitude', type=float)
     
     # If location not provided, get latest location from database
-    if not latitude or not longitude:
-        latest_location = LocationHistory.query.filter_by(user_id=user_id) \
-            .order_by(LocationHistory.timestamp.desc()).first()
+    if latitude is None or longitude is None:
+        latest_location = LocationService.get_latest_location(user_id)
         
         if latest_location:
             latitude = latest_location.latitude
             longitude = latest_location.longitude
     
     # If still no location, return error
-    if not latitude or not longitude:
+    if latitude is None or longitude is None:
         return jsonify({'error': 'Location not available'}), 400
     
-    # Get current time
-    current_time = datetime.utcnow()
-    current_hour = current_time.hour
-    
-    # Generate safety recommendations based on time and location
-    recommendations = []
-    
-    # Time-based recommendations
-    if current_hour >= active_config.NIGHT_START_HOUR or current_hour < active_config.NIGHT_END_HOUR:
-        recommendations.append({
-            'type': 'time',
-            'severity': 'warning',
-            'message': 'It\'s late at night. Stay in well-lit areas and avoid walking alone.'
-        })
-    
-    # Location-based recommendations (simplified for demo)
-    # In a real application, we would use crime data or known unsafe zones
-    
-    # Behavior-based recommendations
-    # Get recent locations to calculate movement patterns
-    recent_locations = LocationHistory.query.filter_by(user_id=user_id) \
-        .order_by(LocationHistory.timestamp.desc()).limit(5).all()
-    
-    if len(recent_locations) >= 2:
-        # Calculate speed between last two locations
-        loc1 = recent_locations[0]
-        loc2 = recent_locations[1]
-        
-        if loc1.speed and loc1.speed > 20:  # Speed > 20 m/s (72 km/h)
-            recommendations.append({
-                'type': 'behavior',
-                'severity': 'info',
-                'message': 'You appear to be moving quickly. If you\'re in a vehicle, ensure you\'re with a trusted driver.'
-            })
-    
-    # General safety tips
-    recommendations.append({
-        'type': 'general',
-        'severity': 'info',
-        'message': 'Share your location with a trusted contact when traveling in unfamiliar areas.'
-    })
-    
-    recommendations.append({
-        'type': 'general',
-        'severity': 'info',
-        'message': 'Keep your phone charged and easily accessible for emergencies.'
-    })
+    # Evaluate the shared safety rules (time, location and behavior)
+    recommendations = SafetyService.get_all_recommendations(user_id, latitude, longitude)
     
     return jsonify({'recommendations': recommendations}), 200
 
+@safety_bp.route('/recommendations/stats', methods=['GET'])
+def get_recommendation_stats():
+    """Get recommendation cache and background push counters"""
+    # Check if user is logged in
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return jsonify({'cache': recommendation_cache.stats(), 'push': recommendation_pusher.stats()}), 200
+
 @safety_bp.route('/report', methods=['POST'])
 def report_safety_issue():
     """Report a safety issue"""
@@ -118,43 +84,99 @@ def report_safety_issue():
     
     return jsonify({'message': 'Safety issue reported successfully', 'alert_id': alert.id}), 201
 
+@safety_bp.route('/reports/nearby', methods=['GET'])
+def get_nearby_reports():
+    """Get recent safety reports from all users near a location"""
+    # Check if user is logged in
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    # Get location parameters
+    latitude = request.args.get('latitude', type=float)
+    longitude = request.args.get('longitude', type=float)
+    radius = min(request.args.get('radius', 1000, type=int), 10000)  # Default 1km, max 10km
+    days = min(request.args.get('days', 30, type=int), 365)
+    
+    # Validate parameters
+    if latitude is None or longitude is None:
+        return jsonify({'error': 'Latitude and longitude are required'}), 400
+    
+    # Geohash range scans over the area, then exact distance filtering
+    query = SafetyAlert.query.filter(
+        SafetyAlert.alert_type != 'sos',
+        SafetyAlert.alert_type != 'geofence',
+        SafetyAlert.created_at >= datetime.utcnow() - timedelta(days=days)
+    )
+    matches = LocationService.find_within_radius(query, SafetyAlert, latitude, longitude, radius, limit=100)
+    
+    reports = []
+    for alert, distance in matches:
+        report = alert.to_dict()
+        report.pop('contacts_notified', None)
+        report['distance'] = round(distance, 1)
+        reports.append(report)
+    
+    return jsonify({'reports': reports}), 200
+
+@safety_bp.route('/heatmap', methods=['GET'])
+def get_heatmap():
+    """Get aggregated safety alert counts for the cells inside a map viewport"""
+    # Check if user is logged in
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    # Get viewport parameters
+    min_lat = request.args.get('min_lat', type=float)
+    min_lon = request.args.get('min_lon', type=float)
+    max_lat = request.args.get('max_lat', type=float)
+    max_lon = request.args.get('max_lon', type=float)
+    zoom = request.args.get('zoom', 12, type=int)
+    
+    # Validate parameters
+    if None in (min_lat, min_lon, max_lat, max_lon):
+        return jsonify({'error': 'min_lat, min_lon, max_lat and max_lon are required'}), 400
+    
+    if min_lat > max_lat or min_lon > max_lon:
+        return jsonify({'error': 'Invalid viewport'}), 400
+    
+    # Optional filters: severities and an hour-of-day range (UTC, may wrap midnight)
+    severity = request.args.get('severity')
+    severities = severity.split(',') if severity else None
+    
+    start_hour = request.args.get('start_hour', type=int)
+    end_hour = request.args.get('end_hour', type=int)
+    hour_buckets = None
+    if start_hour is not None and end_hour is not None:
+        if not (0 <= start_hour < 24 and 0 <= end_hour <= 24):
+            return jsonify({'error': 'Hours must be between 0 and 24'}), 400
+        hour_buckets = HeatmapService.hour_buckets(start_hour, end_hour)
+    
+    cell_zoom, cells = HeatmapService.get_cells(min_lat, min_lon, max_lat, max_lon, zoom, severities, hour_buckets)
+    
+    return jsonify({'zoom': cell_zoom, 'cells': cells}), 200
+
 @safety_bp.route('/safe-areas', methods=['GET'])
 def get_safe_areas():
-    """Get safe areas near the user's location"""
+    """Get the nearest safe places (police, hospitals, shelters, ...) to a location"""
     # Get location parameters
     latitude = request.args.get('latitude', type=float)
     longitude = request.args.get('longitude', type=float)
-    radius = request.args.get('radius', 1000, type=int)  # Default 1km radius
+    radius = request.args.get('radius', active_config.SAFE_PLACES_MAX_RADIUS_METERS, type=int)  # Max search radius
+    k = request.args.get('k', request.args.get('limit', active_config.SAFE_PLACES_DEFAULT_K, type=int), type=int)
+    place_types = request.args.get('type')  # Optional, e.g. police,hospital
     
     # Validate parameters
-    if not latitude or not longitude:
+    if latitude is None or longitude is None:
         return jsonify({'error': 'Latitude and longitude are required'}), 400
+    if radius <= 0 or k <= 0:
+        return jsonify({'error': 'radius and k must be positive'}), 400
+    
+    radius = min(radius, active_config.SAFE_PLACES_MAX_RADIUS_METERS)
+    k = min(k, active_config.SAFE_PLACES_MAX_K)
+    place_types = place_types.split(',') if place_types else None
     
-    # In a real application, we would use crime data or known safe zones
-    # For now, we'll return some example safe areas
-    
-    safe_areas = [
-        {
-            'name': 'Police Station',
-            'type': 'police',
-            'latitude': latitude + 0.01,
-            'longitude': longitude + 0.01,
-            'distance': 500  # meters
-        },
-        {
-            'name': 'Hospital',
-            'type': 'hospital',
-            'latitude': latitude - 0.01,
-            'longitude': longitude - 0.01,
-            'distance': 800  # meters
-        },
-        {
-            'name': 'Shopping Mall',
-            'type': 'public',
-            'latitude': latitude + 0.005,
-            'longitude': longitude - 0.005,
-            'distance': 300  # meters
-        }
-    ]
+    safe_areas = LocationService.get_nearest_places(latitude, longitude, k, place_types, radius)
+    if safe_areas is None:
+        return jsonify({'error': 'Failed to fetch safe places'}), 503
     
     return jsonify({'safe_areas': safe_areas}), 200
@@ -8,7 +8,6 @@ from datetime import datetime
 from extensions import db
 from models.emergency_contact import EmergencyContact
 from models.safety_alert import SafetyAlert
-from models.location_history import LocationHistory
 from services.location_service import LocationService
 from config import active_config
 
@@ -36,8 +35,7 @@ class EmergencyService:
         """Create an SOS alert"""
         # Get latest location if not provided
         if latitude is None or longitude is None:
-            latest_location = LocationHistory.query.filter_by(user_id=user_id) \
-                .order_by(LocationHistory.timestamp.desc()).first()
+            latest_location = LocationService.get_latest_location(user_id)
             
             if latest_location:
                 latitude = latest_location.latitude
@@ -0,0 +1,187 @@
+"""
+Export service for streaming a user's location history as GPX, GeoJSON or CSV
+"""
+
+import csv
+import io
+import json
+import zlib
+from extensions import db
+from models.location_history import LocationHistory
+from models.location_segment import LocationSegment
+from services.track_service import TrackSegmentService
+from utils.pagination import seek_after
+from config import active_config
+
+EXPORT_FORMATS = {
+    'gpx': ('application/gpx+xml', 'gpx'),
+    'geojson': ('application/geo+json', 'geojson'),
+    'csv': ('text/csv', 'csv')
+}
+
+CSV_COLUMNS = ['timestamp', 'latitude', 'longitude', 'accuracy', 'altitude', 'speed', 'heading']
+
+class ExportService:
+    """Service for exporting location history with flat memory use"""
+
+    @staticmethod
+    def iter_point_chunks(user_id, start=None, end=None, chunk_size=None):
+        """Yield lists of points in ascending time order, one short read per chunk
+
+        Each chunk is a separate keyset query and the session is released
+        between chunks, so a long export never keeps a read transaction (and
+        SQLite's shared lock) open while the client is downloading.
+        """
+        chunk_size = chunk_size or active_config.EXPORT_CHUNK_SIZE
+
+        if active_config.LOCATION_HISTORY_STORAGE == 'segments':
+            yield from ExportService._iter_segment_chunks(user_id, start, end, chunk_size)
+            return
+
+        query = LocationHistory.query.filter_by(user_id=user_id)
+        if start is not None:
+            query = query.filter(LocationHistory.timestamp >= start)
+        if end is not None:
+            query = query.filter(LocationHistory.timestamp <= end)
+
+        position = None
+        while True:
+            chunk_query = query
+            if position is not None:
+                chunk_query = chunk_query.filter(seek_after(LocationHistory.timestamp, LocationHistory.id, *position))
+            locations = chunk_query.order_by(LocationHistory.timestamp.asc(), LocationHistory.id.asc()) \
+                .limit(chunk_size).all()
+
+            points = [{
+                'latitude': location.latitude,
+                'longitude': location.longitude,
+                'accuracy': location.accuracy,
+                'altitude': location.altitude,
+                'speed': location.speed,
+                'heading': location.heading,
+                'timestamp': location.timestamp
+            } for location in locations]
+
+            if locations:
+                position = (locations[-1].timestamp, locations[-1].id)
+
+            # End the read before handing data to the (slow) client
+            db.session.rollback()
+            db.session.expunge_all()
+
+            if not points:
+                return
+            yield points
+            if len(points) < chunk_size:
+                return
+
+    @staticmethod
+    def _iter_segment_chunks(user_id, start, end, chunk_size):
+        """Chunked reader over encoded segments, a few segments per read"""
+        query = LocationSegment.query.filter_by(user_id=user_id)
+        if start is not None:
+            query = query.filter(LocationSegment.window_start >= TrackSegmentService.window_start(start))
+        if end is not None:
+            query = query.filter(LocationSegment.window_start <= end)
+
+        last_window = None
+        segments_per_read = max(1, chunk_size // 500)
+        while True:
+            chunk_query = query
+            if last_window is not None:
+                chunk_query = chunk_query.filter(LocationSegment.window_start > last_window)
+            segments = chunk_query.order_by(LocationSegment.window_start.asc()).limit(segments_per_read).all()
+            if not segments:
+                return
+
+            last_window = segments[-1].window_start
+            points = [
+                point for segment in segments for point in segment.decode()
+                if (start is None or point['timestamp'] >= start) and (end is None or point['timestamp'] <= end)
+            ]
+
+            db.session.rollback()
+            db.session.expunge_all()
+
+            if points:
+                yield points
+
+    @staticmethod
+    def _format_gpx(chunks):
+        yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+               '<gpx version="1.1" creator="Swiss Knife for Women" xmlns="http://www.topografix.com/GPX/1/1">\n'
+               '<trk><name>Location history</name><trkseg>\n')
+        for points in chunks:
+            parts = []
+            for point in points:
+                parts.append(f'<trkpt lat="{point["latitude"]}" lon="{point["longitude"]}">')
+                if point['altitude'] is not None:
+                    parts.append(f'<ele>{point["altitude"]}</ele>')
+                parts.append(f'<time>{point["timestamp"].isoformat()}Z</time></trkpt>\n')
+            yield ''.join(parts)
+        yield '</trkseg></trk>\n</gpx>\n'
+
+    @staticmethod
+    def _format_geojson(chunks):
+        yield '{"type": "FeatureCollection", "features": [\n'
+        first = True
+        for points in chunks:
+            features = []
+            for point in points:
+                features.append(json.dumps({
+                    'type': 'Feature',
+                    'geometry': {'type': 'Point', 'coordinates': [point['longitude'], point['latitude']]},
+                    'properties': {
+                        'timestamp': point['timestamp'].isoformat() + 'Z',
+                        'accuracy': point['accuracy'],
+                        'altitude': point['altitude'],
+                        'speed': point['speed'],
+                        'heading': point['heading']
+                    }
+                }))
+            if features:
+                yield ('' if first else ',\n') + ',\n'.join(features)
+                first = False
+        yield '\n]}\n'
+
+    @staticmethod
+    def _format_csv(chunks):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(CSV_COLUMNS)
+        yield buffer.getvalue()
+
+        for points in chunks:
+            buffer.seek(0)
+            buffer.truncate()
+            for point in points:
+                writer.writerow([
+                    point['timestamp'].isoformat() + 'Z', point['latitude'], point['longitude'],
+                    point['accuracy'], point['altitude'], point['speed'], point['heading']
+                ])
+            yield buffer.getvalue()
+
+    @staticmethod
+    def _gzip(parts):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+        for part in parts:
+            data = compressor.compress(part.encode('utf-8'))
+            if data:
+                yield data
+        yield compressor.flush()
+
+    @staticmethod
+    def stream_export(user_id, export_format, start=None, end=None, compress=False):
+        """Return a generator producing the export body in the requested format"""
+        chunks = ExportService.iter_point_chunks(user_id, start, end)
+
+        formatters = {
+            'gpx': ExportService._format_gpx,
+            'geojson': ExportService._format_geojson,
+            'csv': ExportService._format_csv
+        }
+        parts = formatters[export_format](chunks)
+
+        if compress:
+            return ExportService._gzip(parts)
+        return (part.encode('utf-8') for part in parts)
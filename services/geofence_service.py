@@ -0,0 +1,316 @@
+"""
+Geofence service for evaluating location fixes against user-defined areas
+"""
+
+from math import cos, radians, floor
+from extensions import db, socketio
+from models.geofence import Geofence
+from models.safety_alert import SafetyAlert
+from services.location_service import LocationService
+from utils.cache import LRUCache
+from config import active_config
+
+GEOFENCE_SHAPES = ('circle', 'polygon')
+
+class CompiledGeofence:
+    """Immutable in-memory copy of a Geofence, ready for containment tests"""
+
+    __slots__ = ('id', 'name', 'shape', 'latitude', 'longitude', 'radius', 'vertices',
+                 'bounds', 'notify_on_enter', 'notify_on_exit')
+
+    def __init__(self, geofence):
+        self.id = geofence.id
+        self.name = geofence.name
+        self.shape = geofence.shape
+        self.latitude = geofence.latitude
+        self.longitude = geofence.longitude
+        self.radius = geofence.radius
+        self.vertices = geofence.vertices
+        self.bounds = (geofence.min_latitude, geofence.min_longitude,
+                       geofence.max_latitude, geofence.max_longitude)
+        self.notify_on_enter = geofence.notify_on_enter
+        self.notify_on_exit = geofence.notify_on_exit
+
+    def _polygon_contains(self, latitude, longitude):
+        """Even-odd ray casting in the latitude/longitude plane"""
+        inside = False
+        vertices = self.vertices
+        j = len(vertices) - 1
+        for i in range(len(vertices)):
+            lat_i, lon_i = vertices[i]
+            lat_j, lon_j = vertices[j]
+            if (lat_i > latitude) != (lat_j > latitude):
+                crossing = lon_i + (latitude - lat_i) * (lon_j - lon_i) / (lat_j - lat_i)
+                if longitude < crossing:
+                    inside = not inside
+            j = i
+        return inside
+
+    def _distance_to_boundary(self, latitude, longitude):
+        """Approximate distance in meters from a point to the polygon's edges"""
+        # Local equirectangular projection is accurate enough at geofence scale
+        scale_x = 111320.0 * cos(radians(latitude))
+        scale_y = 110540.0
+        points = [((lon - longitude) * scale_x, (lat - latitude) * scale_y) for lat, lon in self.vertices]
+
+        best = float('inf')
+        for (x1, y1), (x2, y2) in zip(points, points[1:] + points[:1]):
+            dx, dy = x2 - x1, y2 - y1
+            length = dx * dx + dy * dy
+            t = 0.0 if length == 0 else max(0.0, min(1.0, -(x1 * dx + y1 * dy) / length))
+            px, py = x1 + t * dx, y1 + t * dy
+            best = min(best, (px * px + py * py) ** 0.5)
+        return best
+
+    def contains(self, latitude, longitude, margin=0.0):
+        """Whether the point lies inside the fence, grown by margin meters"""
+        if self.shape == 'circle':
+            distance = LocationService.calculate_distance(self.latitude, self.longitude, latitude, longitude)
+            return distance <= self.radius + margin
+
+        if self._polygon_contains(latitude, longitude):
+            return True
+        return margin > 0 and self._distance_to_boundary(latitude, longitude) <= margin
+
+class GeofenceIndex:
+    """A user's active fences bucketed into a uniform lat/lon grid
+
+    Each fence is registered in every cell its bounding box touches, so a fix
+    only tests the fences in its own cell (plus fences it is currently inside,
+    to detect exits). Fences covering more than max_cells cells are kept in a
+    short list that is always tested. The index holds geometry only; whether
+    the user is inside a fence is read from the database on every evaluation.
+    """
+
+    def __init__(self, geofences, cell_degrees=0.01, max_cells=2500):
+        self.cell_degrees = cell_degrees
+        self.fences = {}
+        self.grid = {}
+        self.large = []
+
+        for geofence in geofences:
+            fence = CompiledGeofence(geofence)
+            self.fences[fence.id] = fence
+
+            min_x, min_y = self._cell(fence.bounds[0], fence.bounds[1])
+            max_x, max_y = self._cell(fence.bounds[2], fence.bounds[3])
+            if (max_x - min_x + 1) * (max_y - min_y + 1) > max_cells:
+                self.large.append(fence.id)
+                continue
+            for x in range(min_x, max_x + 1):
+                for y in range(min_y, max_y + 1):
+                    self.grid.setdefault((x, y), []).append(fence.id)
+
+    def _cell(self, latitude, longitude):
+        return floor(latitude / self.cell_degrees), floor(longitude / self.cell_degrees)
+
+    def cell_candidates(self, latitude, longitude):
+        """Ids of fences whose grid cells (or large-fence list) could contain the point"""
+        ids = set(self.grid.get(self._cell(latitude, longitude), ()))
+        ids.update(self.large)
+        return ids
+
+    def candidates(self, latitude, longitude, membership):
+        """Ids of fences that could contain the point, that it may be leaving or that were never evaluated"""
+        ids = self.cell_candidates(latitude, longitude)
+        ids.update(fence_id for fence_id, is_inside in membership.items() if is_inside is not False)
+        return ids
+
+    def evaluate(self, latitude, longitude, membership, margin=0.0):
+        """Update membership ({fence_id: is_inside or None}) for one fix and return [(fence, 'enter'|'exit')]
+
+        Fences missing from membership (not loaded, or just deleted) are skipped. A
+        fence's first evaluation sets its state without an event. Exits only
+        fire once the fix is more than margin meters outside the fence, which
+        stops GPS jitter on the boundary from flapping.
+        """
+        transitions = []
+        for fence_id in self.candidates(latitude, longitude, membership):
+            fence = self.fences.get(fence_id)
+            if fence is None or fence_id not in membership:
+                continue
+            was_inside = membership[fence_id]
+            is_inside = fence.contains(latitude, longitude, margin if was_inside else 0.0)
+            membership[fence_id] = is_inside
+
+            if was_inside is None:
+                transitions.append((fence, None))  # State established, no event
+            elif is_inside and not was_inside:
+                transitions.append((fence, 'enter'))
+            elif was_inside and not is_inside:
+                transitions.append((fence, 'exit'))
+
+        return transitions
+
+class GeofenceService:
+    """Service for managing geofences and emitting enter/exit events"""
+
+    @staticmethod
+    def parse_geofence(data):
+        """Validate request data; returns (fields, error)"""
+        name = (data.get('name') or '').strip()
+        if not name:
+            return None, 'Name is required'
+
+        shape = data.get('shape', 'circle')
+        if shape not in GEOFENCE_SHAPES:
+            return None, f"Shape must be one of: {', '.join(GEOFENCE_SHAPES)}"
+
+        fields = {
+            'name': name[:64],
+            'shape': shape,
+            'notify_on_enter': bool(data.get('notify_on_enter', True)),
+            'notify_on_exit': bool(data.get('notify_on_exit', True))
+        }
+
+        try:
+            if shape == 'circle':
+                latitude = float(data['latitude'])
+                longitude = float(data['longitude'])
+                radius = float(data['radius'])
+                if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+                    return None, 'Coordinates out of range'
+                if not 0 < radius <= active_config.GEOFENCE_MAX_RADIUS_METERS:
+                    return None, f'Radius must be between 0 and {active_config.GEOFENCE_MAX_RADIUS_METERS} meters'
+                fields.update(latitude=latitude, longitude=longitude, radius=radius)
+            else:
+                vertices = [(float(lat), float(lon)) for lat, lon in data['polygon']]
+                if not 3 <= len(vertices) <= active_config.GEOFENCE_MAX_VERTICES:
+                    return None, f'Polygon must have between 3 and {active_config.GEOFENCE_MAX_VERTICES} vertices'
+                if not all(-90 <= lat <= 90 and -180 <= lon <= 180 for lat, lon in vertices):
+                    return None, 'Coordinates out of range'
+                fields['polygon'] = vertices
+        except (KeyError, TypeError, ValueError):
+            if shape == 'circle':
+                return None, 'Circle requires numeric latitude, longitude and radius'
+            return None, 'Polygon requires a list of [latitude, longitude] pairs'
+
+        return fields, None
+
+    @staticmethod
+    def load_index(user_id):
+        """Compile the user's active fences into a grid index"""
+        geofences = Geofence.query.filter_by(user_id=user_id, is_active=True).all()
+        return GeofenceIndex(
+            geofences,
+            cell_degrees=active_config.GEOFENCE_GRID_CELL_DEGREES,
+            max_cells=active_config.GEOFENCE_GRID_MAX_CELLS
+        )
+
+    @staticmethod
+    def get_index(user_id):
+        """Get the user's compiled index, compiling it on a miss"""
+        index = geofence_indexes.get(user_id)
+        if index is None:
+            index = GeofenceService.load_index(user_id)
+            geofence_indexes.set(user_id, index)
+        return index
+
+    @staticmethod
+    def invalidate(user_id):
+        """Drop the compiled index after the user's fences change"""
+        geofence_indexes.pop(user_id)
+
+    @staticmethod
+    def evaluate_rows(rows):
+        """Evaluate newly ingested fixes against their users' fences
+
+        Creates a SafetyAlert per enter/exit event and emits it to the user's
+        Socket.IO room and any active tracking rooms. Returns the list of events.
+        """
+        by_user = {}
+        for row in rows:
+            by_user.setdefault(row['user_id'], []).append(row)
+
+        events = []
+        dirty = False
+        for user_id, user_rows in by_user.items():
+            index = GeofenceService.get_index(user_id)
+            if not index.fences:
+                continue
+
+            # Persisted membership is the source of truth, shared by every worker. Only fences these
+            # fixes' cells touch, fences the user is inside (possible exits) and never-evaluated
+            # fences are read; every other fence stays outside and needs no work
+            cell_ids = set()
+            for row in user_rows:
+                cell_ids.update(index.cell_candidates(row['latitude'], row['longitude']))
+            before = dict(db.session.query(Geofence.id, Geofence.is_inside)
+                          .filter_by(user_id=user_id, is_active=True)
+                          .filter(db.or_(Geofence.id.in_(cell_ids),
+                                         Geofence.is_inside.is_(True),
+                                         Geofence.is_inside.is_(None))).all())
+            membership = dict(before)
+
+            user_events = []
+            for row in sorted(user_rows, key=lambda r: r['timestamp']):
+                for fence, event in index.evaluate(row['latitude'], row['longitude'], membership,
+                                                   active_config.GEOFENCE_EXIT_MARGIN_METERS):
+                    if event is None:
+                        continue
+                    if (event == 'enter' and not fence.notify_on_enter) or \
+                            (event == 'exit' and not fence.notify_on_exit):
+                        continue
+                    user_events.append((user_id, fence, event, row))
+
+            # Compare-and-set: when another worker moved a fence's state first, its events are theirs
+            lost = set()
+            for fence_id, is_inside in membership.items():
+                if is_inside == before[fence_id]:
+                    continue
+                result = db.session.execute(
+                    Geofence.__table__.update()
+                    .where(Geofence.id == fence_id, Geofence.is_inside.is_not_distinct_from(before[fence_id]))
+                    .values(is_inside=is_inside)
+                )
+                if result.rowcount == 0:
+                    lost.add(fence_id)
+                dirty = True
+
+            events.extend(event for event in user_events if event[1].id not in lost)
+
+        if not dirty:
+            return []
+
+        alerts = []
+        for user_id, fence, event, row in events:
+            message = f'Arrived at {fence.name}' if event == 'enter' else f'Left {fence.name}'
+            alert = SafetyAlert(user_id, 'geofence', 'info', message, row['latitude'], row['longitude'])
+            db.session.add(alert)
+            alerts.append(alert)
+
+        db.session.commit()
+
+        payloads = []
+        for (user_id, fence, event, row), alert in zip(events, alerts):
+            payload = {
+                'event': event,
+                'geofence_id': fence.id,
+                'name': fence.name,
+                'alert_id': alert.id,
+                'message': alert.message,
+                'latitude': row['latitude'],
+                'longitude': row['longitude'],
+                'timestamp': row['timestamp'].isoformat()
+            }
+            GeofenceService.emit_event(user_id, payload)
+            payloads.append(payload)
+
+        return payloads
+
+    @staticmethod
+    def emit_event(user_id, payload):
+        """Push a geofence event to the user and anyone following their shared location"""
+        from routes.location import get_user_tracking_ids
+
+        socketio.emit('geofence_event', payload, room=f'user_{user_id}')
+        for tracking_id in get_user_tracking_ids(user_id):
+            socketio.emit('geofence_event', payload, room=tracking_id)
+
+
+# Compiled per-user fence geometry (users without fences cache an empty index); the TTL
+# bounds how long fences created or changed through another worker go unnoticed
+geofence_indexes = LRUCache(
+    maxsize=active_config.GEOFENCE_INDEX_CACHE_SIZE,
+    ttl=active_config.GEOFENCE_INDEX_CACHE_TTL_SECONDS
+)
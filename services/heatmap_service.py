@@ -0,0 +1,155 @@
+"""
+Heatmap service for incrementally aggregated safety alert counts
+"""
+
+from math import floor, log, tan, cos, pi, radians
+from sqlalchemy import event
+from extensions import db
+from models.alert_heatmap import AlertHeatmapCell
+from models.safety_alert import SafetyAlert
+from config import active_config
+
+MAX_MERCATOR_LATITUDE = 85.05112878
+
+def tile_xy(latitude, longitude, zoom):
+    """Web Mercator tile containing a coordinate at a zoom level"""
+    latitude = max(min(latitude, MAX_MERCATOR_LATITUDE), -MAX_MERCATOR_LATITUDE)
+    n = 1 << zoom
+    x = floor((longitude + 180.0) / 360.0 * n)
+    lat = radians(latitude)
+    y = floor((1.0 - log(tan(lat) + 1.0 / cos(lat)) / pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+class HeatmapService:
+    """Service for maintaining and querying the alert heatmap aggregate
+
+    Each alert with coordinates adds one to a cell per configured zoom level,
+    in the same transaction that inserts the alert. Viewport queries then
+    read at most the number of cells in view, whatever the number of alerts.
+    """
+
+    @staticmethod
+    def counts_alert(alert):
+        """Whether an alert belongs on the heatmap"""
+        return alert.latitude is not None and alert.longitude is not None \
+            and alert.alert_type not in active_config.HEATMAP_EXCLUDED_ALERT_TYPES
+
+    @staticmethod
+    def cell_keys(alert):
+        """(zoom, x, y, severity, hour_bucket) for each zoom level the alert counts in"""
+        latitude, longitude = float(alert.latitude), float(alert.longitude)
+        hour_bucket = alert.created_at.hour // active_config.HEATMAP_HOUR_BUCKET_SIZE
+        return [(zoom, *tile_xy(latitude, longitude, zoom), alert.severity, hour_bucket)
+                for zoom in active_config.HEATMAP_ZOOM_LEVELS]
+
+    @staticmethod
+    def _after_alert_insert(mapper, connection, alert):
+        """Add a new alert to its cells using the inserting transaction"""
+        if not HeatmapService.counts_alert(alert):
+            return
+
+        table = AlertHeatmapCell.__table__
+        latitude, longitude = float(alert.latitude), float(alert.longitude)
+
+        for zoom, x, y, severity, hour_bucket in HeatmapService.cell_keys(alert):
+            match = (table.c.zoom == zoom) & (table.c.x == x) & (table.c.y == y) & \
+                (table.c.severity == severity) & (table.c.hour_bucket == hour_bucket)
+
+            # Update-then-insert keeps this portable across SQLite and PostgreSQL
+            result = connection.execute(table.update().where(match).values(
+                count=table.c.count + 1,
+                latitude_sum=table.c.latitude_sum + latitude,
+                longitude_sum=table.c.longitude_sum + longitude
+            ))
+            if result.rowcount == 0:
+                connection.execute(table.insert().values(
+                    zoom=zoom, x=x, y=y, severity=severity, hour_bucket=hour_bucket,
+                    count=1, latitude_sum=latitude, longitude_sum=longitude
+                ))
+
+    @staticmethod
+    def register_listeners():
+        """Keep the heatmap in step with SafetyAlert inserts"""
+        if not event.contains(SafetyAlert, 'after_insert', HeatmapService._after_alert_insert):
+            event.listen(SafetyAlert, 'after_insert', HeatmapService._after_alert_insert)
+
+    @staticmethod
+    def rebuild(batch_size=5000):
+        """Recompute every cell from the alerts table; returns the number of alerts counted"""
+        cells = {}
+        counted = 0
+
+        for alert in SafetyAlert.query.filter(SafetyAlert.latitude.isnot(None)) \
+                .order_by(SafetyAlert.id).yield_per(batch_size):
+            if not HeatmapService.counts_alert(alert):
+                continue
+            for key in HeatmapService.cell_keys(alert):
+                cell = cells.setdefault(key, [0, 0.0, 0.0])
+                cell[0] += 1
+                cell[1] += alert.latitude
+                cell[2] += alert.longitude
+            counted += 1
+
+        AlertHeatmapCell.query.delete()
+        rows = [{
+            'zoom': zoom, 'x': x, 'y': y, 'severity': severity, 'hour_bucket': hour_bucket,
+            'count': count, 'latitude_sum': latitude_sum, 'longitude_sum': longitude_sum
+        } for (zoom, x, y, severity, hour_bucket), (count, latitude_sum, longitude_sum) in cells.items()]
+
+        for start in range(0, len(rows), batch_size):
+            db.session.execute(AlertHeatmapCell.__table__.insert(), rows[start:start + batch_size])
+        db.session.commit()
+
+        return counted
+
+    @staticmethod
+    def hour_buckets(start_hour, end_hour):
+        """Buckets overlapping the hours from start_hour up to end_hour, wrapping past midnight"""
+        size = active_config.HEATMAP_HOUR_BUCKET_SIZE
+        hours = range(start_hour, end_hour) if start_hour < end_hour else \
+            list(range(start_hour, 24)) + list(range(0, end_hour))
+        return sorted({hour // size for hour in hours})
+
+    @staticmethod
+    def choose_zoom(map_zoom, min_lat, min_lon, max_lat, max_lon):
+        """Finest configured level at or below the map zoom whose viewport fits in HEATMAP_MAX_CELLS"""
+        levels = sorted(active_config.HEATMAP_ZOOM_LEVELS)
+        candidates = [zoom for zoom in levels if zoom <= map_zoom] or levels[:1]
+
+        for zoom in reversed(candidates):
+            min_x, min_y = tile_xy(max_lat, min_lon, zoom)
+            max_x, max_y = tile_xy(min_lat, max_lon, zoom)
+            if (max_x - min_x + 1) * (max_y - min_y + 1) <= active_config.HEATMAP_MAX_CELLS:
+                return zoom
+        return candidates[0]
+
+    @staticmethod
+    def get_cells(min_lat, min_lon, max_lat, max_lon, map_zoom, severities=None, hour_buckets=None):
+        """Aggregated cells inside a viewport, summed over the selected severities and hours"""
+        zoom = HeatmapService.choose_zoom(map_zoom, min_lat, min_lon, max_lat, max_lon)
+        min_x, min_y = tile_xy(max_lat, min_lon, zoom)  # Tile y grows southwards
+        max_x, max_y = tile_xy(min_lat, max_lon, zoom)
+
+        total = db.func.sum(AlertHeatmapCell.count)
+        query = db.session.query(
+            AlertHeatmapCell.x, AlertHeatmapCell.y, total,
+            db.func.sum(AlertHeatmapCell.latitude_sum), db.func.sum(AlertHeatmapCell.longitude_sum)
+        ).filter(
+            AlertHeatmapCell.zoom == zoom,
+            AlertHeatmapCell.x.between(min_x, max_x),
+            AlertHeatmapCell.y.between(min_y, max_y)
+        )
+        if severities:
+            query = query.filter(AlertHeatmapCell.severity.in_(severities))
+        if hour_buckets:
+            query = query.filter(AlertHeatmapCell.hour_bucket.in_(hour_buckets))
+
+        cells = [{
+            'x': x,
+            'y': y,
+            'count': count,
+            'latitude': latitude_sum / count,
+            'longitude': longitude_sum / count
+        } for x, y, count, latitude_sum, longitude_sum in query.group_by(AlertHeatmapCell.x, AlertHeatmapCell.y)]
+
+        return zoom, cells
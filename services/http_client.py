@@ -0,0 +1,163 @@
+"""
+Outbound HTTP client for external geo APIs: pooling, timeouts, concurrency limits and circuit breaking
+"""
+
+import time
+from collections import deque
+import requests
+from requests.adapters import HTTPAdapter
+from gevent.lock import BoundedSemaphore
+
+class CircuitOpenError(Exception):
+    """Raised without contacting the upstream while its circuit is open"""
+
+class UpstreamBusyError(Exception):
+    """Raised when every concurrency slot for the upstream stays taken"""
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker
+
+    Closed: requests flow. After failure_threshold consecutive failures it
+    opens and rejects requests for reset_timeout seconds, then lets a single
+    trial request through (half-open); its outcome closes or re-opens it.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        """Whether a request may be attempted now"""
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half_open' and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.trial_in_flight or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self.trial_in_flight = False
+
+class UpstreamClient:
+    """Shared client for one external API
+
+    Keeps a keep-alive connection pool, applies connect/read timeouts to
+    every request, limits concurrent requests with a gevent semaphore, and
+    fails fast through a circuit breaker while the upstream is unhealthy.
+    Connection errors, timeouts, 5xx and 429 responses count as failures.
+    """
+
+    def __init__(self, name, url, connect_timeout=3.05, read_timeout=10.0, max_concurrency=10,
+                 acquire_timeout=2.0, failure_threshold=5, reset_timeout=30.0, latency_window=500):
+        self.name = name
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.acquire_timeout = acquire_timeout
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._slots = BoundedSemaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.requests = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejected = 0  # Circuit open
+        self.busy = 0      # No concurrency slot within acquire_timeout
+        self._latencies = deque(maxlen=latency_window)
+
+    def request(self, method, url=None, **kwargs):
+        """Send a request to the upstream and return the response
+
+        Raises CircuitOpenError, UpstreamBusyError or the requests exception;
+        callers still check the response status.
+        """
+        trial = self.breaker.state == 'half_open'
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise CircuitOpenError(f'{self.name} circuit is open')
+
+        try:
+            if not self._slots.acquire(timeout=self.acquire_timeout):
+                self.busy += 1
+                raise UpstreamBusyError(f'{self.name} has no free connection slot')
+
+            self.requests += 1
+            start = time.monotonic()
+            try:
+                response = self.session.request(method, url or self.url, timeout=self.timeout, **kwargs)
+            except requests.Timeout:
+                self.timeouts += 1
+                self.failures += 1
+                self.breaker.record_failure()
+                raise
+            except Exception:
+                # requests errors, and anything urllib3 lets through
+                self.failures += 1
+                self.breaker.record_failure()
+                raise
+            finally:
+                self._latencies.append(time.monotonic() - start)
+                self._slots.release()
+
+            if response.status_code >= 500 or response.status_code == 429:
+                self.failures += 1
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            return response
+        finally:
+            # A trial that ended without an outcome (no free slot, GreenletExit, gevent.Timeout, ...)
+            # must not keep the circuit half-open and closed to every other request
+            if trial:
+                self.breaker.trial_in_flight = False
+
+    def get(self, url=None, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url=None, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        """Request, failure and latency counters"""
+        latencies = sorted(self._latencies)
+
+        def percentile(fraction):
+            if not latencies:
+                return None
+            return round(latencies[min(int(fraction * len(latencies)), len(latencies) - 1)] * 1000, 1)
+
+        return {
+            'name': self.name,
+            'state': self.breaker.state,
+            'requests': self.requests,
+            'failures': self.failures,
+            'timeouts': self.timeouts,
+            'rejected': self.rejected,
+            'busy': self.busy,
+            'in_flight': self.max_concurrency - self._slots.counter,
+            'latency_ms': {'p50': percentile(0.5), 'p95': percentile(0.95), 'max': percentile(1.0)}
+        }
@@ -0,0 +1,44 @@
+"""
+Database leases that elect one worker process to run a background job
+"""
+
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models.job_lease import JobLease
+
+class LeaseService:
+    """Acquire and renew named leases stored in the application database"""
+
+    # Identifies this process as a lease holder
+    holder_id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+    @staticmethod
+    def try_acquire(name, ttl_seconds, holder=None):
+        """Claim or renew the lease; returns whether this process holds it for the next ttl_seconds
+
+        The lease is taken over only once its holder has let it expire, so a
+        holder renewing it every tick keeps it until that process stops.
+        """
+        holder = holder or LeaseService.holder_id
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=ttl_seconds)
+        table = JobLease.__table__
+
+        result = db.session.execute(
+            table.update()
+            .where(table.c.name == name, db.or_(table.c.holder == holder, table.c.expires_at < now))
+            .values(holder=holder, expires_at=expires_at)
+        )
+        if result.rowcount == 0:
+            try:
+                db.session.execute(table.insert().values(name=name, holder=holder, expires_at=expires_at))
+            except IntegrityError:
+                # The lease exists and is held by another process
+                db.session.rollback()
+                return False
+        db.session.commit()
+        return True
@@ -0,0 +1,139 @@
+"""
+Ingest-time dead-band filter that drops redundant fixes from stationary devices
+"""
+
+import math
+from datetime import timedelta
+from utils.cache import LRUCache
+
+def _finite_or_none(value):
+    """value as a finite float, or None when missing or not a usable number"""
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
+
+class DeadBandFilter:
+    """Drop fixes that add no information over the last stored fix
+
+    A fix is dropped when it lies within the previous stored fix's accuracy
+    radius, arrives within ``window_seconds`` of the previously received fix,
+    and the last stored fix is younger than ``heartbeat_seconds``. Anything
+    else (movement, a gap in reporting, or a due heartbeat) is kept.
+    """
+
+    def __init__(self, distance_func, window_seconds=30, heartbeat_seconds=60, min_radius=10,
+                 max_radius=100, maxsize=10000, seed_func=None):
+        self.distance_func = distance_func
+        self.window = timedelta(seconds=window_seconds)
+        self.heartbeat = timedelta(seconds=heartbeat_seconds)
+        self.min_radius = min_radius
+        self.max_radius = max_radius
+        self.seed_func = seed_func
+
+        # user_id -> {'kept': last stored fix row, 'seen': timestamp of last received fix}
+        self._state = LRUCache(maxsize=maxsize)
+
+        self.received = 0
+        self.dropped = 0
+
+    def _get_state(self, user_id):
+        state = self._state.get(user_id)
+        if state is None:
+            state = {'kept': None, 'seen': None}
+            # Seed from the last stored fix so a restart does not store a burst of duplicates
+            if self.seed_func is not None:
+                position = self.seed_func(user_id)
+                if position is not None:
+                    state['kept'] = self._kept(position.latitude, position.longitude,
+                                               position.accuracy, position.timestamp)
+                    state['seen'] = position.timestamp
+            self._state.set(user_id, state)
+        return state
+
+    @staticmethod
+    def _kept(latitude, longitude, accuracy, timestamp):
+        """Filter state for a stored fix; accuracy is kept only as a finite float"""
+        return {
+            'latitude': latitude,
+            'longitude': longitude,
+            'accuracy': _finite_or_none(accuracy),
+            'timestamp': timestamp
+        }
+
+    def _is_redundant(self, state, row):
+        kept = state['kept']
+        if kept is None or kept['timestamp'] is None:
+            return False
+
+        # Never filter backfilled or reordered fixes
+        if row['timestamp'] <= kept['timestamp']:
+            return False
+
+        # Heartbeat: keep one point per interval so liveness stays visible
+        if row['timestamp'] - kept['timestamp'] >= self.heartbeat:
+            return False
+
+        # Keep the first fix after a reporting gap
+        if state['seen'] is not None and row['timestamp'] - state['seen'] > self.window:
+            return False
+
+        radius = min(max(kept['accuracy'] or 0, self.min_radius), self.max_radius)
+        distance = self.distance_func(kept['latitude'], kept['longitude'], row['latitude'], row['longitude'])
+
+        return distance <= radius
+
+    def filter_rows(self, rows):
+        """Return (kept_rows, dropped_count, pending) for a batch of insert rows
+
+        The filter state is not changed here: pass ``pending`` to commit()
+        once the kept rows have been stored, so fixes that fail to save (and
+        are retried by the client) are not later dropped as redundant
+        against a fix that was never stored.
+        """
+        kept_rows = []
+        dropped = 0
+        states = {}  # user_id -> updated copy of that user's state
+
+        for row in sorted(rows, key=lambda r: r['timestamp']):
+            state = states.get(row['user_id'])
+            if state is None:
+                state = states[row['user_id']] = dict(self._get_state(row['user_id']))
+
+            if self._is_redundant(state, row):
+                dropped += 1
+            else:
+                kept_rows.append(row)
+                if state['kept'] is None or row['timestamp'] >= state['kept']['timestamp']:
+                    state['kept'] = self._kept(row['latitude'], row['longitude'],
+                                               row.get('accuracy'), row['timestamp'])
+
+            if state['seen'] is None or row['timestamp'] > state['seen']:
+                state['seen'] = row['timestamp']
+
+        return kept_rows, dropped, (states, len(rows), dropped)
+
+    def commit(self, pending):
+        """Apply the state computed by filter_rows after its rows were stored"""
+        states, received, dropped = pending
+        for user_id, state in states.items():
+            self._state.set(user_id, state)
+
+        self.received += received
+        self.dropped += dropped
+
+    def reset(self, user_id):
+        """Forget filter state for a user"""
+        self._state.pop(user_id)
+
+    def stats(self):
+        """Received/dropped counters"""
+        return {
+            'received': self.received,
+            'dropped': self.dropped,
+            'drop_rate': round(self.dropped / self.received, 4) if self.received else 0.0,
+            'tracked_users': len(self._state)
+        }
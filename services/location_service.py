@@ -2,38 +2,133 @@
 Location service for handling location-related functionality
 """
 
+import heapq
 import math
-import requests
-from datetime import datetime, timedelta
+import numpy as np
+from types import SimpleNamespace
+import sqlite3
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from extensions import db
 from models.location_history import LocationHistory
+from models.location_segment import LocationSegment
+from services.http_client import UpstreamClient
+from services.location_filter import DeadBandFilter
+from services.movement_state import MovementStateStore
+from services.places_cache import NearbyPlacesCache
+from services.poi_store import PoiStore, PLACE_TYPE_TAGS, place_from_tags
+from services.reverse_geocoder import ReverseGeocoder
+from services.position_cache import LastKnownPositionCache, CachedPosition
+from services.track_service import TrackSegmentService
+from services.write_buffer import WriteBehindBuffer
+from utils import geohash
+from utils.singleflight import SingleFlight
+from utils.validation import validate_location_data
 from config import active_config
 
+# Earth radius in meters
+EARTH_RADIUS_METERS = 6371000
+
+# numpy under the math module's names, so one formula serves scalars (math) and arrays (numpy)
+NUMPY_MATH = SimpleNamespace(radians=np.radians, degrees=np.degrees, sin=np.sin, cos=np.cos,
+                             sqrt=np.sqrt, atan2=np.arctan2)
+
+def _haversine(lat1, lon1, lat2, lon2, m):
+    """Haversine distance in meters using math functions from m (math or NUMPY_MATH)"""
+    lat1_rad = m.radians(lat1)
+    lat2_rad = m.radians(lat2)
+    dlat = lat2_rad - lat1_rad
+    dlon = m.radians(lon2) - m.radians(lon1)
+
+    a = m.sin(dlat / 2) ** 2 + m.cos(lat1_rad) * m.cos(lat2_rad) * m.sin(dlon / 2) ** 2
+    return EARTH_RADIUS_METERS * 2 * m.atan2(m.sqrt(a), m.sqrt(1 - a))
+
+def _bearing(lat1, lon1, lat2, lon2, m):
+    """Initial bearing in degrees (0-360) using math functions from m (math or NUMPY_MATH)"""
+    lat1_rad = m.radians(lat1)
+    lat2_rad = m.radians(lat2)
+    dlon = m.radians(lon2) - m.radians(lon1)
+
+    y = m.sin(dlon) * m.cos(lat2_rad)
+    x = m.cos(lat1_rad) * m.sin(lat2_rad) - m.sin(lat1_rad) * m.cos(lat2_rad) * m.cos(dlon)
+    return (m.degrees(m.atan2(y, x)) + 360) % 360
+
 class LocationService:
     """Service for handling location-related functionality"""
     
+    @staticmethod
+    def haversine_distances(lat1, lon1, lat2, lon2):
+        """Element-wise Haversine distance in meters between arrays (or scalars) of points"""
+        return _haversine(lat1, lon1, lat2, lon2, NUMPY_MATH)
+
+    @staticmethod
+    def initial_bearings(lat1, lon1, lat2, lon2):
+        """Element-wise initial bearing in degrees (0-360) from the first to the second points"""
+        return _bearing(lat1, lon1, lat2, lon2, NUMPY_MATH)
+
+    @staticmethod
+    def calculate_distances(latitudes, longitudes):
+        """Distances in meters between consecutive points of a track (length n-1)"""
+        lats = np.asarray(latitudes, dtype=float)
+        lons = np.asarray(longitudes, dtype=float)
+        return LocationService.haversine_distances(lats[:-1], lons[:-1], lats[1:], lons[1:])
+
+    @staticmethod
+    def calculate_headings(latitudes, longitudes):
+        """Headings in degrees between consecutive points of a track (length n-1)"""
+        lats = np.asarray(latitudes, dtype=float)
+        lons = np.asarray(longitudes, dtype=float)
+        return LocationService.initial_bearings(lats[:-1], lons[:-1], lats[1:], lons[1:])
+
+    @staticmethod
+    def calculate_speeds(latitudes, longitudes, timestamps):
+        """Speeds in m/s between consecutive points (length n-1)
+
+        timestamps may be datetimes, numpy datetime64 values or epoch seconds.
+        Non-positive time differences yield a speed of 0, as in calculate_speed.
+        """
+        distances = LocationService.calculate_distances(latitudes, longitudes)
+        time_diffs = np.diff(LocationService.to_epoch_seconds(timestamps))
+
+        speeds = np.zeros_like(distances)
+        moving = time_diffs > 0
+        speeds[moving] = distances[moving] / time_diffs[moving]
+        return speeds
+
+    @staticmethod
+    def calculate_heading_changes(headings):
+        """Absolute change in degrees (0-180) between consecutive headings (length n-1)"""
+        changes = np.abs(np.diff(np.asarray(headings, dtype=float)))
+        return np.where(changes > 180, 360 - changes, changes)
+
+    @staticmethod
+    def distances_to_point(latitude, longitude, latitudes, longitudes):
+        """Distances in meters from one point to many candidates, e.g. for ranking places"""
+        return LocationService.haversine_distances(
+            latitude, longitude,
+            np.asarray(latitudes, dtype=float), np.asarray(longitudes, dtype=float)
+        )
+
+    @staticmethod
+    def to_epoch_seconds(timestamps):
+        """Convert a sequence of naive UTC datetimes / datetime64 / numbers to float seconds"""
+        values = np.asarray(timestamps)
+        if values.dtype.kind == 'O':
+            values = values.astype('datetime64[us]')
+        if values.dtype.kind == 'M':
+            return values.astype('datetime64[us]').astype(np.int64) / 1e6
+        return values.astype(float)
+
     @staticmethod
     def calculate_distance(lat1, lon1, lat2, lon2):
-        """Calculate distance between two points using Haversine formula"""
-        # Earth radius in meters
-        R = 6371000
-        
-        # Convert latitude and longitude from degrees to radians
-        lat1_rad = math.radians(lat1)
-        lon1_rad = math.radians(lon1)
-        lat2_rad = math.radians(lat2)
-        lon2_rad = math.radians(lon2)
-        
-        # Differences
-        dlat = lat2_rad - lat1_rad
-        dlon = lon2_rad - lon1_rad
-        
-        # Haversine formula
-        a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon/2)**2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-        distance = R * c
-        
-        return distance
+        """Calculate distance between two points using Haversine formula
+
+        Same formula as haversine_distances, on the math module: numpy's
+        per-call overhead dominates for a single pair.
+        """
+        return _haversine(lat1, lon1, lat2, lon2, math)
     
     @staticmethod
     def calculate_speed(location1, location2):
@@ -58,26 +153,284 @@ class LocationService:
     
     @staticmethod
     def calculate_heading(lat1, lon1, lat2, lon2):
-        """Calculate heading (direction) between two points"""
-        # Convert latitude and longitude from degrees to radians
-        lat1_rad = math.radians(lat1)
-        lon1_rad = math.radians(lon1)
-        lat2_rad = math.radians(lat2)
-        lon2_rad = math.radians(lon2)
-        
-        # Calculate heading
-        y = math.sin(lon2_rad - lon1_rad) * math.cos(lat2_rad)
-        x = math.cos(lat1_rad) * math.sin(lat2_rad) - math.sin(lat1_rad) * math.cos(lat2_rad) * math.cos(lon2_rad - lon1_rad)
-        heading = math.atan2(y, x)
-        
-        # Convert from radians to degrees
-        heading = math.degrees(heading)
-        
-        # Normalize to 0-360
-        heading = (heading + 360) % 360
-        
-        return heading
+        """Calculate heading (direction) between two points; initial_bearings is the array form"""
+        return _bearing(lat1, lon1, lat2, lon2, math)
     
+    @staticmethod
+    def parse_client_timestamp(value):
+        """Parse a client fix timestamp (epoch milliseconds or ISO 8601) into naive UTC"""
+        if value is None:
+            return None
+
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            # Geolocation API positions carry epoch milliseconds
+            return datetime.utcfromtimestamp(value / 1000.0)
+
+        if isinstance(value, str):
+            parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+            if parsed.tzinfo is not None:
+                parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+            return parsed
+
+        raise ValueError('Unsupported timestamp format')
+
+    @staticmethod
+    def parse_optional_number(value):
+        """Optional numeric fix field (accuracy, altitude, speed, heading) as a finite float, or None
+
+        Raises ValueError for booleans, non-numeric strings and NaN/infinity.
+        """
+        if value is None:
+            return None
+        if isinstance(value, bool):
+            raise ValueError('Booleans are not numbers')
+        number = float(value)
+        if not math.isfinite(number):
+            raise ValueError('Number must be finite')
+        return number
+
+    @staticmethod
+    def build_location_rows(user_id, fixes, ip_address=None, device_info=None):
+        """Validate a list of fixes in one pass and build insert rows for LocationHistory
+
+        Returns (rows, errors) where errors maps the index of each invalid fix to its
+        validation errors. Rows are only meaningful when errors is empty.
+        """
+        rows = []
+        errors = {}
+        now = datetime.utcnow()
+        max_timestamp = now + timedelta(seconds=active_config.LOCATION_MAX_CLOCK_SKEW_SECONDS)
+
+        for index, fix in enumerate(fixes):
+            if not isinstance(fix, dict):
+                errors[index] = {'fix': 'Location fix must be an object'}
+                continue
+
+            _, fix_errors = validate_location_data(fix)
+
+            try:
+                timestamp = LocationService.parse_client_timestamp(fix.get('timestamp'))
+            except (ValueError, TypeError, OverflowError, OSError):
+                fix_errors['timestamp'] = 'Timestamp must be epoch milliseconds or ISO 8601'
+                timestamp = None
+
+            if timestamp is not None and timestamp > max_timestamp:
+                fix_errors['timestamp'] = 'Timestamp is in the future'
+
+            optional = {}
+            for field in ('accuracy', 'altitude', 'speed', 'heading'):
+                try:
+                    optional[field] = LocationService.parse_optional_number(fix.get(field))
+                except (ValueError, TypeError, OverflowError):
+                    fix_errors[field] = f'{field.capitalize()} must be a finite number'
+
+            if fix_errors:
+                errors[index] = fix_errors
+                continue
+
+            rows.append({
+                'user_id': user_id,
+                'latitude': float(fix['latitude']),
+                'longitude': float(fix['longitude']),
+                'accuracy': optional['accuracy'],
+                'altitude': optional['altitude'],
+                'speed': optional['speed'],
+                'heading': optional['heading'],
+                'timestamp': timestamp or now,
+                'ip_address': ip_address,
+                'device_info': device_info,
+                'geohash': geohash.encode(float(fix['latitude']), float(fix['longitude']),
+                                          active_config.GEOHASH_PRECISION)
+            })
+
+        return rows, errors
+
+    @staticmethod
+    def save_locations(rows):
+        """Insert location rows with a single bulk insert and commit
+
+        Depending on LOCATION_HISTORY_STORAGE the rows go to LocationHistory,
+        to encoded LocationSegment blobs, or both, in one transaction. Returns
+        the new primary keys when a single LocationHistory row is inserted,
+        otherwise an empty list (executemany does not report generated ids).
+        """
+        if not rows:
+            return []
+
+        storage = active_config.LOCATION_HISTORY_STORAGE
+
+        for attempt in range(3):
+            location_ids = []
+            try:
+                if storage in ('rows', 'both'):
+                    if len(rows) == 1:
+                        result = db.session.execute(LocationHistory.__table__.insert(), rows[0])
+                        location_ids = list(result.inserted_primary_key)
+                    else:
+                        db.session.execute(LocationHistory.__table__.insert(), rows)
+
+                if storage in ('segments', 'both'):
+                    TrackSegmentService.append_rows(rows)
+
+                # Queue the users for stay/trip segmentation, in the same transaction as their fixes
+                from services.segmentation_service import SegmentationService
+                SegmentationService.mark_pending(rows)
+
+                db.session.commit()
+                return location_ids
+
+            except (StaleDataError, IntegrityError):
+                # Another worker appended to or created the same segment (or segmentation checkpoint);
+                # retry on fresh state
+                db.session.rollback()
+                if attempt == 2:
+                    raise
+
+    @staticmethod
+    def record_locations(rows):
+        """Persist validated location rows, synchronously or via the write-behind buffer
+
+        Redundant fixes from stationary devices are dropped first when the
+        dead-band filter is enabled. Returns a dict with the number of rows
+        saved, queued and dropped. Raises WriteBufferFull when write-behind is
+        enabled and the buffer is full.
+        """
+        dropped = 0
+        pending = None
+        if active_config.LOCATION_DEADBAND_ENABLED:
+            rows, dropped, pending = location_dead_band.filter_rows(rows)
+
+        if not rows:
+            if pending is not None:
+                location_dead_band.commit(pending)
+            return {'saved': 0, 'queued': 0, 'dropped': dropped, 'location_ids': []}
+
+        saved, queued, location_ids = 0, 0, []
+        if location_write_buffer.running:
+            queued = location_write_buffer.enqueue(rows)
+        else:
+            location_ids = LocationService.save_locations(rows)
+            saved = len(rows)
+            if len(location_ids) == len(rows):
+                for row, location_id in zip(rows, location_ids):
+                    row['id'] = location_id
+
+        # Only now that the rows are stored (or queued) may later fixes be compared against them
+        if pending is not None:
+            location_dead_band.commit(pending)
+        last_known_positions.update_from_rows(rows)
+        movement_states.update_from_rows(rows)
+        LocationService._evaluate_geofences(rows)
+        return {'saved': saved, 'queued': queued, 'dropped': dropped, 'location_ids': location_ids}
+
+    @staticmethod
+    def _evaluate_geofences(rows):
+        """Check stored fixes against geofences; failures never reject the fixes"""
+        from services.geofence_service import GeofenceService
+        
+        try:
+            return GeofenceService.evaluate_rows(rows)
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error evaluating geofences: {str(e)}")
+            return []
+
+    @staticmethod
+    def get_latest_location(user_id):
+        """Get the user's most recent fix from the last-known-position cache"""
+        return last_known_positions.get(user_id)
+
+    @staticmethod
+    def get_movement_state(user_id):
+        """Get the user's rolling speed/heading state (rebuilt from history if not in memory)"""
+        return movement_states.get(user_id)
+
+    @staticmethod
+    def load_latest_location(user_id):
+        """Read the user's most recent fix from whichever storage holds history"""
+        if active_config.LOCATION_HISTORY_STORAGE == 'segments':
+            point = next(TrackSegmentService.iter_points(user_id), None)
+            return CachedPosition.from_row(dict(point, user_id=user_id)) if point else None
+
+        latest_location = LocationHistory.query.filter_by(user_id=user_id) \
+            .order_by(LocationHistory.timestamp.desc()).first()
+        return CachedPosition.from_model(latest_location) if latest_location else None
+
+    @staticmethod
+    def iter_history(user_id, start=None, end=None, descending=True):
+        """Yield a user's fixes as dicts with datetime timestamps from the configured storage"""
+        if active_config.LOCATION_HISTORY_STORAGE == 'segments':
+            yield from TrackSegmentService.iter_points(user_id, start, end, descending)
+            return
+
+        query = LocationHistory.query.filter_by(user_id=user_id)
+        if start is not None:
+            query = query.filter(LocationHistory.timestamp >= start)
+        if end is not None:
+            query = query.filter(LocationHistory.timestamp <= end)
+
+        if descending:
+            query = query.order_by(LocationHistory.timestamp.desc(), LocationHistory.id.desc())
+        else:
+            query = query.order_by(LocationHistory.timestamp.asc(), LocationHistory.id.asc())
+
+        for location in query.yield_per(500):
+            yield {
+                'id': location.id,
+                'latitude': location.latitude,
+                'longitude': location.longitude,
+                'accuracy': location.accuracy,
+                'altitude': location.altitude,
+                'speed': location.speed,
+                'heading': location.heading,
+                'timestamp': location.timestamp
+            }
+
+    @staticmethod
+    def geohash_ranges(column, prefixes):
+        """SQL condition matching geohash column values under any of the prefixes"""
+        return db.or_(*[db.and_(column >= prefix, column < prefix + geohash.PREFIX_END) for prefix in prefixes])
+
+    @staticmethod
+    def find_in_bbox(query, model, min_lat, min_lon, max_lat, max_lon):
+        """Narrow a query on a model with geohash/latitude/longitude columns to a bounding box
+
+        The box becomes a few geohash prefix range scans on the indexed column;
+        the exact coordinate check only runs on rows inside those cells.
+        """
+        prefixes = geohash.cover_bbox(min_lat, min_lon, max_lat, max_lon,
+                                      max_cells=active_config.GEOHASH_QUERY_MAX_CELLS,
+                                      max_precision=active_config.GEOHASH_PRECISION)
+        return query.filter(
+            LocationService.geohash_ranges(model.geohash, prefixes),
+            model.latitude.between(min_lat, max_lat),
+            model.longitude.between(min_lon, max_lon)
+        )
+
+    @staticmethod
+    def find_within_radius(query, model, latitude, longitude, radius, limit=None):
+        """Rows of a query within radius meters of a point, nearest first
+
+        Candidates come from geohash prefix range scans over the circle's
+        bounding box and are then filtered by exact haversine distance.
+        Returns a list of (row, distance_in_meters).
+        """
+        min_lat, min_lon, max_lat, max_lon = geohash.radius_bbox(latitude, longitude, radius)
+        candidates = LocationService.find_in_bbox(query, model, min_lat, min_lon, max_lat, max_lon).all()
+        if not candidates:
+            return []
+
+        distances = LocationService.distances_to_point(
+            latitude, longitude,
+            [row.latitude for row in candidates],
+            [row.longitude for row in candidates]
+        )
+        matches = sorted(
+            ((row, float(distance)) for row, distance in zip(candidates, distances) if distance <= radius),
+            key=lambda match: match[1]
+        )
+        return matches[:limit] if limit is not None else matches
+
     @staticmethod
     def clean_old_locations(user_id):
         """Remove old location history entries"""
@@ -88,75 +441,298 @@ class LocationService:
         LocationHistory.query.filter_by(user_id=user_id) \
             .filter(LocationHistory.timestamp < cutoff_date).delete()
         
+        # Delete encoded segments that lie entirely before the cutoff
+        LocationSegment.query.filter_by(user_id=user_id) \
+            .filter(LocationSegment.end_time < cutoff_date).delete()
+        
         db.session.commit()
+        
+        # The cached position may have been among the deleted rows
+        last_known_positions.invalidate(user_id)
+        location_dead_band.reset(user_id)
+        movement_states.invalidate(user_id)
     
     @staticmethod
     def get_nearby_places(latitude, longitude, place_type, radius=1000):
-        """Get nearby places using Overpass API"""
-        overpass_url = "https://overpass-api.de/api/interpreter"
-        
-        # Define the Overpass query based on place type
-        if place_type == 'police':
-            query = f"""
-            [out:json];
-            node["amenity"="police"](around:{radius},{latitude},{longitude});
-            out body;
-            """
-        elif place_type == 'hospital':
-            query = f"""
-            [out:json];
-            node["amenity"="hospital"](around:{radius},{latitude},{longitude});
-            out body;
-            """
-        elif place_type == 'shelter':
-            query = f"""
-            [out:json];
-            node["social_facility"="shelter"](around:{radius},{latitude},{longitude});
-            out body;
-            """
-        else:
+        """Get nearby places of one type, or None when the lookup failed (see get_nearby_places_by_type)"""
+        if place_type not in PLACE_TYPE_TAGS:
             return []
         
-        try:
-            response = requests.post(overpass_url, data={"data": query})
-            data = response.json()
-            
-            # Extract relevant information
-            places = []
-            for element in data.get('elements', []):
-                if element.get('type') == 'node':
-                    places.append({
-                        'id': element.get('id'),
-                        'name': element.get('tags', {}).get('name', 'Unknown'),
-                        'latitude': element.get('lat'),
-                        'longitude': element.get('lon'),
-                        'type': place_type,
-                        'address': element.get('tags', {}).get('addr:full', ''),
-                        'phone': element.get('tags', {}).get('phone', '')
-                    })
-            
-            return places
+        return LocationService.get_nearby_places_by_type(latitude, longitude, [place_type], radius)[place_type]
+    
+    @staticmethod
+    def get_nearby_places_by_type(latitude, longitude, place_types, radius=1000):
+        """Get nearby places for several types at once, as {place_type: [places]}
+
+        Each type is answered from the nearby-places cache when possible; all
+        missing types are then fetched together in one backend request (a
+        single Overpass union query) for the whole cache cell. The backend is
+        selected by PLACES_BACKEND: 'overpass' queries the live Overpass API,
+        'local' the offline POI store, and 'local_then_overpass' uses the store
+        wherever an imported extract covers the location and Overpass elsewhere.
+        Unknown types are ignored. Types whose lookup failed map to None rather
+        than [], so callers can tell an unreachable backend from no places.
+        """
+        results = {}
+        missing = []
+        for place_type in dict.fromkeys(place_types):
+            if place_type not in PLACE_TYPE_TAGS:
+                continue
+            places = nearby_places_cache.get(place_type, latitude, longitude, radius)
+            if places is None:
+                missing.append(place_type)
+            else:
+                results[place_type] = places
         
+        if not missing:
+            return results
+        
+        center_lat, center_lon, fetch_radius = nearby_places_cache.fetch_region(latitude, longitude, radius)
+        try:
+            # Concurrent misses for the same cell share one upstream request
+            fetched = geo_lookups.do(
+                ('places', tuple(sorted(missing)), center_lat, center_lon, fetch_radius),
+                LocationService.fetch_places, center_lat, center_lon, missing, fetch_radius
+            )
         except Exception as e:
+            # Failures are not cached, so the next request retries
             print(f"Error fetching nearby places: {str(e)}")
+            fetched = None
+        
+        for place_type in missing:
+            if fetched is None:
+                results[place_type] = None
+                continue
+            nearby_places_cache.set(place_type, center_lat, center_lon, fetch_radius, fetched[place_type])
+            results[place_type] = nearby_places_cache.filter(fetched[place_type], latitude, longitude, radius)
+        
+        return results
+    
+    @staticmethod
+    def get_nearest_places(latitude, longitude, k=10, place_types=None, max_radius=None):
+        """The k places nearest to a point across several types, nearest first, each with its 'distance'
+
+        Where the offline POI store serves the location (see PLACES_BACKEND)
+        this is an expanding-radius R*Tree search ranked by exact distance;
+        elsewhere the combined cached radius lookups for max_radius are ranked.
+        Defaults to SAFE_PLACE_TYPES within SAFE_PLACES_MAX_RADIUS_METERS.
+        Returns None when no type could be looked up.
+        """
+        place_types = [place_type for place_type in (place_types or active_config.SAFE_PLACE_TYPES)
+                       if place_type in PLACE_TYPE_TAGS]
+        max_radius = max_radius or active_config.SAFE_PLACES_MAX_RADIUS_METERS
+        if not place_types or k <= 0:
             return []
+        
+        backend = active_config.PLACES_BACKEND
+        if backend == 'local' or (backend == 'local_then_overpass' and poi_store.covers(latitude, longitude)):
+            try:
+                return poi_store.nearest(latitude, longitude, place_types, k, max_radius,
+                                         LocationService.distances_to_point)
+            except sqlite3.Error as e:
+                print(f"Error querying local places: {str(e)}")
+        
+        by_type = LocationService.get_nearby_places_by_type(latitude, longitude, place_types, max_radius)
+        if all(found is None for found in by_type.values()):
+            return None
+        places = [place for found in by_type.values() if found is not None for place in found]
+        return heapq.nsmallest(k, places, key=lambda place: place['distance'])
+    
+    @staticmethod
+    def fetch_places(latitude, longitude, place_types, radius):
+        """Query the configured places backend directly for {place_type: [places]}; raises on failure"""
+        backend = active_config.PLACES_BACKEND
+        
+        if backend == 'local' or (backend == 'local_then_overpass' and poi_store.covers(latitude, longitude)):
+            try:
+                return {
+                    place_type: poi_store.nearby(latitude, longitude, place_type, radius,
+                                                 LocationService.calculate_distance)
+                    for place_type in place_types
+                }
+            except sqlite3.Error as e:
+                if backend == 'local':
+                    raise
+                print(f"Error querying local places: {str(e)}")
+        
+        return LocationService.fetch_overpass_places(latitude, longitude, place_types, radius)
+    
+    @staticmethod
+    def fetch_overpass_places(latitude, longitude, place_types, radius=1000):
+        """Get nearby places of several types with one Overpass union query; raises on errors"""
+        # One union query covering every requested place type
+        statements = "\n        ".join(
+            f'node["{key}"="{value}"](around:{radius},{latitude},{longitude});'
+            for key, value in (PLACE_TYPE_TAGS[place_type] for place_type in place_types)
+        )
+        query = f"""
+        [out:json][timeout:{active_config.OVERPASS_QUERY_TIMEOUT_SECONDS}];
+        (
+        {statements}
+        );
+        out body;
+        """
+        
+        response = overpass_client.post(data={"data": query})
+        response.raise_for_status()
+        data = response.json()
+        
+        # Extract relevant information and split it by place type
+        places = {place_type: [] for place_type in place_types}
+        for element in data.get('elements', []):
+            if element.get('type') != 'node':
+                continue
+            place = place_from_tags(element.get('id'), element.get('lat'), element.get('lon'), element.get('tags', {}))
+            if place and place['type'] in places:
+                places[place['type']].append(place)
+        
+        return places
     
     @staticmethod
     def get_country_from_coordinates(latitude, longitude):
-        """Get country code from coordinates using Geoapify API"""
+        """Get country code from coordinates, offline when boundary data is installed
+
+        Falls back to the Geoapify API when no local boundary data covers the
+        point, and to 'US' when that is unavailable too.
+        """
+        try:
+            country_code = reverse_geocoder.country(float(latitude), float(longitude))
+        except (TypeError, ValueError) as e:
+            print(f"Error getting country from coordinates: {str(e)}")
+            return 'US'
+        
+        if country_code:
+            return country_code
+        
         if not active_config.GEOAPIFY_API_KEY:
             return 'US'  # Default to US if no API key
         
         try:
-            url = f"https://api.geoapify.com/v1/geocode/reverse?lat={latitude}&lon={longitude}&apiKey={active_config.GEOAPIFY_API_KEY}"
-            response = requests.get(url)
-            data = response.json()
-            
-            # Extract country code
-            country_code = data.get('features', [{}])[0].get('properties', {}).get('country_code', 'US').upper()
-            
-            return country_code
+            # ~100 m precision is plenty for a country and lets nearby callers share a request
+            latitude, longitude = round(float(latitude), 3), round(float(longitude), 3)
+            return geo_lookups.do(
+                ('country', latitude, longitude),
+                LocationService.fetch_country_code, latitude, longitude
+            )
         
         except Exception as e:
             print(f"Error getting country from coordinates: {str(e)}")
             return 'US'  # Default to US on error
+    
+    @staticmethod
+    def get_timezone(latitude, longitude):
+        """IANA timezone at the coordinates from local boundary data, or None"""
+        try:
+            tzid = reverse_geocoder.timezone(float(latitude), float(longitude))
+        except (TypeError, ValueError) as e:
+            print(f"Error getting timezone from coordinates: {str(e)}")
+            return None
+        if tzid is None:
+            return None
+        try:
+            return ZoneInfo(tzid)
+        except (ZoneInfoNotFoundError, ValueError):
+            return None
+    
+    @staticmethod
+    def get_local_time(latitude=None, longitude=None, now=None):
+        """Current time at the coordinates as a naive local datetime (UTC when unknown)"""
+        now = now or datetime.utcnow()
+        if latitude is None or longitude is None:
+            return now
+        
+        timezone_info = LocationService.get_timezone(latitude, longitude)
+        if timezone_info is None:
+            return now
+        return now.replace(tzinfo=timezone.utc).astimezone(timezone_info).replace(tzinfo=None)
+    
+    @staticmethod
+    def fetch_country_code(latitude, longitude):
+        """Reverse geocode a coordinate to an ISO country code via Geoapify; raises on errors"""
+        response = geoapify_client.get(params={
+            'lat': latitude,
+            'lon': longitude,
+            'apiKey': active_config.GEOAPIFY_API_KEY
+        })
+        response.raise_for_status()
+        data = response.json()
+        
+        # Extract country code
+        return data.get('features', [{}])[0].get('properties', {}).get('country_code', 'US').upper()
+
+
+# Latest fix per user, shared by tracking, SOS and recommendation lookups
+last_known_positions = LastKnownPositionCache(
+    LocationService.load_latest_location,
+    maxsize=active_config.LAST_KNOWN_POSITION_CACHE_SIZE,
+    ttl=active_config.LAST_KNOWN_POSITION_CACHE_TTL_SECONDS
+)
+
+# Rolling per-user speed/heading state, updated once per ingested fix
+movement_states = MovementStateStore(
+    LocationService.iter_history,
+    LocationService.calculate_distance,
+    LocationService.calculate_heading,
+    window=active_config.MOVEMENT_STATE_WINDOW,
+    min_heading_distance=active_config.MOVEMENT_STATE_MIN_HEADING_DISTANCE_METERS,
+    maxsize=active_config.MOVEMENT_STATE_CACHE_SIZE,
+    ttl=active_config.MOVEMENT_STATE_CACHE_TTL_SECONDS
+)
+
+# Ingest-time filter for redundant stationary fixes (see LOCATION_DEADBAND_*)
+location_dead_band = DeadBandFilter(
+    LocationService.calculate_distance,
+    window_seconds=active_config.LOCATION_DEADBAND_WINDOW_SECONDS,
+    heartbeat_seconds=active_config.LOCATION_DEADBAND_HEARTBEAT_SECONDS,
+    min_radius=active_config.LOCATION_DEADBAND_MIN_RADIUS_METERS,
+    max_radius=active_config.LOCATION_DEADBAND_MAX_RADIUS_METERS,
+    seed_func=last_known_positions.get
+)
+
+# Opt-in group-commit buffer for LocationHistory inserts (see LOCATION_WRITE_BEHIND)
+location_write_buffer = WriteBehindBuffer(LocationService.save_locations, name='location-write-buffer')
+
+# Offline safe-places store (see PLACES_BACKEND and `flask import-pois`)
+poi_store = PoiStore(active_config.POI_DATABASE_PATH)
+
+# Superset results per (place type, geohash cell), shared by the map and recommendations
+nearby_places_cache = NearbyPlacesCache(
+    LocationService.calculate_distance,
+    precision=active_config.NEARBY_PLACES_CACHE_PRECISION,
+    min_radius=active_config.NEARBY_PLACES_CACHE_MIN_RADIUS_METERS,
+    maxsize=active_config.NEARBY_PLACES_CACHE_SIZE,
+    ttl=active_config.NEARBY_PLACES_CACHE_TTL_SECONDS
+)
+
+# Coalesces concurrent identical outbound lookups (nearby places, reverse geocoding)
+geo_lookups = SingleFlight(timeout=active_config.GEO_LOOKUP_COALESCE_TIMEOUT_SECONDS)
+
+# Pooled, time-bounded, circuit-broken clients for the external geo APIs
+overpass_client = UpstreamClient(
+    'overpass',
+    active_config.OVERPASS_API_URL,
+    connect_timeout=active_config.HTTP_CONNECT_TIMEOUT_SECONDS,
+    read_timeout=active_config.OVERPASS_QUERY_TIMEOUT_SECONDS + 2,
+    max_concurrency=active_config.HTTP_MAX_CONCURRENCY_PER_UPSTREAM,
+    acquire_timeout=active_config.HTTP_ACQUIRE_TIMEOUT_SECONDS,
+    failure_threshold=active_config.HTTP_CIRCUIT_FAILURE_THRESHOLD,
+    reset_timeout=active_config.HTTP_CIRCUIT_RESET_SECONDS
+)
+geoapify_client = UpstreamClient(
+    'geoapify',
+    active_config.GEOAPIFY_REVERSE_URL,
+    connect_timeout=active_config.HTTP_CONNECT_TIMEOUT_SECONDS,
+    read_timeout=active_config.HTTP_READ_TIMEOUT_SECONDS,
+    max_concurrency=active_config.HTTP_MAX_CONCURRENCY_PER_UPSTREAM,
+    acquire_timeout=active_config.HTTP_ACQUIRE_TIMEOUT_SECONDS,
+    failure_threshold=active_config.HTTP_CIRCUIT_FAILURE_THRESHOLD,
+    reset_timeout=active_config.HTTP_CIRCUIT_RESET_SECONDS
+)
+
+# Offline country/timezone lookups (see REVERSE_GEOCODER_*_PATH)
+reverse_geocoder = ReverseGeocoder(
+    active_config.REVERSE_GEOCODER_COUNTRIES_PATH,
+    active_config.REVERSE_GEOCODER_TIMEZONES_PATH,
+    memo_precision=active_config.REVERSE_GEOCODER_MEMO_PRECISION,
+    memo_size=active_config.REVERSE_GEOCODER_MEMO_SIZE
+)
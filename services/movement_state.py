@@ -0,0 +1,150 @@
+"""
+Incremental per-user movement state, updated once per ingested fix
+"""
+
+from collections import deque
+from itertools import islice
+from utils.cache import LRUCache
+
+class MovementState:
+    """Rolling speed and heading statistics over a user's most recent fixes"""
+
+    def __init__(self, user_id, window=5, min_heading_distance=5.0, speed_smoothing=0.3):
+        self.user_id = user_id
+        self.min_heading_distance = min_heading_distance
+        self.speed_smoothing = speed_smoothing
+
+        self.latitude = None
+        self.longitude = None
+        self.timestamp = None
+        self.speed = None          # Device speed, or derived from the previous fix
+        self.heading = None        # Device heading, or derived from the previous fix
+        self.speed_average = None  # Exponentially weighted moving average (m/s)
+        self.fix_count = 0
+        self.version = 0           # Bumped on every update; lets callers detect changes
+
+        # Track headings between consecutive fixes over the window (n fixes -> n-1 headings)
+        self.track_headings = deque(maxlen=max(window - 1, 1))
+
+    def update(self, fix, distance_func, bearing_func):
+        """Fold one fix (dict with latitude/longitude/timestamp/speed/heading) into the state
+
+        Returns False for fixes older than the current state, which are ignored.
+        """
+        if self.timestamp is not None and fix['timestamp'] < self.timestamp:
+            return False
+
+        speed = fix.get('speed')
+        heading = fix.get('heading')
+
+        if self.timestamp is not None:
+            distance = distance_func(self.latitude, self.longitude, fix['latitude'], fix['longitude'])
+            elapsed = (fix['timestamp'] - self.timestamp).total_seconds()
+
+            if speed is None and elapsed > 0:
+                speed = distance / elapsed
+
+            # Ignore jitter: a heading over a few meters is mostly GPS noise
+            if distance >= self.min_heading_distance:
+                track_heading = bearing_func(self.latitude, self.longitude, fix['latitude'], fix['longitude'])
+                self.track_headings.append(track_heading)
+                if heading is None:
+                    heading = track_heading
+
+        if speed is not None:
+            if self.speed_average is None:
+                self.speed_average = speed
+            else:
+                self.speed_average += self.speed_smoothing * (speed - self.speed_average)
+
+        self.latitude = fix['latitude']
+        self.longitude = fix['longitude']
+        self.timestamp = fix['timestamp']
+        self.speed = speed
+        self.heading = heading
+        self.fix_count += 1
+        self.version += 1
+        return True
+
+    @property
+    def heading_changes(self):
+        """Absolute heading changes (0-180 degrees) between consecutive track headings"""
+        headings = list(self.track_headings)
+        changes = []
+        for previous, current in zip(headings, headings[1:]):
+            change = abs(current - previous)
+            changes.append(360 - change if change > 180 else change)
+        return changes
+
+    @property
+    def max_heading_change(self):
+        """Largest heading change over the window, or 0"""
+        return max(self.heading_changes, default=0.0)
+
+    def to_dict(self):
+        """Convert movement state to dictionary (for API responses)"""
+        changes = self.heading_changes
+        return {
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'timestamp': self.timestamp.isoformat() if self.timestamp else None,
+            'speed': self.speed,
+            'speed_average': self.speed_average,
+            'heading': self.heading,
+            'max_heading_change': max(changes, default=0.0),
+            'mean_heading_change': sum(changes) / len(changes) if changes else 0.0,
+            'fix_count': self.fix_count,
+            'version': self.version
+        }
+
+class MovementStateStore:
+    """Bounded LRU of MovementState objects, rebuilt from recent history on a miss
+
+    ``history_func(user_id)`` must yield the user's fixes newest first.
+    """
+
+    def __init__(self, history_func, distance_func, bearing_func, window=5, min_heading_distance=5.0,
+                 maxsize=10000, ttl=None):
+        self.history_func = history_func
+        self.distance_func = distance_func
+        self.bearing_func = bearing_func
+        self.window = window
+        self.min_heading_distance = min_heading_distance
+        self._states = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def _new_state(self, user_id):
+        return MovementState(user_id, window=self.window, min_heading_distance=self.min_heading_distance)
+
+    def rebuild(self, user_id):
+        """Replay the last few fixes from history into a fresh state"""
+        state = self._new_state(user_id)
+        history = self.history_func(user_id)
+        recent = list(islice(history, self.window))
+        if hasattr(history, 'close'):
+            history.close()
+
+        for fix in reversed(recent):
+            state.update(fix, self.distance_func, self.bearing_func)
+
+        self._states.set(user_id, state)
+        return state
+
+    def get(self, user_id):
+        """Get the user's movement state in O(1), rebuilding it after a restart or eviction"""
+        state = self._states.get(user_id)
+        if state is None:
+            state = self.rebuild(user_id)
+        return state
+
+    def update_from_rows(self, rows):
+        """Fold newly ingested rows into their users' states"""
+        for row in sorted(rows, key=lambda r: r['timestamp']):
+            state = self._states.peek(row['user_id'])
+            if state is None:
+                # Cold users are rebuilt lazily on first read, from history that will include this row
+                continue
+            state.update(row, self.distance_func, self.bearing_func)
+
+    def invalidate(self, user_id):
+        """Forget the user's state"""
+        self._states.pop(user_id)
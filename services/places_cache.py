@@ -0,0 +1,78 @@
+"""
+Spatially keyed cache for nearby-places lookups
+"""
+
+from utils import geohash
+from utils.cache import LRUCache
+
+class NearbyPlacesCache:
+    """TTL/LRU cache of place lookups keyed by (place_type, geohash cell)
+
+    A miss fetches a superset: the circle around the cell's center that
+    contains every query circle of at least min_radius centered anywhere in
+    the cell. Later queries from the same cell are answered by filtering that
+    superset by distance, as long as their circle fits inside it.
+    """
+
+    def __init__(self, distance_func, precision=6, min_radius=2000, maxsize=5000, ttl=3600):
+        self.distance_func = distance_func
+        self.precision = precision
+        self.min_radius = min_radius
+        self._entries = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, place_type, latitude, longitude):
+        return place_type, geohash.encode(latitude, longitude, self.precision)
+
+    def fetch_region(self, latitude, longitude, radius):
+        """(center_latitude, center_longitude, radius) to fetch so the result covers the whole cell"""
+        min_lat, min_lon, max_lat, max_lon = geohash.decode_bbox(geohash.encode(latitude, longitude, self.precision))
+        center_lat, center_lon = (min_lat + max_lat) / 2, (min_lon + max_lon) / 2
+        half_diagonal = max(
+            self.distance_func(center_lat, center_lon, min_lat, min_lon),
+            self.distance_func(center_lat, center_lon, max_lat, min_lon)
+        )
+        return center_lat, center_lon, max(radius, self.min_radius) + half_diagonal
+
+    def filter(self, places, latitude, longitude, radius):
+        """Copies of the places within radius meters of a point, nearest first, each with its 'distance'"""
+        matches = []
+        for place in places:
+            distance = self.distance_func(latitude, longitude, place['latitude'], place['longitude'])
+            if distance <= radius:
+                matches.append((distance, place))
+        matches.sort(key=lambda match: match[0])
+        return [dict(place, distance=round(distance, 1)) for distance, place in matches]
+
+    def get(self, place_type, latitude, longitude, radius):
+        """Places within radius of the point if a cached superset covers the query, else None"""
+        entry = self._entries.get(self._key(place_type, latitude, longitude))
+        if entry is not None:
+            center_lat, center_lon, fetched_radius, places = entry
+            if self.distance_func(center_lat, center_lon, latitude, longitude) + radius <= fetched_radius:
+                self.hits += 1
+                return self.filter(places, latitude, longitude, radius)
+
+        self.misses += 1
+        return None
+
+    def set(self, place_type, center_lat, center_lon, fetched_radius, places):
+        """Cache a superset fetched for the cell containing the center"""
+        self._entries.set(self._key(place_type, center_lat, center_lon),
+                          (center_lat, center_lon, fetched_radius, places))
+
+    def clear(self):
+        """Forget every cached lookup (e.g. after importing new POIs)"""
+        self._entries.clear()
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        lookups = self.hits + self.misses
+        stats = self._entries.stats()
+        stats.update(
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=round(self.hits / lookups, 4) if lookups else 0.0
+        )
+        return stats
@@ -0,0 +1,259 @@
+"""
+Offline point-of-interest store backed by SQLite with an R*Tree index
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from utils.geohash import radius_bbox
+
+# OSM tag identifying each supported place type (shared with the Overpass queries)
+PLACE_TYPE_TAGS = {
+    'police': ('amenity', 'police'),
+    'hospital': ('amenity', 'hospital'),
+    'shelter': ('social_facility', 'shelter'),
+    'fire_station': ('amenity', 'fire_station'),
+    'pharmacy': ('amenity', 'pharmacy')
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pois (
+    id INTEGER PRIMARY KEY,
+    osm_id INTEGER,
+    place_type TEXT NOT NULL,
+    name TEXT,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+    address TEXT,
+    phone TEXT
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS pois_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon);
+CREATE TABLE IF NOT EXISTS coverage (
+    id INTEGER PRIMARY KEY,
+    source TEXT,
+    min_lat REAL, max_lat REAL, min_lon REAL, max_lon REAL,
+    imported_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+def place_type_from_tags(tags):
+    """Place type for a set of OSM tags, or None"""
+    for place_type, (key, value) in PLACE_TYPE_TAGS.items():
+        if tags.get(key) == value:
+            return place_type
+    return None
+
+def place_from_tags(osm_id, latitude, longitude, tags):
+    """Build a place dict (same shape as the Overpass results) from OSM tags"""
+    place_type = place_type_from_tags(tags)
+    if place_type is None or latitude is None or longitude is None:
+        return None
+    return {
+        'id': osm_id,
+        'name': tags.get('name', 'Unknown'),
+        'latitude': float(latitude),
+        'longitude': float(longitude),
+        'type': place_type,
+        'address': tags.get('addr:full', ''),
+        'phone': tags.get('phone', '')
+    }
+
+def read_osm_json(path):
+    """Yield places from Overpass JSON output (`out center;` for ways) or a GeoJSON FeatureCollection"""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+
+    for element in data.get('elements', []):
+        center = element.get('center', {})
+        place = place_from_tags(
+            element.get('id'),
+            element.get('lat', center.get('lat')),
+            element.get('lon', center.get('lon')),
+            element.get('tags', {})
+        )
+        if place:
+            yield place
+
+    for feature in data.get('features', []):
+        geometry = feature.get('geometry') or {}
+        if geometry.get('type') != 'Point':
+            continue
+        properties = feature.get('properties', {})
+        longitude, latitude = geometry['coordinates'][:2]
+        place = place_from_tags(properties.get('@id', feature.get('id')), latitude, longitude, properties)
+        if place:
+            yield place
+
+def read_osm_pbf(path):
+    """Yield places from an OSM PBF extract (requires the optional `osmium` package)"""
+    try:
+        import osmium
+    except ImportError:
+        raise RuntimeError('Reading .pbf extracts requires the osmium package (pip install osmium)')
+
+    places = []
+
+    class PlaceHandler(osmium.SimpleHandler):
+        def node(self, node):
+            place = place_from_tags(node.id, node.location.lat, node.location.lon, dict(node.tags))
+            if place:
+                places.append(place)
+
+        def way(self, way):
+            tags = dict(way.tags)
+            if place_type_from_tags(tags) is None:
+                return
+            # Buildings are mapped as ways; use the mean of their node locations
+            locations = [(n.lat, n.lon) for n in way.nodes if n.location.valid()]
+            if locations:
+                latitude = sum(l[0] for l in locations) / len(locations)
+                longitude = sum(l[1] for l in locations) / len(locations)
+                places.append(place_from_tags(way.id, latitude, longitude, tags))
+
+    PlaceHandler().apply_file(path, locations=True)
+    return places
+
+class PoiStore:
+    """Radius and nearest-neighbour queries over locally imported safe places
+
+    Lives in its own SQLite file so it can be rebuilt and swapped without
+    touching the application database.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    @property
+    def available(self):
+        """Whether an imported store exists on disk"""
+        return os.path.exists(self.path)
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            self._local.connection = connection
+        return connection
+
+    def close(self):
+        """Close this thread's connection (e.g. before replacing the file)"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def import_places(self, places, source=None, replace=True, bounds=None):
+        """Load places into the store in one transaction; returns the number imported
+
+        The extract's bounds (min_lat, max_lat, min_lon, max_lon), or else the
+        bounding box of the imported places, is recorded as coverage so callers
+        can tell "no places nearby" apart from "no data for this area".
+        """
+        connection = self._connection()
+        connection.executescript(SCHEMA)
+
+        with connection:
+            if replace:
+                connection.execute('DELETE FROM pois')
+                connection.execute('DELETE FROM pois_rtree')
+                connection.execute('DELETE FROM coverage')
+
+            count = 0
+            extent = [90.0, -90.0, 180.0, -180.0]
+            for place in places:
+                cursor = connection.execute(
+                    'INSERT INTO pois (osm_id, place_type, name, latitude, longitude, address, phone) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (place['id'], place['type'], place['name'], place['latitude'], place['longitude'],
+                     place['address'], place['phone'])
+                )
+                connection.execute(
+                    'INSERT INTO pois_rtree (id, min_lat, max_lat, min_lon, max_lon) VALUES (?, ?, ?, ?, ?)',
+                    (cursor.lastrowid, place['latitude'], place['latitude'], place['longitude'], place['longitude'])
+                )
+                extent = [min(extent[0], place['latitude']), max(extent[1], place['latitude']),
+                          min(extent[2], place['longitude']), max(extent[3], place['longitude'])]
+                count += 1
+
+            if bounds is not None or count:
+                connection.execute(
+                    'INSERT INTO coverage (source, min_lat, max_lat, min_lon, max_lon) VALUES (?, ?, ?, ?, ?)',
+                    (source, *(bounds or extent))
+                )
+
+        return count
+
+    def covers(self, latitude, longitude):
+        """Whether an imported extract covers the point"""
+        if not self.available:
+            return False
+        try:
+            row = self._connection().execute(
+                'SELECT 1 FROM coverage WHERE ? BETWEEN min_lat AND max_lat AND ? BETWEEN min_lon AND max_lon LIMIT 1',
+                (latitude, longitude)
+            ).fetchone()
+        except sqlite3.Error:
+            return False
+        return row is not None
+
+    def query_bbox(self, place_types, min_lat, min_lon, max_lat, max_lon):
+        """Places of the given types whose location falls in a bounding box (R*Tree lookup)"""
+        if not self.available or not place_types:
+            return []
+        place_types = list(place_types)
+        rows = self._connection().execute(
+            'SELECT p.osm_id, p.place_type, p.name, p.latitude, p.longitude, p.address, p.phone '
+            'FROM pois_rtree r JOIN pois p ON p.id = r.id '
+            'WHERE r.min_lat >= ? AND r.max_lat <= ? AND r.min_lon >= ? AND r.max_lon <= ? '
+            f'AND p.place_type IN ({", ".join("?" * len(place_types))})',
+            (min_lat, max_lat, min_lon, max_lon, *place_types)
+        ).fetchall()
+        return [{
+            'id': row['osm_id'],
+            'name': row['name'],
+            'latitude': row['latitude'],
+            'longitude': row['longitude'],
+            'type': row['place_type'],
+            'address': row['address'] or '',
+            'phone': row['phone'] or ''
+        } for row in rows]
+
+    def nearby(self, latitude, longitude, place_type, radius, distance_func):
+        """Places of a type within radius meters, nearest first"""
+        candidates = self.query_bbox([place_type], *radius_bbox(latitude, longitude, radius))
+        matches = []
+        for place in candidates:
+            distance = distance_func(latitude, longitude, place['latitude'], place['longitude'])
+            if distance <= radius:
+                matches.append((distance, place))
+        matches.sort(key=lambda match: match[0])
+        return [place for _, place in matches]
+
+    def nearest(self, latitude, longitude, place_types, k, max_radius, distances_func, initial_radius=500):
+        """The k places of the given types nearest to a point (within max_radius), each with a 'distance'
+
+        Searches R*Tree boxes of doubling radius until at least k candidates
+        lie inside the search circle, which guarantees they include the true k
+        nearest, then ranks them with one vectorized distances_func call
+        (point, latitudes, longitudes -> meters).
+        """
+        radius = min(initial_radius, max_radius)
+        while True:
+            candidates = self.query_bbox(place_types, *radius_bbox(latitude, longitude, radius))
+            matches = []
+            if candidates:
+                distances = distances_func(
+                    latitude, longitude,
+                    [place['latitude'] for place in candidates],
+                    [place['longitude'] for place in candidates]
+                )
+                matches = [(float(distance), place) for distance, place in zip(distances, candidates)
+                           if distance <= radius]
+
+            if len(matches) >= k or radius >= max_radius:
+                matches.sort(key=lambda match: match[0])
+                return [dict(place, distance=round(distance, 1)) for distance, place in matches[:k]]
+            radius = min(radius * 2, max_radius)
@@ -0,0 +1,121 @@
+"""
+Last-known-position cache so "where is this user now" never needs an ORDER BY
+"""
+
+from utils.cache import LRUCache
+
+# Cached marker for users with no location history at all
+_NO_POSITION = object()
+
+class CachedPosition:
+    """Read-only snapshot of a user's latest fix, mirroring the LocationHistory interface"""
+
+    __slots__ = ('id', 'user_id', 'latitude', 'longitude', 'accuracy', 'altitude',
+                 'speed', 'heading', 'timestamp')
+
+    def __init__(self, user_id, latitude, longitude, accuracy=None, altitude=None,
+                 speed=None, heading=None, timestamp=None, id=None):
+        self.id = id
+        self.user_id = user_id
+        self.latitude = latitude
+        self.longitude = longitude
+        self.accuracy = accuracy
+        self.altitude = altitude
+        self.speed = speed
+        self.heading = heading
+        self.timestamp = timestamp
+
+    @classmethod
+    def from_row(cls, row):
+        """Build from an insert row dict"""
+        return cls(
+            user_id=row['user_id'],
+            latitude=row['latitude'],
+            longitude=row['longitude'],
+            accuracy=row.get('accuracy'),
+            altitude=row.get('altitude'),
+            speed=row.get('speed'),
+            heading=row.get('heading'),
+            timestamp=row.get('timestamp'),
+            id=row.get('id')
+        )
+
+    @classmethod
+    def from_model(cls, location):
+        """Build from a LocationHistory instance"""
+        return cls(
+            user_id=location.user_id,
+            latitude=location.latitude,
+            longitude=location.longitude,
+            accuracy=location.accuracy,
+            altitude=location.altitude,
+            speed=location.speed,
+            heading=location.heading,
+            timestamp=location.timestamp,
+            id=location.id
+        )
+
+    def to_dict(self):
+        """Same shape as LocationHistory.to_dict"""
+        return {
+            'id': self.id,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'accuracy': self.accuracy,
+            'altitude': self.altitude,
+            'speed': self.speed,
+            'heading': self.heading,
+            'timestamp': self.timestamp.isoformat() if self.timestamp else None
+        }
+
+class LastKnownPositionCache:
+    """Per-user latest fix, updated on ingest and backed by the database on a cold miss
+
+    Cold misses are answered by ``loader(user_id)``, which returns a
+    CachedPosition or None. The cache is per process. When running several workers, set a TTL so a
+    worker that did not see an ingest re-reads the database within bounded time.
+    """
+
+    def __init__(self, loader, maxsize=10000, ttl=None):
+        self.loader = loader
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def update(self, position):
+        """Record a newly ingested fix unless a newer one is already cached"""
+        current = self._cache.peek(position.user_id)
+        if (isinstance(current, CachedPosition) and current.timestamp and position.timestamp
+                and current.timestamp > position.timestamp):
+            return
+        self._cache.set(position.user_id, position)
+
+    def update_from_rows(self, rows):
+        """Record the newest row per user from a batch of insert rows"""
+        newest = {}
+        for row in rows:
+            best = newest.get(row['user_id'])
+            if best is None or row['timestamp'] >= best['timestamp']:
+                newest[row['user_id']] = row
+
+        for row in newest.values():
+            self.update(CachedPosition.from_row(row))
+
+    def get(self, user_id):
+        """Return the user's latest position, reading the database only on a cold miss"""
+        cached = self._cache.get(user_id)
+        if cached is _NO_POSITION:
+            return None
+        if cached is not None:
+            return cached
+
+        position = self.loader(user_id)
+
+        self._cache.set(user_id, position if position is not None else _NO_POSITION)
+        return position
+
+    def invalidate(self, user_id):
+        """Forget the cached position for a user"""
+        self._cache.pop(user_id)
+
+    def stats(self):
+        """Cache size and hit/miss counters"""
+        return self._cache.stats()
@@ -0,0 +1,171 @@
+"""
+Periodic push of safety recommendations to users who are sharing their location
+"""
+
+import time
+from collections import deque
+from datetime import datetime, timedelta
+import gevent
+from extensions import socketio
+from services.job_lease import LeaseService
+from services.location_service import LocationService
+from services.safety_service import SafetyService
+
+class RecommendationPusher:
+    """Ticking greenlet that batches recommendation updates for active sharers
+
+    On every tick it takes at most ``batch_size`` users, round-robin, from
+    those with an active share session and a fix newer than ``recent_seconds``.
+    Users whose inputs (latest fix and local hour) are unchanged since their
+    last turn are skipped; the rest are evaluated in one batched rule-engine
+    pass, and only recommendations they have not been sent yet are emitted
+    as 'safety_recommendations' to their ``user_<id>`` room.
+
+    Every worker process may run a pusher, but only the one holding the
+    database lease pushes; the others take over if it stops renewing.
+    """
+
+    def __init__(self, active_users_func, name='recommendation-push'):
+        self.active_users_func = active_users_func
+        self.name = name
+        self.app = None
+        self.interval = 60.0
+        self.batch_size = 200
+        self.recent_seconds = 600
+        self._greenlet = None
+        self._leader = False
+        self._rotation = deque()  # Users waiting for their turn
+        self._inputs = {}         # user_id -> inputs seen on the user's last turn
+        self._sent = {}           # user_id -> set of (type, message) already pushed
+
+        # Counters exposed through stats()
+        self._ticks = 0
+        self._evaluated = 0
+        self._skipped = 0
+        self._pushed = 0
+        self._last_tick_ms = 0.0
+
+    @property
+    def running(self):
+        """Whether the ticking greenlet is active"""
+        return self._greenlet is not None and not self._greenlet.dead
+
+    def init_app(self, app, interval_seconds=60, batch_size=200, recent_seconds=600):
+        """Bind to an app and start ticking"""
+        self.app = app
+        self.interval = interval_seconds
+        self.batch_size = batch_size
+        self.recent_seconds = recent_seconds
+        self._greenlet = gevent.spawn(self._run)
+
+    def stop(self):
+        """Stop ticking"""
+        if self._greenlet is not None:
+            self._greenlet.kill(block=True)
+
+    def _run(self):
+        """Ticker loop"""
+        while True:
+            gevent.sleep(self.interval)
+            started = time.monotonic()
+            try:
+                with self.app.app_context():
+                    # The lease outlives one missed renewal, so a slow tick does not hand it over
+                    leader = LeaseService.try_acquire(self.name, self.interval * 2)
+                    if leader:
+                        self.tick()
+                    elif self._leader:
+                        self._forget()
+                    self._leader = leader
+            except Exception as e:
+                print(f"Error in {self.name}: {str(e)}")
+            self._last_tick_ms = (time.monotonic() - started) * 1000
+
+    def _forget(self):
+        """Drop per-user state after another process took over pushing"""
+        self._rotation.clear()
+        self._inputs.clear()
+        self._sent.clear()
+
+    def _next_users(self, active_users):
+        """Up to batch_size active users, continuing the rotation where the last tick stopped"""
+        # Forget users who stopped sharing; queue those who started
+        for user_id in [user_id for user_id in self._inputs if user_id not in active_users]:
+            self._inputs.pop(user_id, None)
+            self._sent.pop(user_id, None)
+        queued = set(self._rotation)
+        self._rotation.extend(user_id for user_id in active_users if user_id not in queued)
+
+        users = []
+        for _ in range(len(self._rotation)):
+            if len(users) >= self.batch_size:
+                break
+            user_id = self._rotation.popleft()
+            if user_id in active_users:
+                users.append(user_id)
+                self._rotation.append(user_id)
+        return users
+
+    def tick(self):
+        """Evaluate and push for one batch of users; returns the number of users pushed to"""
+        self._ticks += 1
+        active_users = set(self.active_users_func())
+        cutoff = datetime.utcnow() - timedelta(seconds=self.recent_seconds)
+
+        changed = {}
+        for user_id in self._next_users(active_users):
+            position = LocationService.get_latest_location(user_id)
+            if position is None or position.timestamp is None or position.timestamp < cutoff:
+                continue
+
+            hour = LocationService.get_local_time(position.latitude, position.longitude).hour
+            inputs = (position.timestamp, position.latitude, position.longitude, hour)
+            if self._inputs.get(user_id) == inputs:
+                self._skipped += 1
+                continue
+            self._inputs[user_id] = inputs
+            changed[user_id] = (position.latitude, position.longitude)
+
+        if not changed:
+            return 0
+
+        results = SafetyService.get_recommendations_for_users(list(changed), changed)
+        self._evaluated += len(results)
+
+        pushed = 0
+        for user_id, recommendations in results.items():
+            current = {(recommendation['type'], recommendation['message']) for recommendation in recommendations}
+            sent = self._sent.get(user_id, set())
+            new = [recommendation for recommendation in recommendations
+                   if (recommendation['type'], recommendation['message']) not in sent]
+            # Remember only what is current, so a recommendation that returns is pushed again
+            self._sent[user_id] = current
+            if new:
+                socketio.emit('safety_recommendations', {'recommendations': new}, room=f'user_{user_id}')
+                pushed += 1
+
+        self._pushed += pushed
+        return pushed
+
+    def stats(self):
+        """Tick counters for tuning interval and batch size"""
+        return {
+            'running': self.running,
+            'leader': self._leader,
+            'interval_seconds': self.interval,
+            'batch_size': self.batch_size,
+            'tracked_users': len(self._rotation),
+            'ticks': self._ticks,
+            'evaluated': self._evaluated,
+            'skipped_unchanged': self._skipped,
+            'pushed': self._pushed,
+            'last_tick_ms': round(self._last_tick_ms, 3)
+        }
+
+def sharing_user_ids():
+    """Users with an unexpired location share session"""
+    from routes.location import get_sharing_user_ids
+    return get_sharing_user_ids()
+
+# Started by app.py when RECOMMENDATION_PUSH is enabled
+recommendation_pusher = RecommendationPusher(sharing_user_ids)
@@ -0,0 +1,237 @@
+"""
+Offline reverse geocoder for country codes and timezones from GeoJSON boundary files
+"""
+
+import json
+import os
+from math import cos, radians, floor
+import gevent
+import numpy as np
+from utils import geohash
+from utils.cache import LRUCache
+
+METERS_PER_DEGREE = 111320.0
+
+def feature_value(props, properties):
+    """A feature's value: the first of ``properties`` that is set (Natural Earth marks gaps with -99)"""
+    return next((props[name] for name in properties if props.get(name) not in (None, '', '-99')), None)
+
+def simplify_ring(ring, tolerance):
+    """Douglas-Peucker simplification of a closed ring; tolerance in degrees"""
+    points = [tuple(point[:2]) for point in ring]
+    if len(points) <= 4:
+        return points
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    # The ring is closed, so split it at its farthest point from the start to get two real chords
+    far = max(range(1, len(points) - 1),
+              key=lambda i: (points[i][0] - points[0][0]) ** 2 + (points[i][1] - points[0][1]) ** 2)
+    keep[far] = True
+    stack = [(0, far), (far, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (x1, y1), (x2, y2) = points[first], points[last]
+        dx, dy = x2 - x1, y2 - y1
+        length = (dx * dx + dy * dy) ** 0.5
+        farthest, distance = None, tolerance
+        for i in range(first + 1, last):
+            x, y = points[i]
+            d = abs(dy * (x - x1) - dx * (y - y1)) / length if length else ((x - x1) ** 2 + (y - y1) ** 2) ** 0.5
+            if d > distance:
+                farthest, distance = i, d
+        if farthest is not None:
+            keep[farthest] = True
+            stack.extend(((first, farthest), (farthest, last)))
+    return [point for point, kept in zip(points, keep) if kept]
+
+def simplify_boundaries(data, properties, output_property, tolerance=0.01, digits=4):
+    """Smaller FeatureCollection keeping one property per feature and simplified, rounded rings
+
+    Rings that collapse below a triangle are dropped, as are features left
+    without an outer ring.
+    """
+    features = []
+    for feature in data.get('features', []):
+        value = feature_value(feature.get('properties') or {}, properties)
+        geometry = feature.get('geometry') or {}
+        if value is None or geometry.get('type') not in ('Polygon', 'MultiPolygon'):
+            continue
+        parts = [geometry['coordinates']] if geometry['type'] == 'Polygon' else geometry['coordinates']
+
+        simplified = []
+        for rings in parts:
+            rings = [[[round(x, digits), round(y, digits)] for x, y in simplify_ring(ring, tolerance)]
+                     for ring in rings]
+            # The first ring is the outer boundary; without it the holes mean nothing
+            if rings and len(rings[0]) >= 4:
+                simplified.append([ring for ring in rings if len(ring) >= 4])
+        if simplified:
+            features.append({
+                'type': 'Feature',
+                'properties': {output_property: value},
+                'geometry': {'type': 'MultiPolygon', 'coordinates': simplified}
+            })
+    return {'type': 'FeatureCollection', 'features': features}
+
+class BoundaryPolygon:
+    """One (multi)polygon as flat numpy edge arrays for vectorized tests"""
+
+    def __init__(self, value, rings):
+        self.value = value
+        x1, y1, x2, y2 = [], [], [], []
+        for ring in rings:
+            points = np.asarray(ring, dtype=float)[:, :2]
+            x1.append(points[:-1, 0])
+            y1.append(points[:-1, 1])
+            x2.append(points[1:, 0])
+            y2.append(points[1:, 1])
+        self.x1, self.y1 = np.concatenate(x1), np.concatenate(y1)
+        self.x2, self.y2 = np.concatenate(x2), np.concatenate(y2)
+        self.bounds = (
+            float(min(self.y1.min(), self.y2.min())), float(min(self.x1.min(), self.x2.min())),
+            float(max(self.y1.max(), self.y2.max())), float(max(self.x1.max(), self.x2.max()))
+        )
+
+    def contains(self, latitude, longitude):
+        """Even-odd ray casting over every ring at once (holes cancel out)"""
+        min_lat, min_lon, max_lat, max_lon = self.bounds
+        if not (min_lat <= latitude <= max_lat and min_lon <= longitude <= max_lon):
+            return False
+        straddles = (self.y1 > latitude) != (self.y2 > latitude)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossing = self.x1 + (latitude - self.y1) * (self.x2 - self.x1) / (self.y2 - self.y1)
+        return bool(np.count_nonzero(straddles & (longitude < crossing)) % 2)
+
+    def boundary_distance(self, latitude, longitude):
+        """Approximate distance in meters from the point to the nearest edge"""
+        scale = cos(radians(latitude))
+        ax, ay = (self.x1 - longitude) * scale, self.y1 - latitude
+        bx, by = (self.x2 - longitude) * scale, self.y2 - latitude
+        dx, dy = bx - ax, by - ay
+        length = dx * dx + dy * dy
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.clip(np.where(length > 0, -(ax * dx + ay * dy) / length, 0.0), 0.0, 1.0)
+        px, py = ax + t * dx, ay + t * dy
+        return float(np.sqrt(px * px + py * py).min()) * METERS_PER_DEGREE
+
+class BoundaryIndex:
+    """Polygons bucketed into a uniform grid by bounding box"""
+
+    def __init__(self, polygons, cell_degrees=1.0):
+        self.cell_degrees = cell_degrees
+        self.grid = {}
+        for polygon in polygons:
+            min_lat, min_lon, max_lat, max_lon = polygon.bounds
+            for x in range(floor(min_lat / cell_degrees), floor(max_lat / cell_degrees) + 1):
+                for y in range(floor(min_lon / cell_degrees), floor(max_lon / cell_degrees) + 1):
+                    self.grid.setdefault((x, y), []).append(polygon)
+
+    @classmethod
+    def from_geojson(cls, path, properties, cell_degrees=1.0):
+        """Load a FeatureCollection, taking each feature's value from the first non-empty property"""
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+
+        polygons = []
+        for feature in data.get('features', []):
+            props = feature.get('properties') or {}
+            value = feature_value(props, properties)
+            geometry = feature.get('geometry') or {}
+            if value is None:
+                continue
+            if geometry.get('type') == 'Polygon':
+                polygons.append(BoundaryPolygon(value, geometry['coordinates']))
+            elif geometry.get('type') == 'MultiPolygon':
+                for part in geometry['coordinates']:
+                    polygons.append(BoundaryPolygon(value, part))
+        return cls(polygons, cell_degrees)
+
+    def lookup(self, latitude, longitude):
+        """(value, meters to its boundary) of the polygon containing the point, or (None, 0)"""
+        key = (floor(latitude / self.cell_degrees), floor(longitude / self.cell_degrees))
+        for polygon in self.grid.get(key, ()):
+            if polygon.contains(latitude, longitude):
+                return polygon.value, polygon.boundary_distance(latitude, longitude)
+        return None, 0.0
+
+class ReverseGeocoder:
+    """Country (ISO 3166-1 alpha-2) and IANA timezone lookups without network calls
+
+    Boundary files are parsed by load() or, without blocking the gevent loop,
+    by start_loading(); until a file is loaded (or when it is missing) that
+    lookup returns None. Results are memoized per geohash cell, but only when
+    the point is farther from the boundary than the cell is wide, so every
+    point of a memoized cell has the same answer.
+    """
+
+    def __init__(self, countries_path, timezones_path, country_properties=('ISO_A2_EH', 'ISO_A2', 'iso_a2'),
+                 timezone_properties=('tzid', 'TZID'), memo_precision=6, memo_size=50000):
+        self.paths = {'country': countries_path, 'timezone': timezones_path}
+        self.properties = {'country': country_properties, 'timezone': timezone_properties}
+        self.memo_precision = memo_precision
+        height, width = geohash.cell_size(memo_precision)
+        self.memo_margin = (height ** 2 + width ** 2) ** 0.5 * METERS_PER_DEGREE
+        self._indexes = {}
+        self._greenlet = None
+        self.memo = LRUCache(maxsize=memo_size)
+
+    def _read(self, kind):
+        path = self.paths[kind]
+        if not path or not os.path.exists(path):
+            return None
+        return BoundaryIndex.from_geojson(path, self.properties[kind])
+
+    def load(self):
+        """Parse every boundary file now, in the calling greenlet"""
+        for kind in self.paths:
+            if kind not in self._indexes:
+                self._indexes[kind] = self._read(kind)
+
+    def start_loading(self):
+        """Parse the boundary files on the gevent thread pool; lookups answer None meanwhile"""
+        if self._greenlet is None:
+            self._greenlet = gevent.spawn(self._load_in_background)
+        return self._greenlet
+
+    def _load_in_background(self):
+        threadpool = gevent.get_hub().threadpool
+        for kind in self.paths:
+            if kind in self._indexes:
+                continue
+            try:
+                self._indexes[kind] = threadpool.apply(self._read, (kind,))
+            except Exception as e:
+                print(f"Error loading {kind} boundaries: {str(e)}")
+                self._indexes[kind] = None
+
+    def _index(self, kind):
+        return self._indexes.get(kind)
+
+    def available(self, kind):
+        """Whether boundary data for 'country' or 'timezone' is loaded"""
+        return self._index(kind) is not None
+
+    def _lookup(self, kind, latitude, longitude):
+        index = self._index(kind)
+        if index is None:
+            return None
+
+        key = (kind, geohash.encode(latitude, longitude, self.memo_precision))
+        value = self.memo.get(key)
+        if value is not None:
+            return value
+
+        value, boundary_distance = index.lookup(latitude, longitude)
+        if value is not None and boundary_distance > self.memo_margin:
+            self.memo.set(key, value)
+        return value
+
+    def country(self, latitude, longitude):
+        """ISO country code at the point, or None (no data, or at sea)"""
+        value = self._lookup('country', latitude, longitude)
+        return value.upper() if value else None
+
+    def timezone(self, latitude, longitude):
+        """IANA timezone name at the point, or None"""
+        return self._lookup('timezone', latitude, longitude)
@@ -0,0 +1,284 @@
+"""
+Declarative safety recommendation rules and the engine that evaluates them
+"""
+
+from string import Formatter
+from services.location_service import LocationService
+from config import active_config
+
+NEARBY_PLACES_RADIUS_METERS = 2000
+
+# Each rule fires when all of its conditions hold; the message may reference inputs,
+# e.g. {nearest_police[name]}. Rules are reported in the order they are declared.
+SAFETY_RULES = [
+    # Time-based
+    {
+        'id': 'night_well_lit',
+        'type': 'time',
+        'severity': 'warning',
+        'when': [('hour', 'hour_between', (active_config.NIGHT_START_HOUR, active_config.NIGHT_END_HOUR))],
+        'message': 'It\'s late at night. Stay in well-lit areas and avoid walking alone.'
+    },
+    {
+        'id': 'night_ride',
+        'type': 'time',
+        'severity': 'info',
+        'when': [('hour', 'hour_between', (active_config.NIGHT_START_HOUR, active_config.NIGHT_END_HOUR))],
+        'message': 'Consider using ride-sharing services or taxis instead of walking.'
+    },
+    {
+        'id': 'early_morning',
+        'type': 'time',
+        'severity': 'info',
+        'when': [('hour', 'hour_between', (5, 8))],
+        'message': 'Good morning! If you\'re out for a morning walk or jog, stick to populated areas.'
+    },
+    {
+        'id': 'evening',
+        'type': 'time',
+        'severity': 'info',
+        'when': [('hour', 'hour_between', (17, 20))],
+        'message': 'As it gets darker, be aware of your surroundings and stay in well-lit areas.'
+    },
+    # Location-based
+    {
+        'id': 'no_police_nearby',
+        'type': 'location',
+        'severity': 'warning',
+        'when': [('nearby_police', 'empty', None)],
+        'message': 'No police stations detected nearby. Stay vigilant and keep your phone charged.'
+    },
+    {
+        'id': 'nearest_police',
+        'type': 'location',
+        'severity': 'info',
+        'when': [('nearby_police', 'not_empty', None)],
+        'message': 'Nearest police station: {nearest_police[name]} ({nearest_police[distance]:.0f} meters away)'
+    },
+    {
+        'id': 'no_hospital_nearby',
+        'type': 'location',
+        'severity': 'info',
+        'when': [('nearby_hospitals', 'empty', None)],
+        'message': 'No hospitals detected nearby. Be extra cautious and avoid risky activities.'
+    },
+    {
+        'id': 'isolated_area',
+        'type': 'location',
+        'severity': 'warning',
+        'when': [('nearby_police', 'empty', None), ('nearby_hospitals', 'empty', None)],
+        'message': 'You appear to be in an isolated area. Consider sharing your location with a trusted contact.'
+    },
+    # Behavior-based
+    {
+        'id': 'moving_fast',
+        'type': 'behavior',
+        'severity': 'info',
+        'when': [('moving_fast', 'is', True)],
+        'message': 'You appear to be moving quickly. If you\'re in a vehicle, ensure you\'re with a trusted driver.'
+    },
+    {
+        'id': 'moving_erratically',
+        'type': 'behavior',
+        'severity': 'info',
+        'when': [('moving_erratically', 'is', True)],
+        'message': 'Your movement pattern appears erratic. If you\'re lost, consider using the map to find your way.'
+    }
+]
+
+# All tips are shown when no rule fired, otherwise one per hour in rotation
+GENERAL_TIPS = [
+    'Share your location with a trusted contact when traveling in unfamiliar areas.',
+    'Keep your phone charged and easily accessible for emergencies.',
+    'Trust your instincts. If a situation feels unsafe, leave immediately.',
+    'Stay in well-lit, populated areas, especially at night.'
+]
+
+def _hour_between(hour, bounds):
+    start, end = bounds
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end  # Range wraps past midnight
+
+CONDITIONS = {
+    'is': lambda value, expected: value == expected,
+    'gt': lambda value, limit: value > limit,
+    'lt': lambda value, limit: value < limit,
+    'empty': lambda value, _: not value,
+    'not_empty': lambda value, _: bool(value),
+    'hour_between': _hour_between
+}
+
+def behavior_flags(state):
+    """(moving_fast, moving_erratically) for a movement state; all behavior rules depend only on these"""
+    if state.fix_count < 2:
+        return False, False
+    return (
+        bool(state.speed and state.speed > active_config.FAST_MOVEMENT_SPEED_MPS),
+        state.max_heading_change > active_config.ERRATIC_HEADING_CHANGE_DEGREES
+    )
+
+# Input providers fill their inputs on every context that lacks them, for a whole batch at once
+
+def provide_location(contexts):
+    for context in contexts:
+        if 'location' not in context:
+            latest_location = LocationService.get_latest_location(context['user_id'])
+            context['location'] = (latest_location.latitude, latest_location.longitude) if latest_location else None
+
+def provide_hour(contexts):
+    for context in contexts:
+        if 'hour' not in context:
+            # Local time at the user's location (UTC when unknown)
+            context['hour'] = LocationService.get_local_time(*(context['location'] or (None, None))).hour
+
+def provide_nearby_places(contexts):
+    # Users at the same position share one lookup (and nearby users share the places cache)
+    by_location = {}
+    for context in contexts:
+        if 'nearby_police' in context:
+            continue
+        if context['location'] is None:
+            context.update(nearby_police=None, nearby_hospitals=None, nearest_police=None)
+        else:
+            by_location.setdefault(context['location'], []).append(context)
+
+    for (latitude, longitude), group in by_location.items():
+        nearby = LocationService.get_nearby_places_by_type(
+            latitude, longitude, ['police', 'hospital'], radius=NEARBY_PLACES_RADIUS_METERS
+        )
+        # A failed lookup leaves its inputs None, so rules reading them do not fire
+        nearest_police = min(nearby['police'] or [], key=lambda place: place['distance'], default=None)
+        places_failed = nearby['police'] is None or nearby['hospital'] is None
+        for context in group:
+            context.update(nearby_police=nearby['police'], nearby_hospitals=nearby['hospital'],
+                           nearest_police=nearest_police, places_failed=places_failed)
+
+def provide_behavior(contexts):
+    for context in contexts:
+        if 'moving_fast' not in context:
+            moving_fast, moving_erratically = behavior_flags(LocationService.get_movement_state(context['user_id']))
+            context.update(moving_fast=moving_fast, moving_erratically=moving_erratically)
+
+# Input name -> (provider, inputs the provider reads)
+INPUT_PROVIDERS = {
+    'location': (provide_location, ()),
+    'hour': (provide_hour, ('location',)),
+    'nearby_police': (provide_nearby_places, ('location',)),
+    'nearby_hospitals': (provide_nearby_places, ('location',)),
+    'nearest_police': (provide_nearby_places, ('location',)),
+    'moving_fast': (provide_behavior, ()),
+    'moving_erratically': (provide_behavior, ())
+}
+
+class CompiledRule:
+    """A rule with its conditions resolved to predicates and its inputs collected"""
+
+    def __init__(self, rule):
+        self.id = rule['id']
+        self.type = rule['type']
+        self.severity = rule['severity']
+        self.message = rule['message']
+
+        self.conditions = []
+        for input_name, operator, argument in rule.get('when', []):
+            if operator not in CONDITIONS:
+                raise ValueError(f"Rule {self.id}: unknown condition '{operator}'")
+            self.conditions.append((input_name, CONDITIONS[operator], argument))
+
+        # Inputs read by the conditions or referenced by the message template
+        template_fields = {field.split('[')[0].split('.')[0]
+                           for _, field, _, _ in Formatter().parse(self.message) if field}
+        self.inputs = frozenset(name for name, _, _ in self.conditions) | template_fields
+
+    def matches(self, context):
+        # An input that could not be determined (e.g. no known location) never matches
+        if any(context.get(name) is None for name in self.inputs):
+            return False
+        return all(predicate(context[name], argument) for name, predicate, argument in self.conditions)
+
+    def render(self, context):
+        return {
+            'type': self.type,
+            'severity': self.severity,
+            'message': self.message.format(**context) if self.inputs else self.message
+        }
+
+class SafetyRuleEngine:
+    """Evaluates compiled rules for one or many users, fetching only the inputs the rules need
+
+    Rules are validated and compiled once. For each set of rule types the
+    engine plans which input providers to run (with their dependencies),
+    then runs each provider once over the whole batch. Inputs already present
+    in a context (e.g. a location passed by the caller) are not fetched again.
+    """
+
+    def __init__(self, rules, general_tips, providers):
+        self.rules = [CompiledRule(rule) for rule in rules]
+        self.general_tips = list(general_tips)
+        self.providers = providers
+        self._plans = {}
+
+        for rule in self.rules:
+            missing = [name for name in rule.inputs if name not in providers]
+            if missing:
+                raise ValueError(f"Rule {rule.id}: no provider for input(s) {', '.join(missing)}")
+
+    def _providers_for(self, names):
+        """Providers producing the named inputs, dependencies first"""
+        order = []
+
+        def visit(name):
+            provider, dependencies = self.providers[name]
+            for dependency in dependencies:
+                visit(dependency)
+            if provider not in order:
+                order.append(provider)
+
+        for name in sorted(names):
+            visit(name)
+        return order
+
+    def _plan(self, rule_types, include_general):
+        """(rules, providers to run) for a selection of rule types"""
+        key = (rule_types, include_general)
+        if key not in self._plans:
+            rules = [rule for rule in self.rules if rule_types is None or rule.type in rule_types]
+            needed = set().union(*(rule.inputs for rule in rules))
+            if include_general:
+                needed.add('hour')
+            self._plans[key] = (rules, self._providers_for(needed))
+        return self._plans[key]
+
+    def resolve(self, contexts, input_names):
+        """Fetch just the named inputs into each context (e.g. to build a cache key before evaluating)"""
+        for provider in self._providers_for(input_names):
+            provider(contexts)
+
+    def evaluate_many(self, contexts, rule_types=None, include_general=True):
+        """Recommendations for each context (dict with user_id and any known inputs), in order
+
+        Contexts are filled in place with the inputs that were fetched.
+        """
+        rules, providers = self._plan(tuple(rule_types) if rule_types else None, include_general)
+        for provider in providers:
+            provider(contexts)
+
+        results = []
+        for context in contexts:
+            recommendations = [rule.render(context) for rule in rules if rule.matches(context)]
+            if include_general:
+                if not recommendations:
+                    tips = self.general_tips
+                else:
+                    tips = [self.general_tips[context['hour'] % len(self.general_tips)]]
+                recommendations.extend({'type': 'general', 'severity': 'info', 'message': tip} for tip in tips)
+            results.append(recommendations)
+        return results
+
+    def evaluate(self, user_id, rule_types=None, include_general=True, **inputs):
+        """Recommendations for one user; known inputs (e.g. location=(lat, lon), hour=23) may be passed"""
+        return self.evaluate_many([dict(inputs, user_id=user_id)], rule_types, include_general)[0]
+
+# Compiled once at startup; shared by the recommendations route, the service and batch callers
+safety_rule_engine = SafetyRuleEngine(SAFETY_RULES, GENERAL_TIPS, INPUT_PROVIDERS)
@@ -0,0 +1,465 @@
+"""
+Segmentation service for incremental stay-point and trip detection
+"""
+
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+import gevent
+from sqlalchemy import and_, or_, case, func
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models.movement_segment import MovementSegment, SegmentationCheckpoint
+from services.location_service import LocationService
+from config import active_config
+
+class SegmentationService:
+    """Service for splitting location history into stays and trips
+
+    A stay is detected when fixes remain within SEGMENTATION_STAY_RADIUS_METERS
+    of an anchor fix for at least SEGMENTATION_STAY_MIN_SECONDS; movement
+    between stays forms trips. Only fixes newer than the user's checkpoint are
+    processed, and the last segment stays open so later fixes can extend it.
+
+    Ingest marks the checkpoint (mark_pending) in the same transaction as
+    the fixes, including the earliest fix that arrived at or before the
+    checkpoint's position (late or backfilled fixes). The background
+    SegmentationWorker then runs process_user, which rewinds to the last
+    stay before such a fix and reprocesses from there.
+
+    A run never holds a lock across its work: it claims the user in its own
+    short transaction, computes segments without writing, and saves them in
+    one short transaction that only commits if no ingest marked the
+    checkpoint meanwhile (version compare-and-set). A run that loses leaves
+    the user pending for the next tick.
+    """
+
+    @staticmethod
+    def mark_pending(rows):
+        """Flag the checkpoints of users with new rows (caller commits with the rows)
+
+        Users without a checkpoint get one; a concurrent insert raises
+        IntegrityError, which save_locations already retries.
+        """
+        earliest = {}
+        for row in rows:
+            user_id, timestamp = row['user_id'], row['timestamp']
+            if user_id not in earliest or timestamp < earliest[user_id]:
+                earliest[user_id] = timestamp
+
+        table = SegmentationCheckpoint.__table__
+        for user_id, timestamp in earliest.items():
+            late = and_(table.c.last_timestamp >= timestamp,
+                        or_(table.c.rewind_from.is_(None), table.c.rewind_from > timestamp))
+            result = db.session.execute(
+                table.update().where(table.c.user_id == user_id).values(
+                    pending=True,
+                    rewind_from=case((late, timestamp), else_=table.c.rewind_from),
+                    version=func.coalesce(table.c.version, 0) + 1
+                )
+            )
+            if result.rowcount == 0:
+                db.session.execute(table.insert().values(
+                    user_id=user_id, pending=True, candidate_latitude_sum=0.0,
+                    candidate_longitude_sum=0.0, candidate_count=0, version=1
+                ))
+
+    @staticmethod
+    def _start_trip(checkpoint, user_id, point):
+        trip = MovementSegment(user_id, 'trip', point['timestamp'], point['latitude'], point['longitude'])
+        db.session.add(trip)
+        SegmentationService._reset_candidate(checkpoint, point)
+        return trip
+
+    @staticmethod
+    def _reset_candidate(checkpoint, point):
+        checkpoint.anchor_latitude = point['latitude']
+        checkpoint.anchor_longitude = point['longitude']
+        checkpoint.anchor_time = point['timestamp']
+        checkpoint.candidate_latitude_sum = point['latitude']
+        checkpoint.candidate_longitude_sum = point['longitude']
+        checkpoint.candidate_count = 1
+
+    @staticmethod
+    def _process_point(checkpoint, segment, user_id, point):
+        """Advance the state machine by one fix and return the open segment"""
+        radius = active_config.SEGMENTATION_STAY_RADIUS_METERS
+        min_stay = timedelta(seconds=active_config.SEGMENTATION_STAY_MIN_SECONDS)
+
+        if segment is None:
+            return SegmentationService._start_trip(checkpoint, user_id, point)
+
+        if segment.segment_type == 'stay':
+            distance = LocationService.calculate_distance(
+                segment.latitude, segment.longitude, point['latitude'], point['longitude']
+            )
+            if distance <= radius:
+                # Still at the stop: extend it and update the running centroid
+                count = segment.point_count
+                segment.latitude = (segment.latitude * count + point['latitude']) / (count + 1)
+                segment.longitude = (segment.longitude * count + point['longitude']) / (count + 1)
+                segment.point_count = count + 1
+                segment.end_time = point['timestamp']
+                segment.end_latitude = point['latitude']
+                segment.end_longitude = point['longitude']
+                return segment
+
+            # Left the stop: close it and start a trip from its centroid
+            segment.is_open = False
+            trip = MovementSegment(user_id, 'trip', segment.end_time, segment.latitude, segment.longitude)
+            trip.end_time = point['timestamp']
+            trip.end_latitude = point['latitude']
+            trip.end_longitude = point['longitude']
+            trip.distance = distance
+            trip.point_count = 2
+            db.session.add(trip)
+            SegmentationService._reset_candidate(checkpoint, point)
+            return trip
+
+        # On a trip: is the user lingering around the anchor fix?
+        distance = LocationService.calculate_distance(
+            checkpoint.anchor_latitude, checkpoint.anchor_longitude, point['latitude'], point['longitude']
+        )
+        if distance > radius:
+            segment.distance = (segment.distance or 0.0) + LocationService.calculate_distance(
+                segment.end_latitude, segment.end_longitude, point['latitude'], point['longitude']
+            )
+            segment.end_time = point['timestamp']
+            segment.end_latitude = point['latitude']
+            segment.end_longitude = point['longitude']
+            segment.point_count += 1
+            SegmentationService._reset_candidate(checkpoint, point)
+            return segment
+
+        segment.point_count += 1
+        checkpoint.candidate_latitude_sum += point['latitude']
+        checkpoint.candidate_longitude_sum += point['longitude']
+        checkpoint.candidate_count += 1
+
+        if point['timestamp'] - checkpoint.anchor_time < min_stay:
+            return segment
+
+        # Lingered long enough: the trip ends at the anchor and a stay begins there
+        centroid_latitude = checkpoint.candidate_latitude_sum / checkpoint.candidate_count
+        centroid_longitude = checkpoint.candidate_longitude_sum / checkpoint.candidate_count
+
+        if segment.start_time == checkpoint.anchor_time:
+            # The "trip" never left the anchor, so it becomes the stay itself
+            stay = segment
+            stay.segment_type = 'stay'
+            stay.distance = 0.0
+        else:
+            # Fixes after the anchor move from the trip to the stay
+            segment.is_open = False
+            segment.point_count -= checkpoint.candidate_count - 1
+            segment.end_time = checkpoint.anchor_time
+            segment.end_latitude = checkpoint.anchor_latitude
+            segment.end_longitude = checkpoint.anchor_longitude
+            stay = MovementSegment(user_id, 'stay', checkpoint.anchor_time,
+                                   checkpoint.anchor_latitude, checkpoint.anchor_longitude)
+            db.session.add(stay)
+
+        stay.latitude = centroid_latitude
+        stay.longitude = centroid_longitude
+        stay.point_count = checkpoint.candidate_count
+        stay.end_time = point['timestamp']
+        stay.end_latitude = point['latitude']
+        stay.end_longitude = point['longitude']
+        return stay
+
+    @staticmethod
+    def _claim(user_id):
+        """Claim the user for this process in its own transaction; returns whether it was claimed
+
+        Runs in other processes skip a claimed user until the claim is
+        released or expires. Users without a checkpoint get one first.
+        """
+        from services.job_lease import LeaseService
+
+        table = SegmentationCheckpoint.__table__
+        holder = LeaseService.holder_id
+        while True:
+            now = datetime.utcnow()
+            result = db.session.execute(
+                table.update().where(
+                    table.c.user_id == user_id,
+                    or_(table.c.claimed_until.is_(None), table.c.claimed_until < now, table.c.claimed_by == holder)
+                ).values(
+                    claimed_by=holder,
+                    claimed_until=now + timedelta(seconds=active_config.SEGMENTATION_CLAIM_SECONDS)
+                )
+            )
+            if result.rowcount:
+                db.session.commit()
+                return True
+            if db.session.query(table.c.user_id).filter(table.c.user_id == user_id).first() is not None:
+                db.session.rollback()
+                return False
+            try:
+                db.session.add(SegmentationCheckpoint(user_id))
+                db.session.commit()
+            except IntegrityError:
+                # Created concurrently (e.g. by mark_pending); claim it on the next pass
+                db.session.rollback()
+
+    @staticmethod
+    def _release(user_id):
+        """Drop this process's claim without saving anything"""
+        from services.job_lease import LeaseService
+
+        table = SegmentationCheckpoint.__table__
+        db.session.execute(
+            table.update().where(table.c.user_id == user_id, table.c.claimed_by == LeaseService.holder_id)
+            .values(claimed_until=None)
+        )
+        db.session.commit()
+
+    @staticmethod
+    def _load_checkpoint(user_id):
+        """Read the checkpoint and detach it; the run changes it in memory and _save writes it back"""
+        checkpoint = SegmentationCheckpoint.query.filter_by(user_id=user_id).first()
+        db.session.expunge(checkpoint)
+        return checkpoint
+
+    @staticmethod
+    def _save(checkpoint, version, segment, stale, pending):
+        """Write the run's segments and checkpoint in one transaction, if nobody marked the user since
+
+        Returns False (and rolls back) when an ingest bumped the version
+        after the checkpoint was read; the user is pending again then.
+        """
+        table = SegmentationCheckpoint.__table__
+        now = datetime.utcnow()
+
+        if stale is not None:
+            db.session.execute(stale)
+        db.session.flush()
+
+        result = db.session.execute(
+            table.update().where(
+                table.c.user_id == checkpoint.user_id,
+                func.coalesce(table.c.version, 0) == version
+            ).values(
+                version=version + 1,
+                last_timestamp=checkpoint.last_timestamp,
+                open_segment_id=segment.id if segment is not None else None,
+                pending=pending,
+                rewind_from=None,
+                anchor_latitude=checkpoint.anchor_latitude,
+                anchor_longitude=checkpoint.anchor_longitude,
+                anchor_time=checkpoint.anchor_time,
+                candidate_latitude_sum=checkpoint.candidate_latitude_sum,
+                candidate_longitude_sum=checkpoint.candidate_longitude_sum,
+                candidate_count=checkpoint.candidate_count,
+                # Keep the claim between batches; release it once caught up
+                claimed_until=now + timedelta(seconds=active_config.SEGMENTATION_CLAIM_SECONDS) if pending else None,
+                updated_at=now
+            )
+        )
+        if result.rowcount == 0:
+            db.session.rollback()
+            return False
+        db.session.commit()
+        return True
+
+    @staticmethod
+    def _rewind(checkpoint, user_id):
+        """Reopen the last stay that ended before the earliest late fix and mark later segments stale
+
+        A stay's state is all in its segment, so resuming from it reproduces
+        what in-order processing would have built. Only the retention window
+        is reprocessed: without such a stay inside it, segments reaching into
+        the window are rebuilt from its start (older fixes are due for
+        deletion anyway). Returns (resume timestamp, open segment, delete
+        statement for the stale segments, run by _save).
+        """
+        cutoff = datetime.utcnow() - timedelta(days=active_config.LOCATION_HISTORY_RETENTION_DAYS)
+        stay = MovementSegment.query.filter(
+            MovementSegment.user_id == user_id,
+            MovementSegment.segment_type == 'stay',
+            MovementSegment.end_time < checkpoint.rewind_from,
+            MovementSegment.end_time >= cutoff
+        ).order_by(MovementSegment.end_time.desc()).first()
+
+        table = MovementSegment.__table__
+        if stay is not None:
+            stale = table.delete().where(table.c.user_id == user_id, table.c.start_time >= stay.end_time,
+                                         table.c.id != stay.id)
+            stay.is_open = True
+            checkpoint.last_timestamp = stay.end_time
+            start = stay.end_time + timedelta(microseconds=1)
+        else:
+            stale = table.delete().where(table.c.user_id == user_id, table.c.end_time >= cutoff)
+            checkpoint.last_timestamp = None
+            start = cutoff
+
+        checkpoint.rewind_from = None
+        checkpoint.anchor_latitude = checkpoint.anchor_longitude = checkpoint.anchor_time = None
+        checkpoint.candidate_latitude_sum = 0.0
+        checkpoint.candidate_longitude_sum = 0.0
+        checkpoint.candidate_count = 0
+        return start, stay, stale
+
+    @staticmethod
+    def process_user(user_id, batch_size=2000):
+        """Segment fixes newer than the user's checkpoint (after any late fixes); returns the number processed
+
+        Returns 0 without work when another process has claimed the user.
+        """
+        if not SegmentationService._claim(user_id):
+            return 0
+
+        processed = 0
+        start, skip = None, 0
+        first_batch = True
+        while True:
+            checkpoint = SegmentationService._load_checkpoint(user_id)
+            version = checkpoint.version or 0
+
+            # Nothing is written until _save, so ingest commits are not blocked meanwhile
+            with db.session.no_autoflush:
+                stale = None
+                if checkpoint.rewind_from is not None:
+                    start, segment, stale = SegmentationService._rewind(checkpoint, user_id)
+                    skip = 0
+                else:
+                    segment = MovementSegment.query.get(checkpoint.open_segment_id) \
+                        if checkpoint.open_segment_id else None
+                    if first_batch:
+                        # Resume after the checkpoint; between batches, resume at the last timestamp and
+                        # skip the fixes already processed there, so fixes sharing a timestamp are not lost
+                        start = checkpoint.last_timestamp + timedelta(microseconds=1) \
+                            if checkpoint.last_timestamp else None
+                first_batch = False
+
+                history = LocationService.iter_history(user_id, start=start, descending=False)
+                points = list(islice(history, skip + batch_size))[skip:]
+                history.close()
+
+                for point in points:
+                    segment = SegmentationService._process_point(checkpoint, segment, user_id, point)
+                    if point['timestamp'] == checkpoint.last_timestamp:
+                        skip += 1
+                    else:
+                        checkpoint.last_timestamp = point['timestamp']
+                        skip = 1
+
+            pending = len(points) >= batch_size
+            if not SegmentationService._save(checkpoint, version, segment, stale, pending):
+                # New fixes were marked while this batch ran; the next tick redoes it on fresh state
+                SegmentationService._release(user_id)
+                return processed
+
+            processed += len(points)
+            if not pending:
+                return processed
+            start = checkpoint.last_timestamp
+
+    @staticmethod
+    def get_segments(user_id, segment_type=None, start=None, end=None, limit=50):
+        """Get precomputed segments overlapping a time range, newest first"""
+        query = MovementSegment.query.filter_by(user_id=user_id)
+        if segment_type is not None:
+            query = query.filter_by(segment_type=segment_type)
+        if start is not None:
+            query = query.filter(MovementSegment.end_time >= start)
+        if end is not None:
+            query = query.filter(MovementSegment.start_time <= end)
+
+        return query.order_by(MovementSegment.start_time.desc()).limit(limit).all()
+
+    @staticmethod
+    def get_current_stay(user_id):
+        """Get the stay the user is currently in, or None when moving or unknown"""
+        checkpoint = SegmentationCheckpoint.query.get(user_id)
+        if checkpoint is None or checkpoint.open_segment_id is None:
+            return None
+
+        segment = MovementSegment.query.get(checkpoint.open_segment_id)
+        if segment is None or segment.segment_type != 'stay':
+            return None
+
+        return segment
+
+    @staticmethod
+    def time_at_current_stop(user_id, now=None):
+        """Seconds the user has been at the current stop (0 when not stopped)"""
+        stay = SegmentationService.get_current_stay(user_id)
+        if stay is None:
+            return 0.0
+        return ((now or datetime.utcnow()) - stay.start_time).total_seconds()
+
+class SegmentationWorker:
+    """Greenlet that segments users whose checkpoints were marked at ingest
+
+    Each tick processes up to ``users_per_tick`` pending users; the rest
+    wait for the next tick. Runs in several processes skip users another
+    process has claimed.
+    """
+
+    def __init__(self, name='segmentation-worker'):
+        self.name = name
+        self.app = None
+        self.interval = 30.0
+        self.users_per_tick = 100
+        self._greenlet = None
+
+        # Counters exposed through stats()
+        self._ticks = 0
+        self._users = 0
+        self._fixes = 0
+        self._last_tick_ms = 0.0
+
+    @property
+    def running(self):
+        """Whether the worker greenlet is active"""
+        return self._greenlet is not None and not self._greenlet.dead
+
+    def init_app(self, app, interval_seconds=30, users_per_tick=100):
+        """Bind to an app and start ticking"""
+        self.app = app
+        self.interval = interval_seconds
+        self.users_per_tick = users_per_tick
+        self._greenlet = gevent.spawn(self._run)
+
+    def _run(self):
+        """Worker loop (first tick after one interval, once the tables exist)"""
+        while True:
+            gevent.sleep(self.interval)
+            started = time.monotonic()
+            try:
+                with self.app.app_context():
+                    self.tick()
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error in {self.name}: {str(e)}")
+            self._last_tick_ms = (time.monotonic() - started) * 1000
+
+    def tick(self):
+        """Segment one batch of pending users; returns the number of fixes processed"""
+        self._ticks += 1
+        user_ids = [row.user_id for row in db.session.query(SegmentationCheckpoint.user_id)
+                    .filter(SegmentationCheckpoint.pending.is_(True)).limit(self.users_per_tick)]
+        db.session.commit()
+
+        fixes = 0
+        for user_id in user_ids:
+            fixes += SegmentationService.process_user(user_id)
+
+        self._users += len(user_ids)
+        self._fixes += fixes
+        return fixes
+
+    def stats(self):
+        """Tick counters"""
+        return {
+            'running': self.running,
+            'interval_seconds': self.interval,
+            'ticks': self._ticks,
+            'users': self._users,
+            'fixes': self._fixes,
+            'last_tick_ms': round(self._last_tick_ms, 3)
+        }
+
+# Started by app.py
+segmentation_worker = SegmentationWorker()
@@ -0,0 +1,68 @@
+"""
+Socket.IO message queue configuration and an in-process stand-in broker
+"""
+
+import pickle
+import socketio
+from gevent.queue import Queue
+
+LOCAL_QUEUE_SCHEME = 'local://'
+
+class LocalBroker:
+    """In-process pub/sub: every subscriber of a channel receives every message published on it"""
+
+    def __init__(self):
+        self._subscribers = {}  # channel -> [Queue]
+
+    def subscribe(self, channel):
+        queue = Queue()
+        self._subscribers.setdefault(channel, []).append(queue)
+        return queue
+
+    def unsubscribe(self, channel, queue):
+        subscribers = self._subscribers.get(channel, [])
+        if queue in subscribers:
+            subscribers.remove(queue)
+
+    def publish(self, channel, message):
+        for queue in list(self._subscribers.get(channel, [])):
+            queue.put(message)
+
+local_broker = LocalBroker()
+
+class LocalPubSubManager(socketio.PubSubManager):
+    """Socket.IO client manager that fans out through a LocalBroker
+
+    Behaves like the Redis/Kombu managers, so several Socket.IO servers (or
+    write-only emitters) in one process can stand in for separate workers
+    sharing a message queue, e.g. in tests. Messages are pickled, as on the
+    wire, so servers never share mutable payloads.
+    """
+
+    name = 'local'
+
+    def __init__(self, url=LOCAL_QUEUE_SCHEME, channel='socketio', write_only=False, logger=None, broker=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.url = url
+        self.broker = broker or local_broker
+        self._queue = None if write_only else self.broker.subscribe(channel)
+
+    def _publish(self, data):
+        self.broker.publish(self.channel, pickle.dumps(data))
+
+    def _listen(self):
+        while True:
+            yield pickle.loads(self._queue.get())
+
+def message_queue_options(url, channel):
+    """Keyword arguments for SocketIO.init_app for a SOCKETIO_MESSAGE_QUEUE URL
+
+    Empty (single process) when no URL is set; local:// selects the
+    in-process stand-in; anything else (redis://, amqp://, ...) is passed to
+    Flask-SocketIO, which picks the matching python-socketio manager.
+    """
+    if not url:
+        return {}
+    if url.startswith(LOCAL_QUEUE_SCHEME):
+        return {'client_manager': LocalPubSubManager(url, channel=channel)}
+    return {'message_queue': url, 'channel': channel}
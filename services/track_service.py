@@ -0,0 +1,197 @@
+"""
+Track segment service for compact encoded location history storage
+"""
+
+from datetime import timedelta
+from extensions import db
+from models.location_history import LocationHistory
+from models.location_segment import LocationSegment
+from utils.track_encoding import encode_points, to_millis, to_e6, EPOCH
+from config import active_config
+
+def _fix_key(timestamp, latitude, longitude):
+    """Identity of a fix at the encoding's resolution (ms, 1e-6 degrees)"""
+    return to_millis(timestamp), to_e6(latitude), to_e6(longitude)
+
+class TrackSegmentService:
+    """Service for writing and reading per-window encoded location segments"""
+
+    @staticmethod
+    def window_start(timestamp):
+        """Start of the fixed time window containing timestamp"""
+        window = timedelta(minutes=active_config.LOCATION_SEGMENT_WINDOW_MINUTES)
+        return EPOCH + ((timestamp - EPOCH) // window) * window
+
+    @staticmethod
+    def _encode_into(segment, points, append):
+        """Encode sorted points into the segment, appending or rewriting the blob"""
+        if append and segment.point_count:
+            base = (to_millis(segment.end_time), segment.last_latitude_e6, segment.last_longitude_e6)
+            data, last = encode_points(points, *base)
+            segment.data = segment.data + data
+            segment.point_count += len(points)
+            segment.min_latitude = min(segment.min_latitude, *(p['latitude'] for p in points))
+            segment.max_latitude = max(segment.max_latitude, *(p['latitude'] for p in points))
+            segment.min_longitude = min(segment.min_longitude, *(p['longitude'] for p in points))
+            segment.max_longitude = max(segment.max_longitude, *(p['longitude'] for p in points))
+        else:
+            start_time = points[0]['timestamp']
+            data, last = encode_points(points, to_millis(start_time), 0, 0)
+            segment.data = data
+            segment.start_time = start_time
+            segment.point_count = len(points)
+            segment.min_latitude = min(p['latitude'] for p in points)
+            segment.max_latitude = max(p['latitude'] for p in points)
+            segment.min_longitude = min(p['longitude'] for p in points)
+            segment.max_longitude = max(p['longitude'] for p in points)
+
+        segment.end_time = points[-1]['timestamp']
+        segment.last_latitude_e6 = last[1]
+        segment.last_longitude_e6 = last[2]
+
+    @staticmethod
+    def append_rows(rows):
+        """Add location rows to their segments in the current session (caller commits)"""
+        groups = {}
+        for row in rows:
+            key = (row['user_id'], TrackSegmentService.window_start(row['timestamp']))
+            groups.setdefault(key, []).append(row)
+
+        for (user_id, window_start), points in groups.items():
+            points.sort(key=lambda p: p['timestamp'])
+
+            segment = LocationSegment.query.filter_by(user_id=user_id, window_start=window_start).first()
+            if segment is None:
+                segment = LocationSegment(user_id, window_start)
+                db.session.add(segment)
+                TrackSegmentService._encode_into(segment, points, append=False)
+            elif points[0]['timestamp'] >= segment.end_time:
+                TrackSegmentService._encode_into(segment, points, append=True)
+            else:
+                # Out-of-order fixes: merge and rewrite the whole segment
+                merged = sorted(segment.decode() + points, key=lambda p: p['timestamp'])
+                TrackSegmentService._encode_into(segment, merged, append=False)
+
+        return len(rows)
+
+    @staticmethod
+    def iter_points(user_id, start=None, end=None, descending=True):
+        """Yield decoded points (datetime timestamps) for a time range, newest first by default
+
+        Segments are pruned by their time window, so only segments overlapping
+        the range are fetched and decoded.
+        """
+        query = LocationSegment.query.filter_by(user_id=user_id)
+        if start is not None:
+            query = query.filter(LocationSegment.window_start >= TrackSegmentService.window_start(start))
+        if end is not None:
+            query = query.filter(LocationSegment.window_start <= end)
+
+        order = LocationSegment.window_start.desc() if descending else LocationSegment.window_start.asc()
+
+        for segment in query.order_by(order).yield_per(50):
+            points = segment.decode()
+            if descending:
+                points.reverse()
+            for point in points:
+                if start is not None and point['timestamp'] < start:
+                    continue
+                if end is not None and point['timestamp'] > end:
+                    continue
+                yield point
+
+    @staticmethod
+    def point_to_dict(point):
+        """Same shape as LocationHistory.to_dict (segments carry no per-fix id)"""
+        return {
+            'id': point.get('id'),
+            'latitude': point['latitude'],
+            'longitude': point['longitude'],
+            'accuracy': point.get('accuracy'),
+            'altitude': point.get('altitude'),
+            'speed': point.get('speed'),
+            'heading': point.get('heading'),
+            'timestamp': point['timestamp'].isoformat() if point['timestamp'] else None
+        }
+
+    @staticmethod
+    def get_locations(user_id, start=None, end=None, limit=None, offset=0):
+        """Read decoded fixes as LocationHistory.to_dict-shaped dicts, newest first"""
+        locations = []
+        for index, point in enumerate(TrackSegmentService.iter_points(user_id, start, end)):
+            if index < offset:
+                continue
+            if limit is not None and len(locations) >= limit:
+                break
+            locations.append(TrackSegmentService.point_to_dict(point))
+        return locations
+
+    @staticmethod
+    def compact_user_rows(user_id, before=None, delete_rows=False, batch_size=5000):
+        """Migrate a user's LocationHistory rows into segments
+
+        Rows are read in timestamp order in batches; each batch is committed
+        with its segments. Fixes already present in their segment (same
+        millisecond and coordinates) are skipped, so the job can be re-run
+        safely; distinct fixes sharing a timestamp are all kept. Returns the
+        number of rows packed.
+        """
+        query = LocationHistory.query.filter_by(user_id=user_id) \
+            .filter(LocationHistory.timestamp.isnot(None))
+        if before is not None:
+            query = query.filter(LocationHistory.timestamp < before)
+
+        migrated = 0
+        packed = {}  # window_start -> fix keys already stored in that segment
+        last_key = None
+        while True:
+            batch_query = query
+            if last_key is not None:
+                batch_query = batch_query.filter(
+                    db.or_(LocationHistory.timestamp > last_key[0],
+                           db.and_(LocationHistory.timestamp == last_key[0], LocationHistory.id > last_key[1]))
+                )
+            locations = batch_query.order_by(LocationHistory.timestamp.asc(), LocationHistory.id.asc()) \
+                .limit(batch_size).all()
+            if not locations:
+                break
+
+            # Skip fixes already packed (earlier runs, or live writes with storage 'both')
+            locations_to_pack = []
+            for location in locations:
+                window_start = TrackSegmentService.window_start(location.timestamp)
+                if window_start not in packed:
+                    segment = LocationSegment.query.filter_by(user_id=user_id, window_start=window_start).first()
+                    packed[window_start] = {
+                        _fix_key(p['timestamp'], p['latitude'], p['longitude']) for p in segment.decode()
+                    } if segment else set()
+                if _fix_key(location.timestamp, location.latitude, location.longitude) not in packed[window_start]:
+                    locations_to_pack.append(location)
+
+            rows = [{
+                'user_id': location.user_id,
+                'latitude': location.latitude,
+                'longitude': location.longitude,
+                'accuracy': location.accuracy,
+                'altitude': location.altitude,
+                'speed': location.speed,
+                'heading': location.heading,
+                'timestamp': location.timestamp
+            } for location in locations_to_pack]
+
+            if rows:
+                TrackSegmentService.append_rows(rows)
+                for row in rows:
+                    packed[TrackSegmentService.window_start(row['timestamp'])].add(
+                        _fix_key(row['timestamp'], row['latitude'], row['longitude'])
+                    )
+            last_key = (locations[-1].timestamp, locations[-1].id)
+
+            if delete_rows:
+                LocationHistory.query.filter(LocationHistory.id.in_([l.id for l in locations])) \
+                    .delete(synchronize_session=False)
+
+            db.session.commit()
+            migrated += len(rows)
+
+        return migrated
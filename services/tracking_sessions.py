@@ -0,0 +1,405 @@
+"""
+Expiring store for location sharing (tracking) sessions, shared across worker processes
+"""
+
+import heapq
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+import gevent
+from extensions import db
+from models.tracking_session import TrackingSession
+from config import active_config
+
+EPOCH = datetime(1970, 1, 1)
+
+def _score(moment):
+    """Naive UTC datetime as epoch seconds (sorted-set score)"""
+    return (moment - EPOCH).total_seconds()
+
+class TrackingSessionInfo:
+    """Read-only view of one tracking session"""
+
+    __slots__ = ('tracking_id', 'user_id', 'expires_at')
+
+    def __init__(self, tracking_id, user_id, expires_at):
+        self.tracking_id = tracking_id
+        self.user_id = user_id
+        self.expires_at = expires_at
+
+    def is_expired(self, now=None):
+        return self.expires_at <= (now or datetime.utcnow())
+
+class TrackingSessionStore(ABC):
+    """Interface for tracking session storage
+
+    Sessions are indexed by tracking ID, by user and by expiry time, so
+    per-user lookups cost O(that user's sessions) and the sweeper removes
+    expired sessions in expiry order without scanning the rest. get() may
+    still return a session that expired but has not been swept yet.
+    """
+
+    @abstractmethod
+    def create(self, tracking_id, user_id, expires_at):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get(self, tracking_id):
+        """The session (possibly expired), or None"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, tracking_id):
+        """Remove a session; returns whether it existed"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def for_user(self, user_id, now=None):
+        """The user's unexpired sessions, soonest expiry first"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def sharing_user_ids(self, now=None):
+        """IDs of users with at least one unexpired session"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def sweep(self, now=None):
+        """Remove expired sessions; returns how many were removed"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def next_expiry(self):
+        """Earliest expiry among stored sessions, or None"""
+        raise NotImplementedError
+
+class SqlTrackingSessionStore(TrackingSessionStore):
+    """Sessions in the application database (survives restarts; shared by workers using the same database)"""
+
+    @staticmethod
+    def _info(row):
+        return TrackingSessionInfo(row.id, row.user_id, row.expires_at)
+
+    def create(self, tracking_id, user_id, expires_at):
+        db.session.add(TrackingSession(tracking_id, user_id, expires_at))
+        db.session.commit()
+
+    def get(self, tracking_id):
+        row = TrackingSession.query.get(tracking_id)
+        return self._info(row) if row else None
+
+    def delete(self, tracking_id):
+        deleted = TrackingSession.query.filter_by(id=tracking_id).delete()
+        db.session.commit()
+        return deleted > 0
+
+    def for_user(self, user_id, now=None):
+        rows = TrackingSession.query.filter(
+            TrackingSession.user_id == user_id,
+            TrackingSession.expires_at > (now or datetime.utcnow())
+        ).order_by(TrackingSession.expires_at).all()
+        return [self._info(row) for row in rows]
+
+    def sharing_user_ids(self, now=None):
+        rows = db.session.query(TrackingSession.user_id) \
+            .filter(TrackingSession.expires_at > (now or datetime.utcnow())).distinct()
+        return {row.user_id for row in rows}
+
+    def sweep(self, now=None):
+        removed = TrackingSession.query \
+            .filter(TrackingSession.expires_at <= (now or datetime.utcnow())) \
+            .delete(synchronize_session=False)
+        db.session.commit()
+        return removed
+
+    def next_expiry(self):
+        return db.session.query(db.func.min(TrackingSession.expires_at)).scalar()
+
+class KeyValueTrackingSessionStore(TrackingSessionStore):
+    """Sessions in a Redis-compatible key-value server
+
+    Keys: ``<prefix>:session:<id>`` (hash), ``<prefix>:user:<user_id>`` (set
+    of tracking IDs) and ``<prefix>:expiry`` (sorted set of
+    ``<user_id>:<tracking_id>`` scored by expiry). The client must return
+    strings (``decode_responses=True``); LocalKeyValueClient can stand in
+    for the server in a single process. The three keys of a session are
+    written and removed together in one MULTI/EXEC transaction.
+    """
+
+    def __init__(self, client, prefix='tracking'):
+        self.client = client
+        self.prefix = prefix
+        self.expiry_key = f'{prefix}:expiry'
+
+    def _session_key(self, tracking_id):
+        return f'{self.prefix}:session:{tracking_id}'
+
+    def _user_key(self, user_id):
+        return f'{self.prefix}:user:{user_id}'
+
+    def create(self, tracking_id, user_id, expires_at):
+        with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(self._session_key(tracking_id), mapping={
+                'user_id': user_id,
+                'expires_at': expires_at.isoformat()
+            })
+            pipe.sadd(self._user_key(user_id), tracking_id)
+            pipe.zadd(self.expiry_key, {f'{user_id}:{tracking_id}': _score(expires_at)})
+            pipe.execute()
+
+    def get(self, tracking_id):
+        data = self.client.hgetall(self._session_key(tracking_id))
+        if not data:
+            return None
+        return TrackingSessionInfo(tracking_id, int(data['user_id']), datetime.fromisoformat(data['expires_at']))
+
+    def _remove(self, pipe, tracking_id, user_id):
+        pipe.delete(self._session_key(tracking_id))
+        pipe.srem(self._user_key(user_id), tracking_id)
+        pipe.zrem(self.expiry_key, f'{user_id}:{tracking_id}')
+
+    def delete(self, tracking_id):
+        info = self.get(tracking_id)
+        if info is None:
+            return False
+        with self.client.pipeline(transaction=True) as pipe:
+            self._remove(pipe, tracking_id, info.user_id)
+            pipe.execute()
+        return True
+
+    def for_user(self, user_id, now=None):
+        now = now or datetime.utcnow()
+        sessions = []
+        for tracking_id in self.client.smembers(self._user_key(user_id)):
+            info = self.get(tracking_id)
+            if info is None:
+                self.client.srem(self._user_key(user_id), tracking_id)
+            elif not info.is_expired(now):
+                sessions.append(info)
+        sessions.sort(key=lambda info: info.expires_at)
+        return sessions
+
+    def sharing_user_ids(self, now=None):
+        members = self.client.zrangebyscore(self.expiry_key, f'({_score(now or datetime.utcnow())}', '+inf')
+        return {int(member.split(':', 1)[0]) for member in members}
+
+    def sweep(self, now=None):
+        members = self.client.zrangebyscore(self.expiry_key, '-inf', _score(now or datetime.utcnow()))
+        if not members:
+            return 0
+        with self.client.pipeline(transaction=True) as pipe:
+            for member in members:
+                user_id, tracking_id = member.split(':', 1)
+                self._remove(pipe, tracking_id, user_id)
+            pipe.execute()
+        return len(members)
+
+    def next_expiry(self):
+        first = self.client.zrange(self.expiry_key, 0, 0, withscores=True)
+        return datetime.utcfromtimestamp(first[0][1]) if first else None
+
+class LocalPipeline:
+    """Queues commands for a LocalKeyValueClient and runs them atomically on execute()"""
+
+    def __init__(self, client):
+        self.client = client
+        self._commands = []
+
+    def __getattr__(self, command):
+        method = getattr(self.client, command)
+
+        def queue(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        commands, self._commands = self._commands, []
+        with self.client._lock:
+            return [method(*args, **kwargs) for method, args, kwargs in commands]
+
+    def reset(self):
+        self._commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.reset()
+
+class LocalKeyValueClient:
+    """In-process stand-in for the Redis commands KeyValueTrackingSessionStore uses
+
+    Sorted sets are a score map plus a min-heap with lazy deletion, so the
+    earliest expiries are found without sorting. Data lives in this process
+    only; use it for tests and single-worker development.
+    """
+
+    def __init__(self):
+        self._hashes = {}
+        self._sets = {}
+        self._zsets = {}  # name -> (scores, heap)
+        self._lock = threading.RLock()
+
+    def pipeline(self, transaction=True):
+        """Commands queued until execute(), then applied under the client lock (like MULTI/EXEC)"""
+        return LocalPipeline(self)
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        with self._lock:
+            values = self._hashes.setdefault(name, {})
+            if key is not None:
+                values[key] = str(value)
+            for field, field_value in (mapping or {}).items():
+                values[field] = str(field_value)
+
+    def hgetall(self, name):
+        with self._lock:
+            return dict(self._hashes.get(name, {}))
+
+    def delete(self, *names):
+        with self._lock:
+            removed = 0
+            for name in names:
+                for store in (self._hashes, self._sets, self._zsets):
+                    if store.pop(name, None) is not None:
+                        removed += 1
+            return removed
+
+    def sadd(self, name, *values):
+        with self._lock:
+            self._sets.setdefault(name, set()).update(str(value) for value in values)
+
+    def srem(self, name, *values):
+        with self._lock:
+            members = self._sets.get(name)
+            if members is not None:
+                members.difference_update(str(value) for value in values)
+                if not members:
+                    del self._sets[name]
+
+    def smembers(self, name):
+        with self._lock:
+            return set(self._sets.get(name, ()))
+
+    def zadd(self, name, mapping):
+        with self._lock:
+            scores, heap = self._zsets.setdefault(name, ({}, []))
+            for member, score in mapping.items():
+                scores[member] = float(score)
+                heapq.heappush(heap, (float(score), member))
+
+    def zrem(self, name, *members):
+        with self._lock:
+            if name not in self._zsets:
+                return
+            scores, heap = self._zsets[name]
+            for member in members:
+                scores.pop(member, None)
+            if not scores:
+                del self._zsets[name]
+            elif len(heap) > 2 * len(scores) + 16:
+                # Drop stale heap entries once they dominate
+                heap[:] = [(score, member) for member, score in scores.items()]
+                heapq.heapify(heap)
+
+    @staticmethod
+    def _bound(value):
+        """Parse a Redis score bound ('-inf', '+inf', '(1.5' exclusive, or a number) as (score, inclusive)"""
+        value = str(value)
+        if value.startswith('('):
+            return float(value[1:]), False
+        return float(value), True
+
+    def _in_order(self, name, max_score=float('inf'), max_inclusive=True):
+        """Yield live (member, score) pairs in score order, walking the heap without popping it"""
+        scores, heap = self._zsets.get(name, ({}, []))
+        pending = [(heap[0], 0)] if heap else []
+        seen = set()
+        while pending:
+            (score, member), index = heapq.heappop(pending)
+            if score > max_score or (score == max_score and not max_inclusive):
+                break
+            if scores.get(member) == score and member not in seen:
+                seen.add(member)
+                yield member, score
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < len(heap):
+                    heapq.heappush(pending, (heap[child], child))
+
+    def zrangebyscore(self, name, min, max):
+        min_score, min_inclusive = self._bound(min)
+        max_score, max_inclusive = self._bound(max)
+        with self._lock:
+            return [member for member, score in self._in_order(name, max_score, max_inclusive)
+                    if score > min_score or (min_inclusive and score == min_score)]
+
+    def zrange(self, name, start, end, withscores=False):
+        with self._lock:
+            items = []
+            for item in self._in_order(name):
+                if end >= 0 and len(items) > end:
+                    break
+                items.append(item)
+            items = items[start:end + 1 if end >= 0 else None]
+            return items if withscores else [member for member, _ in items]
+
+class TrackingSessionSweeper:
+    """Greenlet that removes expired sessions, waking at the next expiry (or every max_interval seconds)"""
+
+    def __init__(self, store, name='tracking-session-sweeper'):
+        self.store = store
+        self.name = name
+        self.app = None
+        self.max_interval = 60.0
+        self.min_interval = 1.0
+        self._greenlet = None
+        self.swept = 0
+
+    @property
+    def running(self):
+        """Whether the sweeper greenlet is active"""
+        return self._greenlet is not None and not self._greenlet.dead
+
+    def init_app(self, app, max_interval_seconds=60):
+        """Bind to an app and start sweeping"""
+        self.app = app
+        self.max_interval = max_interval_seconds
+        self._greenlet = gevent.spawn(self._run)
+
+    def _run(self):
+        """Sweeper loop (first sweep after one interval, once the tables exist)"""
+        delay = self.max_interval
+        while True:
+            gevent.sleep(min(max(delay, self.min_interval), self.max_interval))
+            delay = self.max_interval
+            try:
+                with self.app.app_context():
+                    self.swept += self.store.sweep()
+                    next_expiry = self.store.next_expiry()
+                if next_expiry is not None:
+                    # Sessions created meanwhile are still caught within max_interval
+                    delay = (next_expiry - datetime.utcnow()).total_seconds()
+            except Exception as e:
+                print(f"Error in {self.name}: {str(e)}")
+
+def create_tracking_session_store(backend, redis_url=None):
+    """Store for TRACKING_SESSION_BACKEND: 'sql', 'redis' (needs the redis package) or 'local'"""
+    if backend == 'sql':
+        return SqlTrackingSessionStore()
+    if backend == 'local':
+        return KeyValueTrackingSessionStore(LocalKeyValueClient())
+    if backend == 'redis':
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('TRACKING_SESSION_BACKEND=redis requires the redis package (pip install redis)')
+        return KeyValueTrackingSessionStore(redis.Redis.from_url(redis_url, decode_responses=True))
+    raise ValueError(f'Unknown tracking session backend: {backend}')
+
+# Backend per TRACKING_SESSION_BACKEND; the sweeper is started by app.py
+tracking_sessions = create_tracking_session_store(
+    active_config.TRACKING_SESSION_BACKEND,
+    active_config.TRACKING_SESSION_REDIS_URL
+)
+tracking_session_sweeper = TrackingSessionSweeper(tracking_sessions)
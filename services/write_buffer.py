@@ -0,0 +1,177 @@
+"""
+Write-behind buffer for batching database inserts off the request path
+"""
+
+import atexit
+import time
+import gevent
+from gevent.queue import Queue, Empty
+
+class WriteBufferFull(Exception):
+    """Raised when the buffer has no room for a batch (backpressure)"""
+
+class WriteBehindBuffer:
+    """Bounded in-process queue drained by a flusher greenlet
+
+    Rows are accepted immediately and committed in groups by ``flush_func``
+    every ``flush_interval_ms`` or once ``batch_size`` rows have accumulated,
+    whichever comes first. A failed flush is retried with exponential backoff
+    (the client was already told the rows were accepted); rows count as
+    failed only after ``max_retries`` retries.
+    """
+
+    def __init__(self, flush_func, name='write-buffer'):
+        self.flush_func = flush_func
+        self.name = name
+        self.app = None
+        self.batch_size = 500
+        self.flush_interval = 0.2
+        self.max_retries = 5
+        self.retry_backoff = 0.2
+        self.max_retry_backoff = 5.0
+        self._queue = None
+        self._greenlet = None
+        self._stopping = False
+
+        # Counters exposed through stats()
+        self._enqueued_rows = 0
+        self._rejected_rows = 0
+        self._flushed_rows = 0
+        self._failed_rows = 0
+        self._retries = 0
+        self._flushes = 0
+        self._last_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    @property
+    def running(self):
+        """Whether the flusher greenlet is active"""
+        return self._greenlet is not None and not self._greenlet.dead
+
+    def init_app(self, app, queue_size=10000, batch_size=500, flush_interval_ms=200, max_retries=5,
+                 retry_backoff_ms=200):
+        """Bind the buffer to an app and start the flusher greenlet"""
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff_ms / 1000.0
+        self._queue = Queue(maxsize=queue_size)
+        self._stopping = False
+        self._greenlet = gevent.spawn(self._run)
+
+        # Drain whatever is still queued when the process exits
+        atexit.register(self.drain)
+
+    def enqueue(self, rows):
+        """Queue rows for the next group commit
+
+        Raises WriteBufferFull if the whole batch does not fit, so callers can
+        push back on the client instead of growing memory without bound.
+        """
+        if not self.running or self._stopping:
+            raise RuntimeError(f'{self.name} is not running')
+
+        if self._queue.maxsize - self._queue.qsize() < len(rows):
+            self._rejected_rows += len(rows)
+            raise WriteBufferFull(f'{self.name} is full')
+
+        # put_nowait never yields, so the capacity check above cannot go stale
+        for row in rows:
+            self._queue.put_nowait(row)
+
+        self._enqueued_rows += len(rows)
+        return len(rows)
+
+    def _collect_batch(self, batch):
+        """Wait for rows until the batch is full or the flush interval elapses"""
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except Empty:
+                break
+
+    def _run(self):
+        """Flusher loop"""
+        batch = []
+        try:
+            while not self._stopping:
+                try:
+                    batch.append(self._queue.get(timeout=1.0))
+                except Empty:
+                    continue
+
+                self._collect_batch(batch)
+                self._flush(batch)
+                batch = []
+        finally:
+            # Rows already pulled off the queue must not be lost on kill
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch):
+        """Commit a batch in one transaction, retrying with backoff, and record its latency"""
+        started = time.monotonic()
+        for attempt in range(self.max_retries + 1):
+            try:
+                # A fresh app context per attempt, so each retry starts on a clean session
+                with self.app.app_context():
+                    self.flush_func(batch)
+                self._flushed_rows += len(batch)
+                break
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self._failed_rows += len(batch)
+                    print(f"Error flushing {self.name} ({len(batch)} rows, giving up): {str(e)}")
+                    break
+                self._retries += 1
+                print(f"Error flushing {self.name} ({len(batch)} rows, retrying): {str(e)}")
+                gevent.sleep(min(self.retry_backoff * 2 ** attempt, self.max_retry_backoff))
+
+        elapsed_ms = (time.monotonic() - started) * 1000
+        self._flushes += 1
+        self._last_flush_ms = elapsed_ms
+        self._total_flush_ms += elapsed_ms
+        self._max_flush_ms = max(self._max_flush_ms, elapsed_ms)
+
+    def drain(self):
+        """Stop the flusher and synchronously commit everything still queued"""
+        if self._queue is None:
+            return
+
+        # Let the flusher finish its current batch and notice the stop flag
+        self._stopping = True
+        if self._greenlet is not None:
+            self._greenlet.join(timeout=5)
+            if not self._greenlet.dead:
+                self._greenlet.kill(block=True)
+
+        while not self._queue.empty():
+            batch = []
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            self._flush(batch)
+
+    def stats(self):
+        """Queue depth and flush latency figures for tuning"""
+        return {
+            'running': self.running,
+            'queue_depth': self._queue.qsize() if self._queue is not None else 0,
+            'queue_capacity': self._queue.maxsize if self._queue is not None else 0,
+            'batch_size': self.batch_size,
+            'flush_interval_ms': self.flush_interval * 1000,
+            'enqueued_rows': self._enqueued_rows,
+            'rejected_rows': self._rejected_rows,
+            'flushed_rows': self._flushed_rows,
+            'failed_rows': self._failed_rows,
+            'retries': self._retries,
+            'flushes': self._flushes,
+            'last_flush_ms': round(self._last_flush_ms, 3),
+            'avg_flush_ms': round(self._total_flush_ms / self._flushes, 3) if self._flushes else 0.0,
+            'max_flush_ms': round(self._max_flush_ms, 3)
+        }
@@ -150,15 +150,18 @@ function updatePlaces() {
         return;
     }
     
-    // For each active filter, fetch and display places
-    activeFilters.forEach(function(type) {
-        fetchNearbyPlaces(type);
-    });
+    // If no active filters, nothing to show
+    if (activeFilters.length === 0) {
+        return;
+    }
+    
+    // Fetch and display places for all active filters in one request
+    fetchNearbyPlaces(activeFilters);
 }
 
-function fetchNearbyPlaces(type) {
+function fetchNearbyPlaces(types) {
     // Fetch nearby places from server
-    fetch(`/map/nearby-places?latitude=${userLocation.lat}&longitude=${userLocation.lng}&type=${type}`)
+    fetch(`/map/nearby-places?latitude=${userLocation.lat}&longitude=${userLocation.lng}&type=${types.join(',')}`)
         .then(response => response.json())
         .then(data => {
             // Add places to map
@@ -259,6 +262,76 @@ function saveLocationToServer() {
     });
 }
 
+// Buffered fixes waiting to be sent to /map/save-locations
+let pendingFixes = [];
+let flushTimer = null;
+const FIX_BATCH_SIZE = 30;
+const FIX_FLUSH_INTERVAL_MS = 60000;
+const MAX_PENDING_FIXES = 100;  // Matches LOCATION_BATCH_MAX_SIZE on the server
+
+function queueLocationFix(position) {
+    pendingFixes.push({
+        latitude: position.coords.latitude,
+        longitude: position.coords.longitude,
+        accuracy: position.coords.accuracy,
+        altitude: position.coords.altitude,
+        speed: position.coords.speed,
+        heading: position.coords.heading,
+        timestamp: position.timestamp
+    });
+    
+    if (pendingFixes.length >= FIX_BATCH_SIZE) {
+        flushLocationFixes();
+    } else if (!flushTimer) {
+        flushTimer = setTimeout(flushLocationFixes, FIX_FLUSH_INTERVAL_MS);
+    }
+}
+
+function flushLocationFixes() {
+    if (flushTimer) {
+        clearTimeout(flushTimer);
+        flushTimer = null;
+    }
+    
+    if (pendingFixes.length === 0) {
+        return;
+    }
+    
+    const batch = pendingFixes.splice(0, MAX_PENDING_FIXES);
+    
+    fetch('/map/save-locations', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({ locations: batch })
+    })
+    .then(response => {
+        // Re-queue the batch on server errors so fixes are not lost
+        if (response.status >= 500) {
+            pendingFixes = batch.concat(pendingFixes).slice(-MAX_PENDING_FIXES);
+        }
+        return response.json();
+    })
+    .then(data => {
+        console.log('Locations saved:', data);
+    })
+    .catch(error => {
+        console.error('Error saving locations:', error);
+        pendingFixes = batch.concat(pendingFixes).slice(-MAX_PENDING_FIXES);
+    });
+}
+
+// Flush remaining fixes when the page is hidden or closed
+window.addEventListener('pagehide', function() {
+    if (pendingFixes.length > 0 && navigator.sendBeacon) {
+        const blob = new Blob([JSON.stringify({ locations: pendingFixes.slice(-MAX_PENDING_FIXES) })], { type: 'application/json' });
+        if (navigator.sendBeacon('/map/save-locations', blob)) {
+            pendingFixes = [];
+        }
+    }
+});
+
 function generateShareLink() {
     // Get share duration
     const duration = document.getElementById('share-duration').value;
@@ -352,8 +425,8 @@ function startLocationWatching() {
             // Update user's location on map
             updateUserLocation();
             
-            // Save location to server
-            saveLocationToServer();
+            // Buffer the fix and flush to the server in batches
+            queueLocationFix(position);
         }, function(error) {
             console.error('Error watching location:', error);
         }, {
@@ -0,0 +1,122 @@
+"""
+Geohash encoding and prefix covers for spatial range scans
+"""
+
+from math import cos, radians
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_DECODE = {char: index for index, char in enumerate(BASE32)}
+
+# Sorts after every base32 character, so prefix <= h < prefix + PREFIX_END
+PREFIX_END = '{'
+
+def encode(latitude, longitude, precision=9):
+    """Encode a coordinate as a geohash string of the given length"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True  # Bits alternate longitude, latitude, starting with longitude
+
+    while len(chars) < precision:
+        rng, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (rng[0] + rng[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            rng[0] = middle
+        else:
+            rng[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+
+    return ''.join(chars)
+
+def encode_or_none(latitude, longitude, precision=9):
+    """Encode when both coordinates are usable numbers, otherwise None"""
+    try:
+        latitude = float(latitude)
+        longitude = float(longitude)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    return encode(latitude, longitude, precision)
+
+def decode_bbox(geohash):
+    """Bounding box (min_lat, min_lon, max_lat, max_lon) of a geohash cell"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+
+    for char in geohash:
+        value = _DECODE[char]
+        for shift in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            middle = (rng[0] + rng[1]) / 2
+            if (value >> shift) & 1:
+                rng[0] = middle
+            else:
+                rng[1] = middle
+            even = not even
+
+    return lat_range[0], lon_range[0], lat_range[1], lon_range[1]
+
+def cell_size(precision):
+    """Cell height and width in degrees at a precision"""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+def cover_bbox(min_lat, min_lon, max_lat, max_lon, max_cells=16, max_precision=9):
+    """Smallest set of same-length geohash prefixes covering a bounding box
+
+    Chooses the finest precision whose cover has at most max_cells cells, so a
+    query turns into a handful of prefix range scans. Boxes crossing the
+    antimeridian are not split; callers pass boxes within [-180, 180].
+    """
+    min_lat, max_lat = max(min_lat, -90.0), min(max_lat, 90.0)
+    min_lon, max_lon = max(min_lon, -180.0), min(max_lon, 180.0)
+
+    best = None
+    for precision in range(1, max_precision + 1):
+        height, width = cell_size(precision)
+        rows = int(max_lat // height) - int(min_lat // height) + 1
+        columns = int(max_lon // width) - int(min_lon // width) + 1
+        if rows * columns > max_cells:
+            break
+        best = precision
+
+    if best is None:
+        best = 1
+
+    height, width = cell_size(best)
+    prefixes = set()
+    lat = min_lat
+    while True:
+        lon = min_lon
+        while True:
+            prefixes.add(encode(min(lat, max_lat), min(lon, max_lon), best))
+            if lon >= max_lon:
+                break
+            lon = min(lon + width, max_lon)
+        if lat >= max_lat:
+            break
+        lat = min(lat + height, max_lat)
+
+    return sorted(prefixes)
+
+def radius_bbox(latitude, longitude, radius):
+    """Bounding box of a circle of radius meters around a point"""
+    dlat = radius / 111320.0
+    dlon = radius / (111320.0 * max(cos(radians(latitude)), 0.01))
+    return latitude - dlat, longitude - dlon, latitude + dlat, longitude + dlon
+
+def cover_radius(latitude, longitude, radius, max_cells=16, max_precision=9):
+    """Geohash prefixes covering a circle of radius meters"""
+    return cover_bbox(*radius_bbox(latitude, longitude, radius), max_cells=max_cells, max_precision=max_precision)
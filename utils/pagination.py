@@ -0,0 +1,67 @@
+"""
+Keyset (cursor) pagination helpers
+"""
+
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+def clamp_limit(limit, maximum, default=10):
+    """Page size within 1..maximum (default when missing)"""
+    if limit is None:
+        limit = default
+    return max(1, min(limit, maximum))
+
+def encode_cursor(timestamp, row_id=None, kind=None):
+    """Encode a (timestamp, id) position as an opaque URL-safe cursor
+
+    kind tags cursors whose second value is not a row id (e.g. 'skip'), so
+    decode_cursor can reject a cursor issued by a different pagination scheme.
+    """
+    position = [timestamp.isoformat(), row_id]
+    if kind is not None:
+        position.append(kind)
+    payload = json.dumps(position, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, kind=None):
+    """Decode a cursor produced by encode_cursor with the same kind into (timestamp, id)
+
+    Raises ValueError for malformed cursors and cursors of another kind.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        timestamp, row_id = position[:2]
+        cursor_kind = position[2] if len(position) > 2 else None
+        timestamp = datetime.fromisoformat(timestamp)
+        if row_id is not None:
+            row_id = int(row_id)
+    except (TypeError, ValueError, KeyError, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError('Invalid cursor') from e
+    if cursor_kind != kind:
+        raise ValueError('Cursor is not valid for this listing')
+    return timestamp, row_id
+
+def seek_before(time_column, id_column, timestamp, row_id):
+    """Filter for rows strictly after the cursor in (time DESC, id DESC) order
+
+    The leading `time <= timestamp` range lets the (user_id, time, id) index
+    seek directly to the cursor instead of scanning earlier pages.
+    """
+    if row_id is None:
+        return time_column < timestamp
+    return and_(
+        time_column <= timestamp,
+        or_(time_column < timestamp, id_column < row_id)
+    )
+
+def seek_after(time_column, id_column, timestamp, row_id):
+    """Filter for rows strictly after the position in (time ASC, id ASC) order"""
+    if row_id is None:
+        return time_column > timestamp
+    return and_(
+        time_column >= timestamp,
+        or_(time_column > timestamp, id_column > row_id)
+    )
@@ -0,0 +1,57 @@
+"""
+Request coalescing for concurrent identical calls
+"""
+
+import gevent
+from gevent.event import AsyncResult
+
+class SingleFlight:
+    """Run at most one call per key at a time; concurrent callers share its outcome
+
+    The first caller for a key (the leader) runs the function. Greenlets that
+    ask for the same key while it is in flight wait on the leader's
+    AsyncResult and receive the same return value or exception. Nothing is
+    kept once the call finishes, so this complements caches, not replaces them.
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self._calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, func, *args, **kwargs):
+        """Call func(*args, **kwargs), or wait for the identical call already running"""
+        call = self._calls.get(key)
+        if call is not None:
+            self.coalesced += 1
+            try:
+                return call.get(timeout=self.timeout)
+            except gevent.Timeout:
+                raise TimeoutError(f'Timed out waiting for in-flight call {key!r}')
+
+        call = AsyncResult()
+        self._calls[key] = call
+        self.leaders += 1
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            call.set_exception(e)
+            raise
+        except BaseException:
+            # Leader was killed (e.g. GreenletExit); release the waiters with an error
+            call.set_exception(RuntimeError(f'In-flight call {key!r} was interrupted'))
+            raise
+        else:
+            call.set(result)
+            return result
+        finally:
+            del self._calls[key]
+
+    def stats(self):
+        """Calls made versus calls served by an in-flight leader"""
+        return {
+            'in_flight': len(self._calls),
+            'leaders': self.leaders,
+            'coalesced': self.coalesced
+        }
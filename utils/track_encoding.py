@@ -0,0 +1,122 @@
+"""
+Compact binary encoding for runs of location fixes
+
+Each fix is stored as a flags byte followed by varints: the millisecond
+timestamp delta and the zigzagged latitude/longitude deltas (1e-6 degree
+units) from the previous fix, then any optional fields flagged as present.
+A stationary or slowly moving device costs roughly 6-10 bytes per fix.
+"""
+
+from datetime import datetime, timedelta
+
+COORDINATE_SCALE = 1000000  # 1e-6 degrees, about 11 cm
+
+# Optional fields: (flag bit, key, scale)
+OPTIONAL_FIELDS = (
+    (0x01, 'accuracy', 10),   # decimeters
+    (0x02, 'altitude', 10),   # decimeters
+    (0x04, 'speed', 100),     # cm/s
+    (0x08, 'heading', 10)     # tenths of a degree
+)
+
+EPOCH = datetime(1970, 1, 1)
+
+def to_millis(timestamp):
+    """Naive UTC datetime to epoch milliseconds"""
+    return (timestamp - EPOCH) // timedelta(milliseconds=1)
+
+def from_millis(millis):
+    """Epoch milliseconds to naive UTC datetime"""
+    return EPOCH + timedelta(milliseconds=millis)
+
+def to_e6(value):
+    """Degrees to integer micro-degrees"""
+    return int(round(value * COORDINATE_SCALE))
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+def _unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+def _write_varint(out, value):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def _read_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+def encode_points(points, last_millis, last_lat_e6, last_lon_e6):
+    """Encode points (dicts sorted by timestamp) relative to the given previous state
+
+    Returns (bytes, (last_millis, last_lat_e6, last_lon_e6)) so further points
+    can be appended to the same blob without re-encoding it.
+    """
+    out = bytearray()
+
+    for point in points:
+        millis = to_millis(point['timestamp'])
+        lat_e6 = to_e6(point['latitude'])
+        lon_e6 = to_e6(point['longitude'])
+
+        flags = 0
+        extras = []
+        for bit, key, scale in OPTIONAL_FIELDS:
+            value = point.get(key)
+            if value is not None:
+                flags |= bit
+                extras.append(int(round(value * scale)))
+
+        out.append(flags)
+        _write_varint(out, _zigzag(millis - last_millis))
+        _write_varint(out, _zigzag(lat_e6 - last_lat_e6))
+        _write_varint(out, _zigzag(lon_e6 - last_lon_e6))
+        for value in extras:
+            _write_varint(out, _zigzag(value))
+
+        last_millis, last_lat_e6, last_lon_e6 = millis, lat_e6, lon_e6
+
+    return bytes(out), (last_millis, last_lat_e6, last_lon_e6)
+
+def decode_points(data, base_millis, base_lat_e6=0, base_lon_e6=0):
+    """Decode a blob produced by encode_points back into point dicts"""
+    points = []
+    pos = 0
+    millis, lat_e6, lon_e6 = base_millis, base_lat_e6, base_lon_e6
+
+    while pos < len(data):
+        flags = data[pos]
+        pos += 1
+
+        delta, pos = _read_varint(data, pos)
+        millis += _unzigzag(delta)
+        delta, pos = _read_varint(data, pos)
+        lat_e6 += _unzigzag(delta)
+        delta, pos = _read_varint(data, pos)
+        lon_e6 += _unzigzag(delta)
+
+        point = {
+            'latitude': lat_e6 / COORDINATE_SCALE,
+            'longitude': lon_e6 / COORDINATE_SCALE,
+            'timestamp': from_millis(millis)
+        }
+        for bit, key, scale in OPTIONAL_FIELDS:
+            if flags & bit:
+                value, pos = _read_varint(data, pos)
+                point[key] = _unzigzag(value) / scale
+            else:
+                point[key] = None
+
+        points.append(point)
+
+    return points
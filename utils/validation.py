@@ -115,7 +115,7 @@ def validate_location_data(location_data):
     # Latitude validation
     try:
         lat = float(location_data['latitude'])
-        if lat < -90 or lat > 90:
+        if not -90 <= lat <= 90:  # Also rejects NaN
             errors['latitude'] = "Latitude must be between -90 and 90"
     except (ValueError, TypeError):
         errors['latitude'] = "Latitude must be a valid number"
@@ -123,7 +123,7 @@ def validate_location_data(location_data):
     # Longitude validation
     try:
         lon = float(location_data['longitude'])
-        if lon < -180 or lon > 180:
+        if not -180 <= lon <= 180:
             errors['longitude'] = "Longitude must be between -180 and 180"
     except (ValueError, TypeError):
         errors['longitude'] = "Longitude must be a valid number"